@@ -0,0 +1,166 @@
+"""
+Maintain the denormalized activity counters and read state of conversations.
+
+`Conversation.last_message_at`, `last_message` and `message_count` save
+a MAX and a COUNT over the messages of each conversation. The helpers
+here must run inside the transaction that writes the messages, so the
+counters commit or roll back together with them.
+
+Every change also bumps `Conversation.version` and `updated_at`, and
+every watermark move `ConversationParticipant.read_version`; chats.etags
+derives the ETags of the API lists from them.
+
+Read state is one watermark per participant, so reading or receiving a
+message never writes more than the reader's own membership row; unread
+counts are range counts on the (conversation, sent_at, message_id) index.
+"""
+from datetime import datetime, timezone
+
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    When
+)
+from django.db.models.functions import Coalesce
+
+from .models import Conversation, ConversationParticipant, Message
+
+# Stands in for a missing read watermark: older than every message.
+NEVER = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def record_messages(conversation_id, last_message, count=1):
+    """
+    Count `count` new messages in a conversation.
+
+    `last_message` is the newest of them; it only replaces the current
+    last message if it is not older, so concurrent writers committing
+    out of order cannot move the pointer backwards.
+    """
+    is_newer = (
+        Q(last_message_at__isnull=True) |
+        Q(last_message_at__lte=last_message.sent_at)
+    )
+    Conversation.objects.filter(pk=conversation_id).update(
+        message_count=F('message_count') + count,
+        version=F('version') + 1,
+        updated_at=datetime.now(timezone.utc),
+        last_message_at=Case(
+            When(is_newer, then=last_message.sent_at),
+            default=F('last_message_at'),
+        ),
+        last_message_id=Case(
+            When(is_newer, then=last_message.pk),
+            default=F('last_message_id'),
+        ),
+    )
+
+
+def record_message_deleted(conversation_id):
+    """Decrement the count and re-read the last message after a delete."""
+    latest = latest_message(OuterRef('pk'))
+    Conversation.objects.filter(pk=conversation_id).update(
+        message_count=Case(
+            When(message_count__gt=0, then=F('message_count') - 1),
+            default=0,
+        ),
+        version=F('version') + 1,
+        updated_at=datetime.now(timezone.utc),
+        last_message_at=Subquery(latest.values('sent_at')[:1]),
+        last_message_id=Subquery(latest.values('message_id')[:1]),
+    )
+
+
+def rebuild_counters(conversations=None):
+    """Recompute the counters of `conversations` (default: all) anew."""
+    if conversations is None:
+        conversations = Conversation.objects.all()
+    latest = latest_message(OuterRef('pk'))
+    counts = Message.objects.filter(
+        conversation_id=OuterRef('pk')
+    ).order_by().values('conversation_id').annotate(
+        count=Count('*')
+    ).values('count')
+    return conversations.update(
+        message_count=Coalesce(Subquery(counts), 0),
+        version=F('version') + 1,
+        updated_at=datetime.now(timezone.utc),
+        last_message_at=Subquery(latest.values('sent_at')[:1]),
+        last_message_id=Subquery(latest.values('message_id')[:1]),
+    )
+
+
+def record_conversations_changed(conversation_ids):
+    """Bump the version of conversations changed other than by a message."""
+    Conversation.objects.filter(pk__in=conversation_ids).update(
+        version=F('version') + 1,
+        updated_at=datetime.now(timezone.utc),
+    )
+
+
+def latest_message(conversation_id):
+    """Return the messages of a conversation, newest first."""
+    return Message.objects.filter(
+        conversation_id=conversation_id
+    ).order_by('-sent_at', '-message_id')
+
+
+def advance_read_watermark(conversation_id, user_id, sent_at, message_id):
+    """
+    Move a participant's read watermark forward to a message.
+
+    The watermark never moves backwards. Return True if it moved.
+    """
+    is_behind = (
+        Q(last_read_at__isnull=True) |
+        Q(last_read_at__lt=sent_at) |
+        Q(last_read_at=sent_at, last_read_message_id__lt=message_id)
+    )
+    return bool(ConversationParticipant.objects.filter(
+        is_behind, conversation_id=conversation_id, user_id=user_id
+    ).update(
+        last_read_at=sent_at, last_read_message_id=message_id,
+        read_version=F('read_version') + 1,
+    ))
+
+
+def unread_messages(conversation_id, read_at, read_message_id):
+    """
+    Return the messages of a conversation after a read watermark.
+
+    The arguments are either values or `OuterRef`s into an enclosing
+    query; a missing watermark means nothing has been read yet. The
+    filter is written as a `sent_at` range minus the watermark's own
+    tie, so it stays a range scan on the composite message index.
+    """
+    messages = Message.objects.filter(conversation_id=conversation_id)
+    if read_at is None:
+        return messages
+    if isinstance(read_at, OuterRef):
+        read_at = Coalesce(read_at, Value(NEVER))
+    return messages.filter(sent_at__gte=read_at).exclude(
+        sent_at=read_at, message_id__lte=read_message_id)
+
+
+def annotate_unread_counts(conversations, user):
+    """
+    Restrict `conversations` to the user's and annotate their unread counts.
+
+    The watermark is read from the membership row joined by the filter,
+    so the whole inbox is counted by a single query.
+    """
+    unread = unread_messages(
+        OuterRef('pk'), OuterRef('last_read_at'),
+        OuterRef('last_read_message_id')
+    ).order_by().values('conversation_id').annotate(
+        count=Count('*')
+    ).values('count')
+    return conversations.filter(memberships__user=user).annotate(
+        last_read_at=F('memberships__last_read_at'),
+        last_read_message_id=F('memberships__last_read_message_id'),
+    ).annotate(unread_count=Coalesce(Subquery(unread), 0))
@@ -1,3 +1,58 @@
-# messaging_app/chats/auth.py
-# This file can be used for custom authentication backends or JWT serializer customizations.
-# For this task, it serves as a placeholder.
+"""
+Authentication classes for the chat app.
+
+`CachedJWTAuthentication` is the default scheme of the API. Verifying a
+JWT is an HMAC instead of the PBKDF2 hash Basic auth pays on every call,
+and the verified tokens and their users are cached per process so the
+common request does neither the signature check nor a user query.
+"""
+import copy
+import time
+
+from django.conf import settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from .lru import LRUCache
+
+# Raw token -> validated token, kept until the token expires.
+verified_tokens = LRUCache(
+    getattr(settings, 'CHATS_AUTH_TOKEN_CACHE_SIZE', 10000)
+)
+
+# User id -> user, kept for CHATS_AUTH_USER_CACHE_TTL seconds and dropped
+# when the user is saved or deleted in this process.
+cached_users = LRUCache(
+    getattr(settings, 'CHATS_AUTH_USER_CACHE_SIZE', 10000)
+)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication with bounded caches of verified tokens and users.
+
+    A token seen before is trusted until its `exp` claim without checking
+    its signature again, and its user is served from memory for a short
+    time instead of being read from the database.
+    """
+
+    def get_validated_token(self, raw_token):
+        """Return the validated token, verifying it only once."""
+        token = verified_tokens.get(raw_token)
+        if token is not None:
+            return token
+
+        token = super().get_validated_token(raw_token)
+        verified_tokens.set(raw_token, token, expires_at=token.get('exp'))
+        return token
+
+    def get_user(self, validated_token):
+        """Return the token's user, from memory when possible."""
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        user = cached_users.get(user_id)
+        if user is None:
+            user = super().get_user(validated_token)
+            ttl = getattr(settings, 'CHATS_AUTH_USER_CACHE_TTL', 60)
+            cached_users.set(user_id, user, expires_at=time.time() + ttl)
+        # Each request gets its own copy to modify.
+        return copy.copy(user)
@@ -0,0 +1,247 @@
+"""
+Relay chat events between server processes over a Unix domain socket.
+
+`Broker` is a small asyncio server (run it with `manage.py
+run_event_broker`) that forwards every batch of events a worker sends to
+all the other connected workers. `BrokerClient` is the worker side: it
+runs on its own thread, sends published events in batches and hands the
+events of the other workers to a callback.
+
+Frames are a 4-byte big-endian length followed by a JSON list of
+`[conversation_id, encoded_event]` pairs. Events accumulate while the
+previous frame is being written, so batches grow with the load. Each
+connection has a bounded backlog: the broker disconnects a worker that
+cannot keep up rather than buffering for it, and the worker resyncs its
+clients when it reconnects. A worker whose own backlog overflows drops
+it and sends `MISSED_EVENT` instead, which makes the other workers
+resync their clients. Nothing here depends on Django.
+"""
+import asyncio
+import json
+import logging
+import os
+import struct
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>I')
+
+# Sent in place of events a worker had to drop.
+MISSED_EVENT = [None, None]
+
+
+def encode_frame(events):
+    """Return the frame carrying a list of `[conversation_id, data]`."""
+    payload = json.dumps(events, separators=(',', ':')).encode()
+    return HEADER.pack(len(payload)) + payload
+
+
+async def read_frame(reader):
+    """Read one frame and return its events."""
+    header = await reader.readexactly(HEADER.size)
+    (length,) = HEADER.unpack(header)
+    return json.loads(await reader.readexactly(length))
+
+
+class BacklogFull(Exception):
+    """A connection has more events waiting than it may hold."""
+
+
+class EventBacklog:
+    """Bounded queue of events waiting to be written to one socket."""
+
+    def __init__(self, max_events):
+        """Create an empty backlog of at most `max_events` events."""
+        self.max_events = max_events
+        self._events = deque()
+        self._ready = asyncio.Event()
+
+    def __len__(self):
+        """Return the number of waiting events."""
+        return len(self._events)
+
+    def extend(self, events):
+        """Queue events, or raise BacklogFull if there is no room."""
+        if len(self._events) + len(events) > self.max_events:
+            raise BacklogFull
+        self._events.extend(events)
+        self._ready.set()
+
+    def clear(self):
+        """Drop every waiting event."""
+        self._events.clear()
+
+    async def take(self, batch_size):
+        """Wait for events and return up to `batch_size` of them."""
+        while not self._events:
+            self._ready.clear()
+            await self._ready.wait()
+        count = min(batch_size, len(self._events))
+        return [self._events.popleft() for _ in range(count)]
+
+
+async def write_batches(backlog, writer, batch_size):
+    """Write the backlog to `writer` as it fills, one frame per batch."""
+    while True:
+        writer.write(encode_frame(await backlog.take(batch_size)))
+        # Waits while the socket buffer is full: the backlog grows instead.
+        await writer.drain()
+
+
+class Broker:
+    """Forward event batches between the workers connected to a socket."""
+
+    def __init__(self, path, max_backlog=10000, batch_size=500):
+        """Create a broker listening on the Unix socket at `path`."""
+        self.path = path
+        self.max_backlog = max_backlog
+        self.batch_size = batch_size
+        self.connections = {}
+
+    async def serve(self, started=None):
+        """Listen until cancelled; set `started` once accepting."""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self.handle, self.path)
+        if started is not None:
+            started.set()
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        """Relay the batches of one worker and feed it the others'."""
+        backlog = EventBacklog(self.max_backlog)
+        self.connections[writer] = backlog
+        sender = asyncio.create_task(
+            write_batches(backlog, writer, self.batch_size))
+        try:
+            while True:
+                self.forward(writer, await read_frame(reader))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections.pop(writer, None)
+            sender.cancel()
+            writer.close()
+
+    def forward(self, origin, events):
+        """Queue events for every connection but `origin`."""
+        for writer, backlog in list(self.connections.items()):
+            if writer is origin:
+                continue
+            try:
+                backlog.extend(events)
+            except BacklogFull:
+                logger.warning("Dropping slow event broker consumer.")
+                del self.connections[writer]
+                writer.close()
+
+
+class BrokerClient:
+    """
+    A worker's connection to the broker, run on a background thread.
+
+    `publish` may be called from any thread. Received events are passed
+    to `on_events` on the client thread. `on_missed` is called there when
+    events of the other workers may have been missed: after a lost
+    connection is restored, and when another worker dropped events.
+    """
+
+    def __init__(self, path, on_events, on_missed=None,
+                 max_backlog=10000, batch_size=500, retry_delay=0.5):
+        """Create a client for the broker listening at `path`."""
+        self.path = path
+        self.on_events = on_events
+        self.on_missed = on_missed
+        self.max_backlog = max_backlog
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.dropped = 0
+        self.connected = threading.Event()
+        self._loop = asyncio.new_event_loop()
+        self._backlog = EventBacklog(max_backlog)
+        self._task = self._loop.create_task(self._run())
+        self._thread = threading.Thread(
+            target=self._main, name='chats-event-broker', daemon=True)
+
+    def start(self):
+        """Start connecting in the background."""
+        self._thread.start()
+
+    def close(self):
+        """Stop the client thread."""
+        self._loop.call_soon_threadsafe(self._task.cancel)
+        self._thread.join()
+
+    def _main(self):
+        """Run the client's event loop until `close`."""
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    @property
+    def pending(self):
+        """Return the number of events not yet written to the broker."""
+        return len(self._backlog)
+
+    def publish(self, conversation_id, data):
+        """Send an encoded event of a conversation to the other workers."""
+        self._loop.call_soon_threadsafe(
+            self._queue, [str(conversation_id), data])
+
+    def _queue(self, event):
+        """
+        Queue an event on the client thread.
+
+        When there is no room, the backlog is dropped along with the event
+        and replaced by `MISSED_EVENT`, so the other workers resync their
+        clients instead of silently missing events.
+        """
+        try:
+            self._backlog.extend([event])
+        except BacklogFull:
+            dropped = len(self._backlog) + 1
+            logger.warning(
+                "Event broker backlog full: dropping %d events and asking "
+                "the other workers to resync.", dropped)
+            self.dropped += dropped
+            self._backlog.clear()
+            self._backlog.extend([MISSED_EVENT])
+
+    def _receive(self, events):
+        """Pass received events on, calling `on_missed` for dropped ones."""
+        if MISSED_EVENT in events:
+            events = [event for event in events if event != MISSED_EVENT]
+            if self.on_missed is not None:
+                self.on_missed()
+        if events:
+            self.on_events(events)
+
+    async def _run(self):
+        """Keep a connection to the broker open until cancelled."""
+        lost = False
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(self.retry_delay)
+                continue
+            if lost and self.on_missed is not None:
+                self.on_missed()
+            self.connected.set()
+            sender = asyncio.create_task(
+                write_batches(self._backlog, writer, self.batch_size))
+            try:
+                while True:
+                    self._receive(await read_frame(reader))
+            except (asyncio.IncompleteReadError, ConnectionError):
+                lost = True
+            finally:
+                self.connected.clear()
+                sender.cancel()
+                writer.close()
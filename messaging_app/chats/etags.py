@@ -0,0 +1,153 @@
+"""
+Conditional GET for the list and retrieve endpoints of the chat app.
+
+ETags are built from version counters instead of from the rendered body:
+a conversation, its message list and its messages from
+`Conversation.version`, and a user's lists from an aggregate over their
+memberships (count, sum of the conversation versions and of the read
+watermark versions) plus their membership version. Checking
+`If-None-Match` therefore costs one indexed lookup, and a match is
+answered with 304 before the list is queried or serialized. Every ETag
+also carries the username epoch of `chats.responses`, replaced when a
+user is renamed. The same validators key the rendered responses kept by
+`chats.responses`, so a request the client cannot answer from its own
+copy is often served from the server's.
+"""
+import hashlib
+
+from django.db.models import Count, Sum
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .fragments import encoding_version
+from .models import Conversation, CustomUser
+from .responses import response_cache
+
+
+def make_etag(*parts):
+    """Return a weak ETag identifying `parts`."""
+    digest = hashlib.blake2b(
+        '|'.join(map(str, parts)).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def conversation_validators(conversation_id):
+    """Return the version and the last change time of a conversation."""
+    return Conversation.objects.filter(pk=conversation_id).values_list(
+        'version', 'updated_at').first() or (None, None)
+
+
+def user_version(user):
+    """Return a value that changes whenever any list of the user does."""
+    return CustomUser.objects.filter(pk=user.pk).values_list(
+        'pk', 'membership_version'
+    ).annotate(
+        count=Count('memberships'),
+        conversations=Sum('memberships__conversation__version'),
+        reads=Sum('memberships__read_version'),
+    ).first()
+
+
+class ConditionalResponseMixin:
+    """
+    Answer conditional requests from validators and cache the responses.
+
+    Sets `ETag` (and `Last-Modified` when the view knows it) and returns
+    304 Not Modified when the client's copy is current. Otherwise the
+    rendered response is served from `response_cache` when it holds it,
+    and stored there once rendered when it does not. The browsable API,
+    whose pages depend on more than the data, is never cached.
+    """
+
+    response_cache_key = None
+
+    def conditional_response(self, parts, last_modified, respond):
+        """Return 304, the cached response, or the response of `respond`."""
+        request = self.request
+        etag = make_etag(
+            request.accepted_renderer.format, request.get_full_path(),
+            response_cache.get_epoch(), *parts)
+        if last_modified is not None:
+            last_modified = int(last_modified.timestamp())
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = self.get_cached_response(etag)
+        if response is None:
+            response = respond()
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def get_cached_response(self, etag):
+        """Return the cached response matching `etag`, or None."""
+        request = self.request
+        if not response_cache.enabled() or (
+                request.accepted_renderer.format == 'api'):
+            return None
+        key = response_cache.make_key(
+            etag, request.user.pk, request.accepted_media_type,
+            encoding_version()
+        )
+        entry = response_cache.get(key)
+        if entry is None:
+            self.response_cache_key = key
+            return None
+        content, content_type = entry
+        return HttpResponse(content, content_type=content_type)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """Render and cache the response that missed the cache."""
+        response = super().finalize_response(
+            request, response, *args, **kwargs)
+        if self.response_cache_key is not None and isinstance(
+                response, Response) and response.status_code == 200:
+            response.render()
+            response_cache.set(
+                self.response_cache_key, response.content,
+                response['Content-Type']
+            )
+        return response
+
+
+class ConditionalListMixin(ConditionalResponseMixin):
+    """Answer `list` requests conditionally from `get_list_validators`."""
+
+    def get_list_validators(self):
+        """Return the version parts of the list and its change time."""
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        """Return 304 for an unchanged list, the list otherwise."""
+        parts, last_modified = self.get_list_validators()
+        respond = super().list
+        return self.conditional_response(
+            parts, last_modified, lambda: respond(request, *args, **kwargs))
+
+
+class ConditionalRetrieveMixin(ConditionalResponseMixin):
+    """Answer `retrieve` requests conditionally, when the view can."""
+
+    def get_retrieve_validators(self):
+        """
+        Return the version parts of the object and its change time.
+
+        Returns None, which serves the request normally, when the object
+        cannot be versioned without loading it, e.g. when it is missing
+        or hidden from the user.
+        """
+        return None
+
+    def retrieve(self, request, *args, **kwargs):
+        """Return 304 for an unchanged object, the object otherwise."""
+        validators = self.get_retrieve_validators()
+        if validators is None:
+            return super().retrieve(request, *args, **kwargs)
+        parts, last_modified = validators
+        respond = super().retrieve
+        return self.conditional_response(
+            parts, last_modified, lambda: respond(request, *args, **kwargs))
@@ -0,0 +1,108 @@
+"""
+Streaming exports of a conversation's whole history.
+
+`export_chunks` reads the messages oldest first in keyset batches on
+(sent_at, message_id), the order of the conversation's message index,
+each batch a single range scan read through `iterator(chunk_size=...)`
+and rendered by `MessageRows` like the message list. No query stays
+open between batches and only one chunk of rows is held at a time, so
+memory does not grow with the conversation and long downloads never pin
+a read transaction. The encoders turn the chunks into NDJSON (one
+message object per line) or CSV (a header, then one row per message).
+
+Django consumes a synchronous streaming iterator whole before serving it
+over ASGI; `aiterate` feeds it chunk by chunk from the request's sync
+thread instead.
+"""
+import csv
+import io
+
+from asgiref.sync import sync_to_async
+from rest_framework.negotiation import BaseContentNegotiation
+
+from .models import Message
+from .pagination import MessageCursorPagination
+from .renderers import encode_json
+from .rows import MessageRows
+
+# Messages read per keyset query, and rendered per chunk.
+EXPORT_BATCH_SIZE = 20000
+EXPORT_CHUNK_SIZE = 2000
+
+
+def export_chunks(conversation_id, batch_size=EXPORT_BATCH_SIZE,
+                  chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield lists of the serialized messages of a conversation, in order."""
+    message_rows = MessageRows()
+    ordering = MessageCursorPagination.ordering
+    keyset = MessageCursorPagination().get_keyset_filter
+    messages = Message.objects.filter(conversation_id=conversation_id)
+    position = None
+    while True:
+        batch = messages.order_by(*ordering)
+        if position is not None:
+            batch = batch.filter(keyset(position))
+        rows = message_rows.values(batch, *ordering)[:batch_size]
+        count, chunk = 0, []
+        for row in rows.iterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                count += len(chunk)
+                yield message_rows.serialize(chunk)
+                last, chunk = chunk[-1], []
+        if chunk:
+            count += len(chunk)
+            yield message_rows.serialize(chunk)
+            last = chunk[-1]
+        if count < batch_size:
+            return
+        message_rows.restore_keys([last])
+        position = tuple(last[key] for key in ordering)
+
+
+def encode_ndjson(chunks):
+    """Encode each chunk of messages as JSON lines."""
+    for chunk in chunks:
+        yield b''.join(encode_json(data) + b'\n' for data in chunk)
+
+
+def encode_csv(chunks):
+    """Encode the chunks of messages as CSV rows, after a header."""
+    fields = MessageRows().field_names
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fields)
+    writer.writeheader()
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+# Export types: (content type, file extension, encoder).
+EXPORT_TYPES = {
+    'ndjson': ('application/x-ndjson', 'ndjson', encode_ndjson),
+    'csv': ('text/csv; charset=utf-8', 'csv', encode_csv),
+}
+
+
+class ExportContentNegotiation(BaseContentNegotiation):
+    """Ignore the Accept header, as `?type=` chooses what is exported."""
+
+    def select_parser(self, request, parsers):
+        """Use the first parser."""
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        """Render errors with the first renderer."""
+        return renderers[0], renderers[0].media_type
+
+
+async def aiterate(iterable):
+    """Iterate over a synchronous iterable from the request's sync thread."""
+    iterator = iter(iterable)
+    step = sync_to_async(next, thread_sensitive=True)
+    while (item := await step(iterator, None)) is not None:
+        yield item
@@ -0,0 +1,114 @@
+"""
+Sparse fieldsets and nested message limits for the chat endpoints.
+
+`?fields=a,b` renders only the named fields of each object, and
+`?messages_limit=n` only the `n` latest messages of each conversation
+(oldest first, like the full list). The views build their querysets
+from the selection, so a field left out also skips the columns, joins,
+annotations and prefetches only it needs, e.g. the join to the sender
+for `sender_username` or the message query for `messages`.
+
+The full path is part of every ETag and cached response key, so
+responses with different selections are versioned and cached apart.
+"""
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from rest_framework import serializers
+
+from .pagination import MessageCursorPagination
+
+
+def latest_messages(messages, limit):
+    """Keep the `limit` latest of each conversation's `messages`."""
+    return messages.annotate(
+        position=Window(
+            RowNumber(), partition_by=F('conversation_id'),
+            order_by=(F('sent_at').desc(), F('message_id').desc())
+        )
+    ).filter(position__lte=limit).order_by('sent_at', 'message_id')
+
+
+class SparseFieldsMixin:
+    """
+    Read `?fields=` and `?messages_limit=` for a view.
+
+    Passes the requested fields to the serializer, whose class must
+    accept a `fields` argument
+    (`chats.serializers.SparseFieldsSerializerMixin`). Unknown fields and
+    limits that are not a number from 0 to `max_messages_limit` are
+    answered with 400, and so is a limit given to an action that renders
+    no nested messages.
+    """
+
+    fields_query_param = 'fields'
+    messages_limit_query_param = 'messages_limit'
+    max_messages_limit = MessageCursorPagination.max_page_size
+
+    def initial(self, request, *args, **kwargs):
+        """Validate `?messages_limit=` before the action runs."""
+        super().initial(request, *args, **kwargs)
+        if self.messages_limit_query_param not in request.query_params:
+            return
+        if not self.nests_messages():
+            raise serializers.ValidationError({
+                self.messages_limit_query_param: [
+                    "This view does not render nested messages."]
+            })
+        self.get_messages_limit()
+
+    def nests_messages(self):
+        """Return True if the action renders nested messages."""
+        return False
+
+    def get_requested_fields(self):
+        """Return the names of the fields to render, or None for all."""
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = self.parse_fields()
+        return self._requested_fields
+
+    def parse_fields(self):
+        """Validate the requested fields against the serializer's."""
+        value = self.request.query_params.get(self.fields_query_param, '')
+        fields = frozenset(filter(None, map(str.strip, value.split(','))))
+        if not fields:
+            return None
+        serializer = self.get_serializer_class()()
+        readable = {
+            name for name, field in serializer.fields.items()
+            if not field.write_only
+        }
+        unknown = sorted(fields - readable)
+        if unknown:
+            raise serializers.ValidationError({self.fields_query_param: [
+                f"Unknown fields: {', '.join(unknown)}. Choose from: "
+                f"{', '.join(sorted(readable))}."
+            ]})
+        return fields
+
+    def wants(self, *names):
+        """Return True if any of the named fields is rendered."""
+        fields = self.get_requested_fields()
+        return fields is None or not fields.isdisjoint(names)
+
+    def get_messages_limit(self):
+        """Return the number of nested messages to render, or None."""
+        value = self.request.query_params.get(
+            self.messages_limit_query_param)
+        if value is None:
+            return None
+        try:
+            limit = int(value)
+        except ValueError:
+            limit = -1
+        if not 0 <= limit <= self.max_messages_limit:
+            raise serializers.ValidationError({
+                self.messages_limit_query_param: [
+                    "Enter a whole number of messages, from 0 to "
+                    f"{self.max_messages_limit}."]
+            })
+        return limit
+
+    def get_serializer(self, *args, **kwargs):
+        """Render only the requested fields."""
+        kwargs.setdefault('fields', self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
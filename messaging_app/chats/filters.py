@@ -0,0 +1,73 @@
+"""
+FilterSets of the chat app.
+
+Every filter maps onto an index: `sent_at` ranges and `sender` onto the
+(conversation, sent_at, message_id) and (sender, sent_at) message
+indexes, and `participant` onto the unique (conversation, user) index of
+the participants table, and `participant_set` onto the unique participant
+set hash of conversations.
+"""
+from django.db.models import Exists, OuterRef
+from django_filters import rest_framework as filters
+
+from .fingerprint import participant_set_hash
+from .models import Conversation, ConversationParticipant, Message
+
+
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    """Comma-separated list of numbers, e.g. `?participant=3,7`."""
+
+
+class MessageFilter(filters.FilterSet):
+    """Filter messages by sending time and sender."""
+
+    sent_after = filters.IsoDateTimeFilter(
+        field_name='sent_at', lookup_expr='gte',
+        help_text="Only messages sent at or after this time."
+    )
+    sent_before = filters.IsoDateTimeFilter(
+        field_name='sent_at', lookup_expr='lt',
+        help_text="Only messages sent before this time."
+    )
+    sender = filters.NumberFilter(
+        field_name='sender_id', help_text="Only messages of this user id."
+    )
+
+    class Meta:
+        model = Message
+        fields = ['sent_after', 'sent_before', 'sender']
+
+
+class ConversationFilter(filters.FilterSet):
+    """Filter conversations by participant."""
+
+    participant = NumberInFilter(
+        method='filter_participant',
+        help_text="Only conversations including all these user ids."
+    )
+    participant_set = NumberInFilter(
+        method='filter_participant_set',
+        help_text=(
+            "Only the conversation between exactly these user ids and the "
+            "current user."
+        )
+    )
+
+    class Meta:
+        model = Conversation
+        fields = ['participant', 'participant_set']
+
+    def filter_participant(self, queryset, name, value):
+        """Keep the conversations every listed user takes part in."""
+        for user_id in value:
+            queryset = queryset.filter(Exists(
+                ConversationParticipant.objects.filter(
+                    conversation_id=OuterRef('pk'), user_id=user_id)
+            ))
+        return queryset
+
+    def filter_participant_set(self, queryset, name, value):
+        """Keep the conversation of exactly this participant set."""
+        fingerprint = participant_set_hash(
+            list(value) + [self.request.user.id])
+        return queryset.filter(participant_set_hash=fingerprint)
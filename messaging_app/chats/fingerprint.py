@@ -0,0 +1,44 @@
+"""
+Fingerprint conversations by their set of participants.
+
+`Conversation.participant_set_hash` is a hash of the sorted participant
+ids, unique across conversations, so the conversation between a given
+set of users is found with one index probe. When several conversations
+share a participant set only the oldest keeps the hash; the others have
+none and are not returned by lookups.
+"""
+import hashlib
+
+from django.db import IntegrityError, transaction
+
+from .models import Conversation, ConversationParticipant
+
+
+def participant_set_hash(user_ids):
+    """Return the fingerprint of a set of user ids, or None if empty."""
+    user_ids = sorted({int(user_id) for user_id in user_ids})
+    if not user_ids:
+        return None
+    return hashlib.sha256(
+        ','.join(map(str, user_ids)).encode()).hexdigest()
+
+
+def refresh_participant_set_hashes(conversation_ids):
+    """
+    Recompute the fingerprints of conversations after membership changes.
+
+    A conversation whose new participant set already belongs to another
+    conversation gets no fingerprint.
+    """
+    for conversation_id in conversation_ids:
+        fingerprint = participant_set_hash(
+            ConversationParticipant.objects.filter(
+                conversation_id=conversation_id
+            ).values_list('user_id', flat=True)
+        )
+        conversation = Conversation.objects.filter(pk=conversation_id)
+        try:
+            with transaction.atomic():
+                conversation.update(participant_set_hash=fingerprint)
+        except IntegrityError:
+            conversation.update(participant_set_hash=None)
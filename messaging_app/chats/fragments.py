@@ -0,0 +1,82 @@
+"""
+Cache of the encoded JSON of messages.
+
+A sent message only changes when it is edited, yet every list request
+used to serialize and encode the same rows again. `message_fragments`
+keeps the JSON encoding of the messages listed by this process, bounded
+by total size, and `MessageFragmentRows` splices the cached fragments
+into list responses, encoding only the messages it has not seen.
+
+A fragment is keyed by message id and only used while `SCHEMA_VERSION`,
+the time zone, the message's `edited_at` and its sender's username are
+the ones it was encoded with. These are read with the page itself, so an
+edit made through another process is never served stale; edits and
+deletions made here also drop the fragment right away.
+"""
+from django.conf import settings
+from django.utils import timezone
+
+from .lru import ByteLRUCache
+from .renderers import JSONFragments, encode_json
+from .rows import MessageRows, format_uuid_text
+
+# Bump whenever the output of MessageSerializer changes.
+SCHEMA_VERSION = 1
+
+# Approximate memory taken by an entry besides the fragment itself.
+ENTRY_OVERHEAD = 200
+
+message_fragments = ByteLRUCache(
+    getattr(settings, 'CHATS_MESSAGE_FRAGMENT_CACHE_BYTES', 32 * 1024 * 1024),
+    sizeof=lambda entry: len(entry[1]) + ENTRY_OVERHEAD
+)
+
+
+def encoding_version():
+    """Return what the fragments encoded now depend on besides the data."""
+    return (SCHEMA_VERSION, str(timezone.get_current_timezone()))
+
+
+def fragments_enabled():
+    """Return True when message fragments may be cached."""
+    return message_fragments.max_bytes > 0
+
+
+def forget_messages(message_ids):
+    """Drop the cached fragments of the given messages."""
+    for message_id in message_ids:
+        message_fragments.pop(str(message_id))
+
+
+class MessageFragmentRows(MessageRows):
+    """Rows of `MessageSerializer`, rendered from cached fragments."""
+
+    extra_lookups = ('edited_at',)
+
+    def serialize(self, rows):
+        """Return the encoded rows, encoding only the uncached ones."""
+        rows = list(rows)
+        version = encoding_version()
+        fragments = JSONFragments()
+        missing = []
+        for row in rows:
+            if 'message_id_text' in row:
+                message_id = format_uuid_text(row['message_id_text'])
+            else:
+                message_id = str(row['message_id'])
+            validator = (version, row['edited_at'], row['sender__username'])
+            entry = message_fragments.get(message_id)
+            if entry is not None and entry[0] == validator:
+                fragments.append(entry[1])
+                continue
+            missing.append((len(fragments), message_id, validator, row))
+            fragments.append(None)
+
+        if missing:
+            encoded = super().serialize([row for *_, row in missing])
+            for (index, message_id, validator, _), data in zip(
+                    missing, encoded):
+                fragment = encode_json(data)
+                message_fragments.set(message_id, (validator, fragment))
+                fragments[index] = fragment
+        return fragments
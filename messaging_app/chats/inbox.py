@@ -0,0 +1,161 @@
+"""
+Maintain the optional fan-out-on-write inbox table.
+
+When the `CHATS_INBOX_FANOUT` setting is enabled, message writes and
+membership changes are copied into `InboxEntry` rows, one per (user,
+conversation), so a user's conversation list is a single range scan
+instead of a participants join plus DISTINCT. `rebuild` and `check`
+recompute the table from `Message` and the participants table.
+"""
+from django.conf import settings
+from django.db.models import (
+    Case, Count, Exists, F, OuterRef, Q, Subquery, When,
+)
+from django.db.models.functions import Coalesce
+
+from .activity import latest_message, unread_messages
+from .models import ConversationParticipant, CustomUser, InboxEntry
+
+# Inbox entries computed and written at a time, and users whose entries
+# `check` compares at a time.
+INBOX_BATCH_SIZE = 1000
+
+
+def fanout_enabled():
+    """Return True when the inbox table is maintained and read from."""
+    return getattr(settings, 'CHATS_INBOX_FANOUT', False)
+
+
+def record_message(message):
+    """
+    Fan a new message out to the inbox entries of its conversation.
+
+    Other participants get one more unread message; the sender's entry is
+    recomputed, since sending moves their own read watermark.
+    """
+    is_newer = (
+        Q(last_activity__isnull=True) |
+        Q(last_activity__lte=message.sent_at)
+    )
+    InboxEntry.objects.filter(
+        conversation_id=message.conversation_id
+    ).exclude(user_id=message.sender_id).update(
+        unread_count=F('unread_count') + 1,
+        last_activity=Case(
+            When(is_newer, then=message.sent_at),
+            default=F('last_activity'),
+        ),
+    )
+    sync([message.conversation_id], [message.sender_id])
+
+
+def record_read(conversation_id, user_id, unread_count):
+    """Store the unread count of a user after their watermark moved."""
+    InboxEntry.objects.filter(
+        conversation_id=conversation_id, user_id=user_id
+    ).update(unread_count=unread_count)
+
+
+def sync(conversation_ids=None, user_ids=None):
+    """
+    Bring the entries of the given conversations and users up to date.
+
+    Entries without a membership are deleted and the others recomputed.
+    With no arguments this rebuilds the whole table.
+    """
+    memberships = ConversationParticipant.objects.all()
+    entries = InboxEntry.objects.all()
+    if conversation_ids is not None:
+        memberships = memberships.filter(conversation_id__in=conversation_ids)
+        entries = entries.filter(conversation_id__in=conversation_ids)
+    if user_ids is not None:
+        memberships = memberships.filter(user_id__in=user_ids)
+        entries = entries.filter(user_id__in=user_ids)
+
+    entries.exclude(Exists(ConversationParticipant.objects.filter(
+        conversation_id=OuterRef('conversation_id'),
+        user_id=OuterRef('user_id'),
+    ))).delete()
+    for batch in compute_entries(memberships):
+        InboxEntry.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=['user', 'conversation'],
+            update_fields=['last_activity', 'unread_count'],
+        )
+
+
+def compute_entries(memberships, batch_size=INBOX_BATCH_SIZE):
+    """
+    Compute the inbox entries of `memberships` from the messages.
+
+    The memberships are read in chunks and the entries yielded in lists
+    of `batch_size`, so the table is never held in memory at once.
+    """
+    unread = unread_messages(
+        OuterRef('conversation_id'), OuterRef('last_read_at'),
+        OuterRef('last_read_message_id')
+    ).order_by().values('conversation_id').annotate(
+        count=Count('*')
+    ).values('count')
+    latest = latest_message(OuterRef('conversation_id'))
+    rows = memberships.annotate(
+        activity=Subquery(latest.values('sent_at')[:1]),
+        unread=Coalesce(Subquery(unread), 0),
+    ).values_list('user_id', 'conversation_id', 'activity', 'unread')
+    batch = []
+    for user_id, conversation_id, activity, unread in rows.iterator(
+            chunk_size=batch_size):
+        batch.append(InboxEntry(
+            user_id=user_id, conversation_id=conversation_id,
+            last_activity=activity, unread_count=unread
+        ))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def check(batch_size=INBOX_BATCH_SIZE):
+    """
+    Compare the inbox table with what the messages say it should be.
+
+    Return the number of missing, stale and out-of-date entries. Users
+    are compared `batch_size` at a time.
+    """
+    report = {'missing': 0, 'stale': 0, 'mismatched': 0}
+    user_ids = CustomUser.objects.order_by('pk').values_list('pk', flat=True)
+    batch = []
+    for user_id in user_ids.iterator(chunk_size=batch_size):
+        batch.append(user_id)
+        if len(batch) == batch_size:
+            compare_entries(batch, report)
+            batch = []
+    if batch:
+        compare_entries(batch, report)
+    return report
+
+
+def compare_entries(user_ids, report):
+    """Count the differing inbox entries of `user_ids` into `report`."""
+    expected = {}
+    memberships = ConversationParticipant.objects.filter(
+        user_id__in=user_ids)
+    for entries in compute_entries(memberships):
+        expected.update(
+            ((entry.user_id, entry.conversation_id),
+             (entry.last_activity, entry.unread_count))
+            for entry in entries
+        )
+    for user_id, conversation_id, activity, unread in (
+        InboxEntry.objects.filter(user_id__in=user_ids).values_list(
+            'user_id', 'conversation_id', 'last_activity', 'unread_count'
+        ).iterator()
+    ):
+        wanted = expected.pop((user_id, conversation_id), None)
+        if wanted is None:
+            report['stale'] += 1
+        elif wanted != (activity, unread):
+            report['mismatched'] += 1
+    report['missing'] += len(expected)
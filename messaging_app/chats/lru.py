@@ -0,0 +1,106 @@
+"""A small thread-safe LRU cache for per-process lookups."""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe mapping bounded to `max_entries`, evicting the least
+    recently used entry first.
+
+    Entries may carry an absolute expiry time (`time.time()` based);
+    expired entries are dropped when they are next read.
+    """
+
+    def __init__(self, max_entries):
+        """Create an empty cache holding at most `max_entries` entries."""
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the live value stored under `key`, or `default`."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at=None):
+        """Store `value` under `key`, evicting old entries if needed."""
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove `key` and return its value, or `default`."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        """Return the number of entries, expired or not."""
+        return len(self._entries)
+
+
+class ByteLRUCache(LRUCache):
+    """
+    Thread-safe mapping bounded to `max_bytes` in total, evicting the least
+    recently used entries first.
+
+    The size of a value is given by `sizeof`; values larger than the whole
+    cache are not stored. Entries do not expire. `evictions` counts the
+    entries dropped to make room.
+    """
+
+    def __init__(self, max_bytes, sizeof=len):
+        """Create an empty cache holding at most `max_bytes` of values."""
+        super().__init__(max_entries=None)
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self.evictions = 0
+        self._sizes = {}
+
+    def set(self, key, value):
+        """Store `value` under `key`, evicting old entries if needed."""
+        size = self.sizeof(value)
+        with self._lock:
+            self.total_bytes -= self._sizes.pop(key, 0)
+            self._entries.pop(key, None)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, None)
+            self._sizes[key] = size
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                evicted, _ = self._entries.popitem(last=False)
+                self.total_bytes -= self._sizes.pop(evicted)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """Remove `key` and return its value, or `default`."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            self.total_bytes -= self._sizes.pop(key, 0)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.total_bytes = 0
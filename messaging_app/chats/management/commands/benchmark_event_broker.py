@@ -0,0 +1,149 @@
+"""
+Benchmark cross-process fan-out through the event broker.
+
+Starts a broker and `--workers` subscriber processes on a temporary Unix
+socket, publishes `--events` events from this process and reports the
+delivery rate and the publish-to-delivery latency percentiles seen by
+each worker.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from chats.broker import Broker, BrokerClient
+
+
+def run_broker(path, max_backlog):
+    """Serve a broker until the process is terminated."""
+    asyncio.run(Broker(path, max_backlog=max_backlog).serve())
+
+
+def run_subscriber(path, expected, timeout, results):
+    """Receive events, then report the count, duration and latencies."""
+    latencies = []
+    done = threading.Event()
+
+    def on_events(events):
+        now = time.monotonic()
+        for _, data in events:
+            latencies.append(now - json.loads(data)['t'])
+        if len(latencies) >= expected:
+            done.set()
+
+    client = BrokerClient(path, on_events=on_events)
+    client.start()
+    client.connected.wait()
+    results.put(('ready', None))
+    done.wait(timeout)
+    client.close()
+    results.put(('done', latencies))
+
+
+class Command(BaseCommand):
+    """Measure events/s and fan-out latency across processes."""
+
+    help = (
+        "Publish events through a local event broker to N worker "
+        "processes and report throughput and latency percentiles."
+    )
+
+    def add_arguments(self, parser):
+        """Add the load options."""
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--events', type=int, default=100000)
+        parser.add_argument(
+            '--rate', type=int, default=0,
+            help="Events per second to publish; 0 publishes flat out."
+        )
+        parser.add_argument('--max-backlog', type=int, default=10000)
+        parser.add_argument('--timeout', type=float, default=60)
+
+    def handle(self, *args, **options):
+        """Run the broker, the workers and the publisher."""
+        workers, events = options['workers'], options['events']
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'broker.sock')
+            broker = context.Process(
+                target=run_broker, args=(path, options['max_backlog']))
+            broker.start()
+            subscribers = [
+                context.Process(
+                    target=run_subscriber,
+                    args=(path, events, options['timeout'], results)
+                )
+                for _ in range(workers)
+            ]
+            try:
+                for subscriber in subscribers:
+                    subscriber.start()
+                for _ in subscribers:
+                    results.get(timeout=options['timeout'])
+                elapsed = self.publish(path, events, options['rate'])
+                reports = []
+                for _ in subscribers:
+                    try:
+                        reports.append(
+                            results.get(timeout=options['timeout'])[1])
+                    except queue.Empty:
+                        break
+            finally:
+                for process in subscribers + [broker]:
+                    process.terminate()
+                    process.join()
+        self.report(events, elapsed, reports)
+
+    def publish(self, path, events, rate):
+        """Publish the events and return the publishing time."""
+        client = BrokerClient(
+            path, on_events=lambda events: None, max_backlog=events)
+        client.start()
+        client.connected.wait()
+        start = time.monotonic()
+        for n in range(events):
+            if rate:
+                delay = start + n / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            client.publish(n % 1000, json.dumps({'t': time.monotonic()}))
+        elapsed = time.monotonic() - start
+        # Let the client thread flush its backlog before stopping it.
+        while client.pending:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        client.close()
+        return elapsed
+
+    def report(self, events, elapsed, reports):
+        """Print the publishing rate and the per-worker deliveries."""
+        self.stdout.write(
+            f"published {events} events in {elapsed:.3f} s "
+            f"({events / elapsed:,.0f} events/s)"
+        )
+        for worker, latencies in enumerate(reports):
+            if not latencies:
+                self.stdout.write(f"worker {worker}: no events received")
+                continue
+            latencies.sort()
+            p = [
+                latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+                * 1000 for q in (0.5, 0.95, 0.99)
+            ]
+            self.stdout.write(
+                f"worker {worker}: {len(latencies)}/{events} delivered, "
+                f"latency p50 {p[0]:.2f} ms, p95 {p[1]:.2f} ms, "
+                f"p99 {p[2]:.2f} ms, max {latencies[-1] * 1000:.2f} ms"
+            )
+        delivered = sum(len(latencies) for latencies in reports)
+        self.stdout.write(
+            f"total fan-out: {delivered} deliveries "
+            f"({delivered / elapsed:,.0f} deliveries/s)"
+        )
@@ -0,0 +1,86 @@
+"""
+Benchmark the serialization of message list pages.
+
+Fetches and serializes a page of the busiest conversation's messages,
+once through `MessageSerializer` and once through the `values()` row
+serializer of `chats.rows`, and prints the CPU time per row of each path,
+in total and without the time the database takes to run the query and
+return the raw rows. Read-only: safe to run against any database.
+"""
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+
+from chats.models import Message
+from chats.pagination import MessageCursorPagination
+from chats.rows import MessageRows
+from chats.serializers import MessageSerializer
+from chats.views import MESSAGE_COLUMNS
+
+
+class Command(BaseCommand):
+    """Compare ModelSerializer and row serialization of a page."""
+
+    help = (
+        "Fetch and serialize a page of messages with MessageSerializer and "
+        "with the values() row serializer, and report CPU time per row."
+    )
+
+    def add_arguments(self, parser):
+        """Add the page size and repeat options."""
+        parser.add_argument('--page-size', type=int, default=1000)
+        parser.add_argument(
+            '--repeat', type=int, default=50,
+            help="Number of timed runs of each path."
+        )
+
+    def handle(self, *args, **options):
+        """Measure both paths on one page."""
+        busiest = Message.objects.order_by().values(
+            'conversation_id'
+        ).annotate(total=Count('*')).order_by('-total').first()
+        if busiest is None:
+            self.stderr.write("No messages to benchmark.")
+            return
+        repeat = options['repeat']
+
+        messages = Message.objects.select_related('sender').only(
+            *MESSAGE_COLUMNS
+        ).filter(
+            conversation_id=busiest['conversation_id']
+        ).order_by(*MessageCursorPagination.ordering)[:options['page_size']]
+        rows = MessageRows()
+        values = rows.values(messages, *MessageCursorPagination.ordering)
+        count = len(values)
+        self.report('serializer', messages, count, repeat, lambda: (
+            MessageSerializer(list(messages.all()), many=True).data))
+        self.report('rows', values, count, repeat, lambda: (
+            rows.serialize(values.all())))
+
+    def report(self, name, queryset, count, repeat, function):
+        """Print the CPU time per row of `function` reading `queryset`."""
+        sql, params = queryset.query.sql_with_params()
+
+        def execute():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                cursor.fetchall()
+
+        total = self.time(function, repeat) / count
+        database = self.time(execute, repeat) / count
+        self.stdout.write(
+            f"{name:<10} {count} rows  {total:6.1f} us/row, "
+            f"{total - database:6.1f} us/row without the query"
+        )
+
+    def time(self, function, repeat):
+        """Return the median CPU time of `function` in microseconds."""
+        timings = []
+        for _ in range(repeat):
+            start = time.process_time_ns()
+            function()
+            timings.append((time.process_time_ns() - start) / 1000)
+        return statistics.median(timings)
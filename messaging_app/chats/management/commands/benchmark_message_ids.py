@@ -0,0 +1,128 @@
+"""
+Benchmark inserting messages keyed by random and by time-ordered UUIDs.
+
+Creates two scratch tables shaped like `chats_message`'s keys (the
+primary key and the (conversation, sent_at, message_id) index), fills
+one with `uuid.uuid4` ids and the other with `chats.ids.uuid7` ids, and
+prints the insert rate over the whole run and over its last tenth, when
+the table is largest, then the size of each index. The tables are
+dropped afterwards; run it against a scratch database all the same, as
+10M+ rows take a while and plenty of disk.
+"""
+import random
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from chats.ids import uuid7
+
+ID_FACTORIES = (
+    ('uuid4', uuid.uuid4),
+    ('uuid7', uuid7),
+)
+
+
+class Command(BaseCommand):
+    """Compare insert rates and index sizes of UUIDv4 and UUIDv7 keys."""
+
+    help = (
+        "Insert rows keyed by uuid4 and by uuid7 into scratch tables and "
+        "report insert rates and index sizes."
+    )
+
+    def add_arguments(self, parser):
+        """Add the size options."""
+        parser.add_argument('--rows', type=int, default=10_000_000)
+        parser.add_argument('--conversations', type=int, default=10000)
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        """Fill one table per id kind and report on each."""
+        for name, make_id in ID_FACTORIES:
+            table = f'bench_message_{name}'
+            self.create_table(table)
+            try:
+                total, tail = self.fill(
+                    table, make_id, options['rows'],
+                    options['conversations'], options['batch_size']
+                )
+                self.stdout.write(
+                    f"{name}: {total:,.0f} rows/s overall, "
+                    f"{tail:,.0f} rows/s over the last tenth"
+                )
+                for index, size in self.index_sizes(table):
+                    self.stdout.write(f"   {index}: {size / 2**20:,.1f} MiB")
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DROP TABLE {table}')
+
+    def create_table(self, table):
+        """Create a table with the keys of `chats_message`."""
+        id_type = models.UUIDField().db_type(connection)
+        time_type = models.DateTimeField().db_type(connection)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE {table} ("
+                f"message_id {id_type} NOT NULL PRIMARY KEY, "
+                f"conversation_id {id_type} NOT NULL, "
+                f"sent_at {time_type} NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX {table}_conv_sent_idx ON {table} "
+                f"(conversation_id, sent_at, message_id)"
+            )
+
+    def fill(self, table, make_id, rows, conversations, batch_size):
+        """Insert `rows` rows; return the overall and final insert rates."""
+        field = models.UUIDField()
+        prep_id = field.get_db_prep_value
+        prep_time = connection.ops.adapt_datetimefield_value
+        conversation_ids = [
+            prep_id(uuid.uuid4(), connection) for _ in range(conversations)
+        ]
+        sent_at = timezone.now() - timedelta(seconds=rows)
+        tail_start = rows - rows // 10
+        elapsed = tail = 0.0
+        sql = (
+            f"INSERT INTO {table} (message_id, conversation_id, sent_at) "
+            f"VALUES (%s, %s, %s)"
+        )
+        for start in range(0, rows, batch_size):
+            batch = []
+            for _ in range(min(batch_size, rows - start)):
+                sent_at += timedelta(seconds=1)
+                batch.append((
+                    prep_id(make_id(), connection),
+                    random.choice(conversation_ids), prep_time(sent_at),
+                ))
+            began = time.perf_counter()
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+            took = time.perf_counter() - began
+            elapsed += took
+            if start >= tail_start:
+                tail += took
+        return rows / elapsed, (rows - tail_start) / tail
+
+    def index_sizes(self, table):
+        """Return the `(name, bytes)` of the table's indexes, if known."""
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(
+                    "SELECT name, SUM(pgsize) FROM dbstat WHERE name IN "
+                    "(SELECT name FROM sqlite_master WHERE type = 'index' "
+                    "AND tbl_name = %s) GROUP BY name", [table]
+                )
+            elif connection.vendor == 'postgresql':
+                cursor.execute(
+                    "SELECT indexrelid::regclass::text, "
+                    "pg_relation_size(indexrelid) FROM pg_index "
+                    "WHERE indrelid = %s::regclass", [table]
+                )
+            else:
+                return []
+            return cursor.fetchall()
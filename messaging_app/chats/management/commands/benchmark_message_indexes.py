@@ -0,0 +1,189 @@
+"""
+Benchmark the message and membership access paths.
+
+Runs the hot queries of the chat API against the current database twice:
+once with only the single-column foreign key indexes the tables started
+with, and once with the composite indexes of migration 0002. For each run
+it prints the query plan and the latency percentiles.
+
+The command swaps indexes in place, so only run it against a scratch
+database, e.g. one seeded with `--seed 10000000`.
+"""
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from chats.models import (
+    Conversation,
+    ConversationParticipant,
+    CustomUser,
+    Message
+)
+
+# The single-column indexes the tables had before migration 0002.
+LEGACY_INDEXES = (
+    (Message, models.Index(
+        fields=['conversation'], name='bench_msg_conversation_idx')),
+    (Message, models.Index(fields=['sender'], name='bench_msg_sender_idx')),
+    (ConversationParticipant, models.Index(
+        fields=['user'], name='bench_member_user_idx')),
+)
+
+
+class Command(BaseCommand):
+    """Compare query plans and latencies before and after 0002."""
+
+    help = (
+        "Benchmark message and membership queries with the legacy "
+        "single-column indexes and with the composite indexes. "
+        "Swaps indexes in place: use a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        """Add the seeding and measuring options."""
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help="Insert this many synthetic messages before measuring."
+        )
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--conversations', type=int, default=10000)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument(
+            '--repeat', type=int, default=50,
+            help="Number of timed runs of each query."
+        )
+
+    def handle(self, *args, **options):
+        """Seed if asked, then measure both index layouts."""
+        if options['seed']:
+            self.seed(
+                options['seed'], options['users'], options['conversations'],
+                options['batch_size']
+            )
+        queries = self.get_queries()
+        if not queries:
+            self.stderr.write("No messages to benchmark; use --seed.")
+            return
+
+        self.stdout.write("== before: single-column indexes")
+        with self.legacy_indexes():
+            self.measure(queries, options['repeat'])
+        self.stdout.write("== after: composite indexes")
+        self.measure(queries, options['repeat'])
+
+    def seed(self, messages, users, conversations, batch_size):
+        """Insert users, conversations and skewed message traffic."""
+        self.stdout.write(f"Seeding {messages} messages...")
+        offset = CustomUser.objects.count()
+        user_ids = [
+            user.id for user in CustomUser.objects.bulk_create(
+                CustomUser(username=f'bench_{offset + i}')
+                for i in range(users)
+            )
+        ]
+        conversation_ids = [
+            conversation.pk
+            for conversation in Conversation.objects.bulk_create(
+                Conversation() for _ in range(conversations)
+            )
+        ]
+        ConversationParticipant.objects.bulk_create(
+            (
+                ConversationParticipant(conversation_id=pk, user_id=user_id)
+                for pk in conversation_ids
+                for user_id in random.sample(user_ids, random.randint(2, 5))
+            ),
+            batch_size=batch_size,
+        )
+        members = {}
+        for pk, user_id in ConversationParticipant.objects.filter(
+            conversation_id__in=conversation_ids
+        ).values_list('conversation_id', 'user_id'):
+            members.setdefault(pk, []).append(user_id)
+
+        # A few conversations take most of the traffic, as in production.
+        weights = [1 / (rank + 1) for rank in range(len(conversation_ids))]
+        sent_at = timezone.now() - timedelta(seconds=messages)
+        for start in range(0, messages, batch_size):
+            count = min(batch_size, messages - start)
+            batch = []
+            for pk in random.choices(conversation_ids, weights, k=count):
+                sent_at += timedelta(seconds=1)
+                batch.append(Message(
+                    conversation_id=pk,
+                    sender_id=random.choice(members[pk]),
+                    message_body='benchmark message',
+                    sent_at=sent_at,
+                ))
+            with transaction.atomic():
+                Message.objects.bulk_create(batch)
+
+    def get_queries(self):
+        """Return the named querysets to measure."""
+        busiest = Message.objects.order_by().values(
+            'conversation_id'
+        ).annotate(total=models.Count('*')).order_by('-total').first()
+        if busiest is None:
+            return {}
+        conversation_id = busiest['conversation_id']
+        member = ConversationParticipant.objects.filter(
+            conversation_id=conversation_id
+        ).values_list('user_id', flat=True).first()
+        messages = Message.objects.filter(
+            conversation_id=conversation_id
+        ).order_by('sent_at', 'message_id')
+        middle = messages.values_list('sent_at', flat=True)[
+            busiest['total'] // 2]
+
+        return {
+            'conversation page (deep keyset)': messages.filter(
+                sent_at__gt=middle)[:50],
+            'sender history': Message.objects.filter(
+                sender_id=member).order_by('-sent_at')[:50],
+            'conversations of user': ConversationParticipant.objects.filter(
+                user_id=member).values_list('conversation_id', flat=True),
+        }
+
+    def measure(self, queries, repeat):
+        """Print the plan and latency percentiles of each query."""
+        for name, queryset in queries.items():
+            self.stdout.write(f"-- {name}")
+            self.stdout.write(queryset.explain())
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            self.stdout.write(
+                f"   median {statistics.median(timings):.3f} ms, "
+                f"p95 {p95:.3f} ms"
+            )
+
+    @contextmanager
+    def legacy_indexes(self):
+        """Temporarily replace the composite indexes with legacy ones."""
+        composite = [
+            (model, index) for model in (Message, ConversationParticipant)
+            for index in model._meta.indexes
+        ]
+        with connection.schema_editor() as editor:
+            for model, index in composite:
+                editor.remove_index(model, index)
+            for model, index in LEGACY_INDEXES:
+                editor.add_index(model, index)
+        try:
+            yield
+        finally:
+            with connection.schema_editor() as editor:
+                for model, index in LEGACY_INDEXES:
+                    editor.remove_index(model, index)
+                for model, index in composite:
+                    editor.add_index(model, index)
@@ -0,0 +1,88 @@
+"""
+Benchmark the response renderers on pages of messages.
+
+Serializes a page of the most recent messages the way the message list
+does, then renders and parses it with DRF's JSON classes and with each
+of `chats.renderers`, printing the size on the wire and the median time
+of each step. Read-only: safe to run against any database.
+"""
+import io
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from chats import renderers
+from chats.models import Message
+from chats.serializers import MessageSerializer
+from chats.views import MESSAGE_COLUMNS
+
+
+class Command(BaseCommand):
+    """Compare the size and speed of the response formats."""
+
+    help = (
+        "Render a page of messages with each available renderer and "
+        "report bytes on the wire and encode/decode times."
+    )
+
+    def add_arguments(self, parser):
+        """Add the page size and repeat options."""
+        parser.add_argument('--page-size', type=int, default=1000)
+        parser.add_argument(
+            '--repeat', type=int, default=50,
+            help="Number of timed runs of each step."
+        )
+
+    def handle(self, *args, **options):
+        """Serialize one page, then measure every format on it."""
+        messages = list(
+            Message.objects.select_related('sender').only(*MESSAGE_COLUMNS)
+            .order_by('-sent_at')[:options['page_size']]
+        )
+        if not messages:
+            self.stderr.write("No messages to benchmark.")
+            return
+        repeat = options['repeat']
+
+        serialize = self.time(
+            lambda: MessageSerializer(messages, many=True).data, repeat)
+        self.stdout.write(
+            f"{len(messages)} messages, serializer {serialize:.2f} ms")
+
+        data = MessageSerializer(messages, many=True).data
+        for name, renderer, parser in self.get_formats():
+            body = renderer.render(data)
+            encode = self.time(lambda: renderer.render(data), repeat)
+            decode = self.time(
+                lambda: parser.parse(io.BytesIO(body)), repeat)
+            self.stdout.write(
+                f"{name:<10} {len(body):>9} bytes  "
+                f"encode {encode:7.2f} ms  decode {decode:7.2f} ms"
+            )
+
+    def get_formats(self):
+        """Return (name, renderer, parser) for each available format."""
+        formats = [('drf-json', JSONRenderer(), JSONParser())]
+        if renderers.orjson is not None:
+            formats.append((
+                'orjson', renderers.ORJSONRenderer(),
+                renderers.ORJSONParser()
+            ))
+        if renderers.msgpack is not None:
+            formats.append((
+                'msgpack', renderers.MessagePackRenderer(),
+                renderers.MessagePackParser()
+            ))
+        return formats
+
+    def time(self, function, repeat):
+        """Return the median time of `function` in milliseconds."""
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
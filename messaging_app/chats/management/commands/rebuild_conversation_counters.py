@@ -0,0 +1,47 @@
+"""Rebuild the denormalized activity counters of conversations."""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chats.activity import rebuild_counters
+from chats.models import Conversation
+
+
+class Command(BaseCommand):
+    """Recompute last_message_at, last_message and message_count."""
+
+    help = (
+        "Recompute the activity counters of conversations from their "
+        "messages, in batches."
+    )
+
+    def add_arguments(self, parser):
+        """Add the batch and selection options."""
+        parser.add_argument(
+            'conversation_ids', nargs='*',
+            help="Only rebuild these conversations (default: all)."
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        """Rebuild the counters one batch of conversations at a time."""
+        conversations = Conversation.objects.order_by('pk')
+        if options['conversation_ids']:
+            conversations = conversations.filter(
+                pk__in=options['conversation_ids'])
+
+        batch_size = options['batch_size']
+        total = 0
+        last_pk = None
+        while True:
+            batch = conversations
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            pks = list(batch.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            with transaction.atomic():
+                total += rebuild_counters(
+                    Conversation.objects.filter(pk__in=pks))
+            last_pk = pks[-1]
+
+        self.stdout.write(f"Rebuilt counters of {total} conversations.")
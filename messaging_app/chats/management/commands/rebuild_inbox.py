@@ -0,0 +1,36 @@
+"""Check or rebuild the fan-out inbox table."""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from chats import inbox
+
+
+class Command(BaseCommand):
+    """Recompute InboxEntry rows from messages and memberships."""
+
+    help = (
+        "Compare the inbox table with the messages and the participants "
+        "table, and rebuild it unless --check is given."
+    )
+
+    def add_arguments(self, parser):
+        """Add the --check option."""
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report drift, and fail if there is any."
+        )
+
+    def handle(self, *args, **options):
+        """Report drift, then rebuild the table if asked to."""
+        report = inbox.check()
+        self.stdout.write(
+            "missing: {missing}, stale: {stale}, "
+            "mismatched: {mismatched}".format(**report)
+        )
+        if options['check']:
+            if any(report.values()):
+                raise CommandError("The inbox table is out of date.")
+            return
+        with transaction.atomic():
+            inbox.sync()
+        self.stdout.write("Inbox rebuilt.")
@@ -0,0 +1,34 @@
+"""Check or rebuild the full-text index of message bodies."""
+from django.core.management.base import BaseCommand, CommandError
+
+from chats import search
+
+
+class Command(BaseCommand):
+    """Reindex chats_message_fts from the messages table."""
+
+    help = (
+        "Rebuild the FTS5 message search index and its triggers from the "
+        "messages, or only check them with --check."
+    )
+
+    def add_arguments(self, parser):
+        """Add the --check option."""
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only check the index, and fail if it is out of date."
+        )
+
+    def handle(self, *args, **options):
+        """Check the index, or rebuild it."""
+        if not search.fts_available():
+            raise CommandError(
+                "Full-text search needs SQLite; this database uses "
+                "substring matching.")
+        if options['check']:
+            if not search.check():
+                raise CommandError("The message search index is out of date.")
+            self.stdout.write("The message search index is up to date.")
+            return
+        search.rebuild()
+        self.stdout.write("Message search index rebuilt.")
@@ -0,0 +1,129 @@
+"""
+Rewrite the ids of existing conversations and messages as UUIDv7.
+
+New rows get time-ordered ids (`chats.ids`); this command gives the rows
+made before the same order. Each message gets an id made from its
+`sent_at` and each conversation one made from its `created_at`, in
+(time, old id) order, and every column pointing at the old ids is
+rewritten with them: messages, memberships, inbox entries, the
+conversations' last message and the read watermarks. Ids that are
+already UUIDv7 are kept, so the command can be run again, e.g. after an
+interruption.
+
+Conversations, then messages, are rekeyed in one transaction each,
+through a temporary table mapping the old ids to the new ones. Message
+search keys, and so the search index, are unchanged. Stop the application
+while it runs and clear its caches afterwards: cached memberships,
+buffers and responses still name the old ids.
+"""
+from datetime import datetime, time, timezone
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from chats.ids import UUID7Generator
+from chats.models import (
+    Conversation,
+    ConversationParticipant,
+    InboxEntry,
+    Message
+)
+
+MAP_TABLE = 'chats_rekey_map'
+
+
+class Command(BaseCommand):
+    """Give existing conversations and messages time-ordered ids."""
+
+    help = (
+        "Rewrite the ids of existing conversations and messages as UUIDv7 "
+        "made from their creation times, updating every reference."
+    )
+
+    def add_arguments(self, parser):
+        """Add the batch size option."""
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help="Number of id pairs written to the map table at once."
+        )
+
+    def handle(self, *args, **options):
+        """Rekey conversations, then messages."""
+        batch_size = options['batch_size']
+        count = self.rekey(
+            Conversation.objects.order_by('created_at', 'pk').values_list(
+                'pk', 'created_at'),
+            [
+                (Conversation, 'conversation_id'),
+                (Message, 'conversation_id'),
+                (ConversationParticipant, 'conversation_id'),
+                (InboxEntry, 'conversation_id'),
+            ],
+            batch_size,
+        )
+        self.stdout.write(f"Rekeyed {count} conversations.")
+        count = self.rekey(
+            Message.objects.order_by('sent_at', 'pk').values_list(
+                'pk', 'sent_at'),
+            [
+                (Message, 'message_id'),
+                (Conversation, 'last_message_id'),
+                (ConversationParticipant, 'last_read_message_id'),
+            ],
+            batch_size,
+        )
+        self.stdout.write(f"Rekeyed {count} messages.")
+
+    def rekey(self, rows, columns, batch_size):
+        """Give the `(id, time)` rows new ids and rewrite `columns`."""
+        model = rows.model
+        field = model._meta.pk
+        generate = UUID7Generator()
+        quote = connection.ops.quote_name
+        id_type = field.db_type(connection)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {MAP_TABLE} ("
+                f"old_id {id_type} PRIMARY KEY, new_id {id_type} NOT NULL)"
+            )
+            count = 0
+            batch = []
+            for pk, created in rows.iterator(chunk_size=batch_size):
+                if pk.version == 7:
+                    continue
+                if not isinstance(created, datetime):
+                    # Conversations only record the day.
+                    created = datetime.combine(
+                        created, time.min, tzinfo=timezone.utc)
+                new_id = generate(int(created.timestamp() * 1000))
+                batch.append((
+                    field.get_db_prep_value(pk, connection),
+                    field.get_db_prep_value(new_id, connection),
+                ))
+                if len(batch) >= batch_size:
+                    count += self.write_map(cursor, batch)
+            if batch:
+                count += self.write_map(cursor, batch)
+
+            for table_model, column in columns:
+                table = quote(table_model._meta.db_table)
+                column = quote(column)
+                cursor.execute(
+                    f"UPDATE {table} SET {column} = ("
+                    f"SELECT new_id FROM {MAP_TABLE} "
+                    f"WHERE old_id = {table}.{column}) "
+                    f"WHERE {column} IN (SELECT old_id FROM {MAP_TABLE})"
+                )
+            cursor.execute(f"DROP TABLE {MAP_TABLE}")
+        return count
+
+    def write_map(self, cursor, batch):
+        """Insert a batch of `(old_id, new_id)` pairs; empty the batch."""
+        cursor.executemany(
+            f"INSERT INTO {MAP_TABLE} (old_id, new_id) VALUES (%s, %s)",
+            batch
+        )
+        count = len(batch)
+        batch.clear()
+        return count
@@ -0,0 +1,42 @@
+"""Run the event broker that relays push events between processes."""
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chats.broker import Broker
+
+
+class Command(BaseCommand):
+    """Serve chats.broker.Broker on a Unix domain socket."""
+
+    help = (
+        "Relay real-time chat events between server processes. Listens on "
+        "CHATS_EVENT_BROKER_SOCKET unless --socket is given."
+    )
+
+    def add_arguments(self, parser):
+        """Add the socket and backlog options."""
+        parser.add_argument('--socket', help="Path of the Unix socket.")
+        parser.add_argument(
+            '--max-backlog', type=int, default=10000,
+            help="Events queued per worker before it is disconnected."
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        """Serve until interrupted."""
+        path = options['socket'] or getattr(
+            settings, 'CHATS_EVENT_BROKER_SOCKET', None)
+        if not path:
+            raise CommandError(
+                "Set CHATS_EVENT_BROKER_SOCKET or pass --socket.")
+        broker = Broker(
+            path, max_backlog=options['max_backlog'],
+            batch_size=options['batch_size']
+        )
+        self.stdout.write(f"Event broker listening on {path}")
+        try:
+            asyncio.run(broker.serve())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,120 @@
+"""
+Cache of the conversations each user takes part in.
+
+Every process keeps a bounded LRU map of user id -> frozenset of
+conversation ids. Each entry is stamped with the user's membership
+version, `CustomUser.membership_version`, which is incremented in the
+same transaction as any change to the user's participations. A stale
+entry in any process is therefore noticed with one primary key lookup
+and reloaded with one query, instead of loading the participations on
+every check. Given the request being served, the version is read once
+per request however many checks it makes. Entries are also dropped
+after CHATS_MEMBERSHIP_CACHE_TTL seconds, bounding how long a change the
+version missed (a raw SQL update, a bump rolled back after a reload) can
+go unnoticed.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import ConversationParticipant, CustomUser
+
+
+class MembershipCache:
+    """Bounded, versioned cache of user id -> conversation ids."""
+
+    def __init__(self, max_users=1024, ttl=300):
+        """Create an empty cache of `max_users` users for `ttl` seconds."""
+        self.max_users = max_users
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_conversation_ids(self, user_id, request=None):
+        """
+        Return the ids of the conversations the user takes part in.
+
+        With a `request`, the user's version is read for its first check
+        only.
+        """
+        version = self.get_version(user_id, request)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and version is not None and (
+                    entry[0] == version and entry[1] > now):
+                self._entries.move_to_end(user_id)
+                return entry[2]
+
+        conversation_ids = frozenset(
+            ConversationParticipant.objects.filter(
+                user_id=user_id
+            ).values_list('conversation_id', flat=True)
+        )
+        with self._lock:
+            self._entries[user_id] = (
+                version, now + self.ttl, conversation_ids)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return conversation_ids
+
+    def is_member(self, user_id, conversation_id, request=None):
+        """Return True if the user takes part in the conversation."""
+        return conversation_id in self.get_conversation_ids(
+            user_id, request)
+
+    def get_version(self, user_id, request=None):
+        """
+        Return the user's membership version, or None if not found.
+
+        The versions read for a `request` are kept on it.
+        """
+        versions = getattr(request, '_membership_versions', None)
+        if versions is not None and user_id in versions:
+            return versions[user_id]
+        version = CustomUser.objects.filter(pk=user_id).values_list(
+            'membership_version', flat=True).first()
+        if request is not None:
+            if versions is None:
+                versions = request._membership_versions = {}
+            versions[user_id] = version
+        return version
+
+    def invalidate(self, user_ids):
+        """
+        Mark the memberships of `user_ids` as changed in every process.
+
+        The versions are incremented in the current transaction, so other
+        processes see the new version together with the new memberships.
+        This process drops its entries now and again once the transaction
+        commits, so nothing it reloads in between outlives the change.
+        """
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        CustomUser.objects.filter(pk__in=user_ids).update(
+            membership_version=F('membership_version') + 1)
+        self._drop(user_ids)
+        transaction.on_commit(lambda: self._drop(user_ids))
+
+    def clear(self):
+        """Drop every entry held by this process."""
+        with self._lock:
+            self._entries.clear()
+
+    def _drop(self, user_ids):
+        """Drop the entries of `user_ids`."""
+        with self._lock:
+            for pk in user_ids:
+                self._entries.pop(pk, None)
+
+
+membership_cache = MembershipCache(
+    max_users=getattr(settings, 'CHATS_MEMBERSHIP_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'CHATS_MEMBERSHIP_CACHE_TTL', 300),
+)
@@ -0,0 +1,89 @@
+# Generated by Django 4.2.22 on 2026-10-18 19:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0001_initial'),
+    ]
+
+    operations = [
+        # Adopt the auto-created participants table as an explicit model;
+        # the table, its columns and its indexes are left as they are.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ConversationParticipant',
+                    fields=[
+                        ('id', models.AutoField(primary_key=True, serialize=False)),
+                        ('conversation', models.ForeignKey(help_text='The conversation the user takes part in', on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='chats.conversation')),
+                        ('user', models.ForeignKey(db_column='customuser_id', help_text='The participating user', on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'chats_conversation_participants',
+                        'unique_together': {('conversation', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='conversation',
+                    name='participants',
+                    field=models.ManyToManyField(help_text='Users involved in this conversation', related_name='conversations', through='chats.ConversationParticipant', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'sent_at', 'message_id'], name='chats_msg_conv_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'sent_at'], name='chats_msg_sender_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationparticipant',
+            index=models.Index(fields=['user', 'conversation'], name='chats_member_user_conv_idx'),
+        ),
+        # The composite indexes above make the single-column foreign key
+        # indexes redundant. Drop them directly: altering db_index through
+        # the schema editor would rebuild the whole table on SQLite.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    'DROP INDEX "chats_message_conversation_id_91ecdd5c"',
+                    'CREATE INDEX "chats_message_conversation_id_91ecdd5c" '
+                    'ON "chats_message" ("conversation_id")',
+                ),
+                migrations.RunSQL(
+                    'DROP INDEX "chats_message_sender_id_4f3659eb"',
+                    'CREATE INDEX "chats_message_sender_id_4f3659eb" '
+                    'ON "chats_message" ("sender_id")',
+                ),
+                migrations.RunSQL(
+                    'DROP INDEX "chats_conversation_participants_customuser_id_55b17f67"',
+                    'CREATE INDEX "chats_conversation_participants_customuser_id_55b17f67" '
+                    'ON "chats_conversation_participants" ("customuser_id")',
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='message',
+                    name='conversation',
+                    field=models.ForeignKey(db_index=False, help_text='The conversation this message belongs to', on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='chats.conversation'),
+                ),
+                migrations.AlterField(
+                    model_name='message',
+                    name='sender',
+                    field=models.ForeignKey(db_index=False, help_text='The user who sent this message', on_delete=django.db.models.deletion.CASCADE, related_name='sent_messages', to=settings.AUTH_USER_MODEL),
+                ),
+                migrations.AlterField(
+                    model_name='conversationparticipant',
+                    name='user',
+                    field=models.ForeignKey(db_column='customuser_id', db_index=False, help_text='The participating user', on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.22 on 2026-10-18 19:57
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def backfill_counters(apps, schema_editor):
+    """Compute the activity counters of the existing conversations."""
+    Conversation = apps.get_model('chats', 'Conversation')
+    Message = apps.get_model('chats', 'Message')
+    latest = Message.objects.filter(
+        conversation_id=OuterRef('pk')
+    ).order_by('-sent_at', '-message_id')
+    counts = Message.objects.filter(
+        conversation_id=OuterRef('pk')
+    ).order_by().values('conversation_id').annotate(
+        count=Count('*')
+    ).values('count')
+    Conversation.objects.update(
+        message_count=Coalesce(Subquery(counts), 0),
+        last_message_at=Subquery(latest.values('sent_at')[:1]),
+        last_message_id=Subquery(latest.values('message_id')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0002_message_and_membership_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, db_constraint=False, editable=False, help_text='The most recent message', null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='chats.message'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Timestamp of the most recent message', null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of messages in the conversation'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['-last_message_at'], name='chats_conv_activity_idx'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
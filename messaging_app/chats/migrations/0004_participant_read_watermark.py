@@ -0,0 +1,23 @@
+# Generated by Django 4.2.22 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0003_conversation_activity_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, help_text='Timestamp of the last message the user has read', null=True),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='last_read_message_id',
+            field=models.UUIDField(blank=True, help_text='UUID of the last message the user has read', null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.22 on 2026-10-18 19:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0004_participant_read_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_activity', models.DateTimeField(blank=True, help_text='Timestamp of the most recent message', null=True)),
+                ('unread_count', models.PositiveIntegerField(default=0, help_text="Number of messages after the user's read watermark")),
+                ('conversation', models.ForeignKey(help_text='The conversation listed in the inbox', on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to='chats.conversation')),
+                ('user', models.ForeignKey(db_index=False, help_text='The user whose inbox this is', on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Inbox entry',
+                'verbose_name_plural': 'Inbox entries',
+                'indexes': [models.Index(fields=['user', '-last_activity'], name='chats_inbox_user_activity_idx')],
+                'unique_together': {('user', 'conversation')},
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.22 on 2026-10-18 23:10
+
+from django.db import migrations
+
+# The index as first installed, keyed on the rowid of chats_message; the
+# current one (chats.search) is installed by 0012_message_search_key.
+FTS_TABLE = 'chats_message_fts'
+
+CREATE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "message_body, content='chats_message', content_rowid='rowid', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai "
+    "AFTER INSERT ON chats_message "
+    f"BEGIN INSERT INTO {FTS_TABLE}(rowid, message_body) "
+    "VALUES (new.rowid, new.message_body); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad "
+    "AFTER DELETE ON chats_message "
+    f"BEGIN INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message_body) "
+    "VALUES ('delete', old.rowid, old.message_body); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au "
+    "AFTER UPDATE OF message_body ON chats_message "
+    f"BEGIN INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message_body) "
+    "VALUES ('delete', old.rowid, old.message_body); "
+    f"INSERT INTO {FTS_TABLE}(rowid, message_body) "
+    "VALUES (new.rowid, new.message_body); END",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+)
+
+DROP_SQL = (
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+)
+
+
+def install_search(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql)
+
+
+def uninstall_search(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0005_inbox_entry'),
+    ]
+
+    operations = [
+        # The FTS5 index and its triggers only exist on SQLite; other
+        # databases search with a substring match instead.
+        migrations.RunPython(install_search, uninstall_search),
+    ]
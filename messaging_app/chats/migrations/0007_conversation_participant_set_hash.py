@@ -0,0 +1,52 @@
+# Generated by Django 4.2.22 on 2026-10-18 20:23
+
+from django.db import migrations, models
+
+from chats.fingerprint import participant_set_hash
+
+
+def backfill_participant_set_hashes(apps, schema_editor):
+    """Fingerprint the oldest conversation of each participant set."""
+    Conversation = apps.get_model('chats', 'Conversation')
+    ConversationParticipant = apps.get_model(
+        'chats', 'ConversationParticipant')
+    members = {}
+    for conversation_id, user_id in ConversationParticipant.objects.values_list(
+        'conversation_id', 'user_id'
+    ).iterator():
+        members.setdefault(conversation_id, []).append(user_id)
+
+    taken = set()
+    updated = []
+    for conversation in Conversation.objects.order_by(
+        'created_at', 'conversation_id'
+    ).only('pk').iterator():
+        fingerprint = participant_set_hash(members.get(conversation.pk, ()))
+        if fingerprint is None or fingerprint in taken:
+            continue
+        taken.add(fingerprint)
+        conversation.participant_set_hash = fingerprint
+        updated.append(conversation)
+    Conversation.objects.bulk_update(
+        updated, ['participant_set_hash'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0006_message_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='participant_set_hash',
+            field=models.CharField(blank=True, editable=False, help_text='Hash of the sorted participant ids; only the oldest conversation of each participant set has one', max_length=64, null=True),
+        ),
+        migrations.RunPython(
+            backfill_participant_set_hashes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(condition=models.Q(('participant_set_hash__isnull', False)), fields=('participant_set_hash',), name='chats_conv_participant_set_uniq'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.22 on 2026-10-18 20:25
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_updated_at(apps, schema_editor):
+    """Date the existing conversations by their last message."""
+    Conversation = apps.get_model('chats', 'Conversation')
+    Conversation.objects.update(updated_at=F('last_message_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0007_conversation_participant_set_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='updated_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Timestamp of the last change to the conversation', null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False, help_text='Incremented on every change to the conversation'),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='read_version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Incremented whenever the read watermark moves'),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.22 on 2026-10-18 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0008_conversation_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='edited_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Timestamp of the last edit of the message', null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.22 on 2026-10-18 21:00
+
+import chats.ids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0009_message_edited_at'),
+    ]
+
+    operations = [
+        # The defaults are only applied by Django, so the tables are left
+        # alone: altering the fields would make SQLite rebuild
+        # chats_message and renumber the rowids its search index uses.
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='conversation',
+                name='conversation_id',
+                field=models.UUIDField(default=chats.ids.uuid7, editable=False, help_text='Unique UUID for conversations', primary_key=True, serialize=False),
+            ),
+            migrations.AlterField(
+                model_name='message',
+                name='message_id',
+                field=models.UUIDField(default=chats.ids.uuid7, editable=False, help_text='Unique UUID for the message', primary_key=True, serialize=False),
+            ),
+        ]),
+    ]
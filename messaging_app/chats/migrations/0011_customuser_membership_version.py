@@ -0,0 +1,18 @@
+# Generated by Django 4.2.22 on 2026-10-18 21:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0010_uuid7_primary_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='membership_version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Incremented when the user joins or leaves a conversation'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.22 on 2026-10-19 09:30
+
+from importlib import import_module
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from chats import search
+
+message_search = import_module('chats.migrations.0006_message_search')
+
+
+def key_search_index(apps, schema_editor):
+    # Adding the unique column rebuilt chats_message on SQLite, dropping
+    # the triggers of the rowid-keyed index; the rowids the table was
+    # rebuilt with become the search keys of the existing messages.
+    if not search.fts_available(schema_editor.connection):
+        return
+    search.uninstall(schema_editor)
+    schema_editor.execute("UPDATE chats_message SET search_key = rowid")
+    search.install(schema_editor)
+
+
+def uninstall_search(apps, schema_editor):
+    search.uninstall(schema_editor)
+
+
+def reinstall_rowid_search(apps, schema_editor):
+    # Once removing search_key has rebuilt chats_message.
+    message_search.uninstall_search(apps, schema_editor)
+    message_search.install_search(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0011_customuser_membership_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            migrations.RunPython.noop, reinstall_rowid_search),
+        migrations.AddField(
+            model_name='message',
+            name='search_key',
+            field=models.BigIntegerField(editable=False, help_text='Key of the message in the search index', null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='MessageSearchIndex',
+            fields=[
+                ('message', models.OneToOneField(db_column='rowid', db_constraint=False, help_text='The indexed message', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='chats.message', to_field='search_key')),
+                ('message_body', models.TextField(help_text='The indexed text of the message')),
+                ('rank', models.FloatField(help_text='Relevance of the message to the MATCH query (bm25)')),
+            ],
+            options={
+                'db_table': 'chats_message_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(key_search_index, uninstall_search),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.22 on 2026-10-19 14:05
+
+from django.db import migrations
+
+# The last search key reserved for new messages (chats.search.reserve_keys).
+KEYS_TABLE = 'chats_message_search_keys'
+
+CREATE_SQL = (
+    f"CREATE TABLE IF NOT EXISTS {KEYS_TABLE} (last_key INTEGER NOT NULL)",
+    f"INSERT INTO {KEYS_TABLE}(last_key) SELECT 0 "
+    f"WHERE NOT EXISTS (SELECT 1 FROM {KEYS_TABLE})",
+)
+
+DROP_SQL = (
+    f"DROP TABLE IF EXISTS {KEYS_TABLE}",
+)
+
+
+def create_keys_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_keys_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0012_message_search_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_keys_table, drop_keys_table),
+    ]
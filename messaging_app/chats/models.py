@@ -6,13 +6,44 @@ The models are for users, messages, and conversations.
 import uuid
 
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import connections, models, transaction
 from django.utils import timezone
 
+from .ids import uuid7
+from .search import Match, fts_available, reserve_keys
 
-class CustomUser(AbstractUser):
+
+class DatabaseFieldsMixin:
+    """
+    Leave the fields named in `database_fields` as stored on updates.
+
+    Those fields are only written by UPDATE queries or triggers; saving
+    the value an instance was loaded with would undo them.
+    """
+
+    database_fields = ()
+
+    def save(self, *args, **kwargs):
+        """Save the instance, without the `database_fields` on updates."""
+        if not self._state.adding and not args and (
+                kwargs.get('update_fields') is None and
+                not kwargs.get('force_insert')):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.attname not in deferred and
+                field.name not in self.database_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class CustomUser(DatabaseFieldsMixin, AbstractUser):
     """Custom User model extending Django's AbstractUser."""
 
+    # Incremented by chats.membership.
+    database_fields = ('membership_version',)
+
     user_id = models.UUIDField(
         default=uuid.uuid4,
         unique=True,
@@ -47,6 +78,12 @@ class CustomUser(AbstractUser):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    membership_version = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Incremented when the user joins or leaves a conversation"
+    )
+
     groups = models.ManyToManyField(
         'auth.Group',
         verbose_name='groups',
@@ -82,13 +119,14 @@ class Conversation(models.Model):
 
     conversation_id = models.UUIDField(
         primary_key=True,
-        default=uuid.uuid4,
+        default=uuid7,
         editable=False,
         help_text="Unique UUID for conversations"
     )
 
     participants = models.ManyToManyField(
         CustomUser,
+        through='ConversationParticipant',
         related_name='conversations',
         help_text="Users involved in this conversation"
     )
@@ -99,6 +137,59 @@ class Conversation(models.Model):
         help_text="Timestamp when the conversation was created"
     )
 
+    # Activity counters, kept up to date by chats.activity in the same
+    # transaction as the message writes.
+    last_message_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Timestamp of the most recent message"
+    )
+
+    last_message = models.ForeignKey(
+        'Message',
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        help_text="The most recent message"
+    )
+
+    message_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Number of messages in the conversation"
+    )
+
+    # Change counter and time for conditional GETs, bumped by chats.activity
+    # whenever the messages or the participants of the conversation change.
+    version = models.PositiveBigIntegerField(
+        default=0,
+        editable=False,
+        help_text="Incremented on every change to the conversation"
+    )
+
+    updated_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Timestamp of the last change to the conversation"
+    )
+
+    # Kept up to date by chats.fingerprint on every membership change.
+    participant_set_hash = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=(
+            "Hash of the sorted participant ids; only the oldest "
+            "conversation of each participant set has one"
+        )
+    )
+
     class Meta:
         """Meta class for Conversation model."""
 
@@ -106,6 +197,19 @@ class Conversation(models.Model):
         verbose_name_plural = "Conversations"
         # Corrected typo: removed trailing hyphen from '-created_at-'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['-last_message_at'],
+                name='chats_conv_activity_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['participant_set_hash'],
+                condition=models.Q(participant_set_hash__isnull=False),
+                name='chats_conv_participant_set_uniq'
+            ),
+        ]
 
     def __str__(self):
         """Show a string representation of the Conversation."""
@@ -115,12 +219,103 @@ class Conversation(models.Model):
         )
 
 
-class Message(models.Model):
+class ConversationParticipant(models.Model):
+    """
+    Model representing the membership of a user in a conversation.
+
+    This is the through table of `Conversation.participants`, kept on the
+    table Django originally created for the many-to-many relation.
+    """
+
+    id = models.AutoField(primary_key=True)
+
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='memberships',
+        help_text="The conversation the user takes part in"
+    )
+
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        db_column='customuser_id',
+        db_index=False,
+        related_name='memberships',
+        help_text="The participating user"
+    )
+
+    # Read watermark: every message up to (last_read_at,
+    # last_read_message_id) in (sent_at, message_id) order has been read.
+    last_read_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Timestamp of the last message the user has read"
+    )
+
+    last_read_message_id = models.UUIDField(
+        null=True,
+        blank=True,
+        help_text="UUID of the last message the user has read"
+    )
+
+    read_version = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Incremented whenever the read watermark moves"
+    )
+
+    class Meta:
+        """Meta class for ConversationParticipant model."""
+
+        db_table = 'chats_conversation_participants'
+        unique_together = [('conversation', 'user')]
+        indexes = [
+            # "Conversations of this user"; also covers lookups by user.
+            models.Index(
+                fields=['user', 'conversation'],
+                name='chats_member_user_conv_idx'
+            ),
+        ]
+
+    def __str__(self):
+        """Show a string representation of the ConversationParticipant."""
+        return f"{self.user_id} in {self.conversation_id}"
+
+
+class MessageQuerySet(models.QuerySet):
+    """QuerySet of messages."""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Insert messages, with search keys reserved in a single statement.
+
+        Without them, the insert trigger of the search index would update
+        every new row to give it a key.
+        """
+        objs = list(objs)
+        unkeyed = [obj for obj in objs if obj.search_key is None]
+        if not unkeyed or not fts_available(connections[self.db]):
+            return super().bulk_create(objs, *args, **kwargs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            first = reserve_keys(len(unkeyed), connections[self.db])
+            for search_key, obj in enumerate(unkeyed, first):
+                obj.search_key = search_key
+            return super().bulk_create(objs, *args, **kwargs)
+
+
+class Message(DatabaseFieldsMixin, models.Model):
     """Model representing a single message within a conversation."""
 
+    # Set when the message is inserted, by MessageQuerySet.bulk_create or
+    # else by the insert trigger of the search index (chats.search).
+    database_fields = ('search_key',)
+
+    objects = MessageQuerySet.as_manager()
+
     message_id = models.UUIDField(
         primary_key=True,
-        default=uuid.uuid4,
+        default=uuid7,
         editable=False,
         help_text="Unique UUID for the message"
     )
@@ -128,6 +323,7 @@ class Message(models.Model):
     sender = models.ForeignKey(
         CustomUser,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='sent_messages',
         help_text="The user who sent this message"
     )
@@ -135,6 +331,7 @@ class Message(models.Model):
     conversation = models.ForeignKey(
         Conversation,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='messages',
         help_text="The conversation this message belongs to"
     )
@@ -148,12 +345,43 @@ class Message(models.Model):
         help_text="Timestamp when the message was sent"
     )
 
+    # Set whenever a sent message is saved again; chats.fragments uses it
+    # to tell cached encodings of the message apart.
+    edited_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Timestamp of the last edit of the message"
+    )
+
+    # The key of the message in the full-text index (chats.search), given
+    # when the message is inserted. Unlike the rowid, it survives table
+    # rebuilds.
+    search_key = models.BigIntegerField(
+        null=True,
+        unique=True,
+        editable=False,
+        help_text="Key of the message in the search index"
+    )
+
     class Meta:
         """Meta class for Message model."""
 
         verbose_name = "Message"
         verbose_name_plural = "Messages"
         ordering = ['sent_at']
+        # The composite indexes lead with the foreign keys, so they also
+        # serve the plain foreign key lookups.
+        indexes = [
+            models.Index(
+                fields=['conversation', 'sent_at', 'message_id'],
+                name='chats_msg_conv_sent_idx'
+            ),
+            models.Index(
+                fields=['sender', 'sent_at'],
+                name='chats_msg_sender_sent_idx'
+            ),
+        ]
 
     def __str__(self):
         """Show a string representation of the class."""
@@ -161,3 +389,97 @@ class Message(models.Model):
             f"Message {self.message_id} from {self.sender.username} "
             f"in {self.conversation.conversation_id}"
         )
+
+
+class MessageSearchIndex(models.Model):
+    """
+    Model reading the full-text index of message bodies.
+
+    The FTS5 table is created and kept up to date by chats.search, on
+    SQLite only; its rowid is the search key of the indexed message.
+    """
+
+    message = models.OneToOneField(
+        Message,
+        primary_key=True,
+        to_field='search_key',
+        db_column='rowid',
+        db_constraint=False,
+        on_delete=models.DO_NOTHING,
+        related_name='search_index',
+        help_text="The indexed message"
+    )
+
+    message_body = models.TextField(
+        help_text="The indexed text of the message"
+    )
+
+    rank = models.FloatField(
+        help_text="Relevance of the message to the MATCH query (bm25)"
+    )
+
+    class Meta:
+        """Meta class for MessageSearchIndex model."""
+
+        managed = False
+        db_table = 'chats_message_fts'
+
+    def __str__(self):
+        """Show a string representation of the MessageSearchIndex."""
+        return f"Search index entry of {self.message_id}"
+
+
+MessageSearchIndex._meta.get_field('message_body').register_lookup(Match)
+
+
+class InboxEntry(models.Model):
+    """
+    Model representing a conversation in a user's materialized inbox.
+
+    Optional fan-out-on-write copy of the membership table, enabled by
+    the `CHATS_INBOX_FANOUT` setting and maintained by chats.inbox. It
+    lets the conversation list be a single range scan per user.
+    """
+
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        db_index=False,
+        related_name='inbox_entries',
+        help_text="The user whose inbox this is"
+    )
+
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='inbox_entries',
+        help_text="The conversation listed in the inbox"
+    )
+
+    last_activity = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Timestamp of the most recent message"
+    )
+
+    unread_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of messages after the user's read watermark"
+    )
+
+    class Meta:
+        """Meta class for InboxEntry model."""
+
+        verbose_name = "Inbox entry"
+        verbose_name_plural = "Inbox entries"
+        unique_together = [('user', 'conversation')]
+        indexes = [
+            models.Index(
+                fields=['user', '-last_activity'],
+                name='chats_inbox_user_activity_idx'
+            ),
+        ]
+
+    def __str__(self):
+        """Show a string representation of the InboxEntry."""
+        return f"{self.conversation_id} in the inbox of {self.user_id}"
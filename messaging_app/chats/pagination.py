@@ -0,0 +1,191 @@
+"""Pagination classes for the chat app."""
+import uuid
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+from rest_framework.response import Response
+
+
+class MessageCursorPagination(CursorPagination):
+    """
+    Keyset pagination for messages ordered on (sent_at, message_id).
+
+    DRF's CursorPagination positions on the first ordering field only and
+    falls back to an OFFSET to step over rows sharing the same value. Here
+    the opaque cursor carries the full (sent_at, message_id) key of the
+    boundary row, so each page is a single range scan whatever its depth,
+    and rows inserted concurrently never shift the pages already handed out.
+    Without a cursor the first page is the oldest one, or the newest one
+    with `?from=latest`.
+    """
+
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('sent_at', 'message_id')
+    start_query_param = 'from'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Return one page of messages following the request's cursor."""
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            reverse, position = self.starts_from_latest(request), None
+        else:
+            reverse, position = self.cursor.reverse, self.cursor.position
+
+        if reverse:
+            queryset = queryset.order_by(
+                *('-' + field for field in self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(
+                position, reverse))
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.position = position
+        return self.page
+
+    def starts_from_latest(self, request):
+        """Return True if the request asks for the newest page first."""
+        return bool(self.start_query_param) and (
+            request.query_params.get(self.start_query_param) == 'latest')
+
+    def paginate_latest(self, rows, request, complete):
+        """
+        Return the newest page out of `rows`, the newest rows in order.
+
+        `complete` tells whether `rows` holds every row of the list; the
+        page has a previous page when it does not, or when more rows than
+        a page were given.
+        """
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.position = None
+        self.page = rows[max(len(rows) - self.page_size, 0):]
+        self.has_next = False
+        self.has_previous = len(self.page) < len(rows) or not complete
+        return self.page
+
+    def get_keyset_filter(self, position, reverse=False):
+        """Build the row-value comparison `ordering > position`."""
+        (first, second), (first_value, second_value) = self.ordering, position
+        op = 'lt' if reverse else 'gt'
+        return (
+            Q(**{f'{first}__{op}': first_value}) |
+            Q(**{first: first_value, f'{second}__{op}': second_value})
+        )
+
+    def get_next_link(self):
+        """Return the link to the page after the current one."""
+        if not self.has_next:
+            return None
+        if self.page:
+            position = self._get_position_from_instance(
+                self.page[-1], self.ordering)
+        else:
+            position = self.position
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        """Return the link to the page before the current one."""
+        if not self.has_previous:
+            return None
+        if self.page:
+            position = self._get_position_from_instance(
+                self.page[0], self.ordering)
+        else:
+            position = self.position
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=True, position=position))
+
+    def _get_position_from_instance(self, instance, ordering):
+        if isinstance(instance, dict):
+            return tuple(instance[field] for field in ordering)
+        return tuple(getattr(instance, field) for field in ordering)
+
+    def encode_cursor(self, cursor):
+        """Serialize the (sent_at, message_id) position into the cursor."""
+        sent_at, message_id = cursor.position
+        position = f'{sent_at.isoformat()}|{message_id.hex}'
+        return super().encode_cursor(cursor._replace(position=position))
+
+    def decode_cursor(self, request):
+        """Parse the (sent_at, message_id) position back out of the cursor."""
+        cursor = super().decode_cursor(request)
+        if cursor is None:
+            return None
+        if cursor.position is None:
+            return cursor
+
+        try:
+            sent_at, message_id = cursor.position.split('|')
+            sent_at = parse_datetime(sent_at)
+            message_id = uuid.UUID(hex=message_id)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if sent_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return cursor._replace(position=(sent_at, message_id))
+
+
+class SearchCursorPagination(MessageCursorPagination):
+    """
+    Keyset pagination for ranked search results.
+
+    Results are ordered on (search_rank, search_key): the full-text rank,
+    best first, then the search key of the message to break ties. Pages
+    say whether `truncated` left older matches out of the results.
+    """
+
+    ordering = ('search_rank', 'search_key')
+    start_query_param = None
+    truncated = False
+
+    def get_paginated_response(self, data):
+        """Return the page with its links and the truncation flag."""
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('truncated', self.truncated),
+            ('results', data),
+        ]))
+
+    def encode_cursor(self, cursor):
+        """Serialize the (rank, key) position into the cursor."""
+        rank, key = cursor.position
+        position = f'{rank!r}|{key}'
+        return super(MessageCursorPagination, self).encode_cursor(
+            cursor._replace(position=position))
+
+    def decode_cursor(self, request):
+        """Parse the (rank, key) position back out of the cursor."""
+        cursor = super(MessageCursorPagination, self).decode_cursor(request)
+        if cursor is None or cursor.position is None:
+            return cursor
+
+        try:
+            rank, key = cursor.position.split('|')
+            position = (float(rank), int(key))
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        return cursor._replace(position=position)
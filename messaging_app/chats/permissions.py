@@ -1,16 +1,47 @@
-# messaging_app/chats/permissions.py
-# This file can be used for custom permission classes, e.g.,
-# from rest_framework import permissions
-#
-# class IsOwnerOrReadOnly(permissions.BasePermission):
-#     """
-#     Custom permission to only allow owners of an object to edit it.
-#     """
-#     def has_object_permission(self, request, view, obj):
-#         # Read permissions are allowed to any request,
-#         # so we'll always allow GET, HEAD or OPTIONS requests.
-#         if request.method in permissions.SAFE_METHODS:
-#             return True
-#
-#         # Write permissions are only allowed to the owner of the snippet.
-#         return obj.owner == request.user
+"""Permission classes for the chat app."""
+import uuid
+
+from rest_framework import permissions
+from rest_framework.exceptions import NotFound
+
+from .membership import membership_cache
+from .models import Conversation
+
+
+class IsParticipantOfConversation(permissions.BasePermission):
+    """
+    Allow access only to participants of the conversation involved.
+
+    Under the nested `/conversations/{conversation_pk}/...` routes the URL
+    conversation is checked before the view runs; objects (conversations
+    and messages alike expose `conversation_id`) are checked against their
+    conversation. Answers come from the membership cache, so the common
+    path makes no membership query.
+    """
+
+    message = "You are not a participant in this conversation."
+
+    def has_permission(self, request, view):
+        """Check membership of the conversation in the URL, if any."""
+        if not (request.user and request.user.is_authenticated):
+            return False
+        conversation_pk = view.kwargs.get('conversation_pk')
+        if conversation_pk is None:
+            return True
+
+        try:
+            conversation_pk = uuid.UUID(str(conversation_pk))
+        except ValueError:
+            raise NotFound("Conversation not found.")
+        if membership_cache.is_member(
+                request.user.id, conversation_pk, request):
+            return True
+        # Only the refusal path tells a missing conversation apart.
+        if not Conversation.objects.filter(pk=conversation_pk).exists():
+            raise NotFound("Conversation not found.")
+        return False
+
+    def has_object_permission(self, request, view, obj):
+        """Check membership of the object's conversation."""
+        return membership_cache.is_member(
+            request.user.id, obj.conversation_id, request)
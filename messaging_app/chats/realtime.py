@@ -0,0 +1,385 @@
+"""
+Push chat events to connected clients.
+
+`hub` fans events out to the subscriptions held by this process, one per
+open WebSocket (`websocket_application`) or Server-Sent Events stream
+(`sse_application`), both mounted by `messaging_app.asgi`. A subscription
+only holds its user id, the ids of the user's conversations and a bounded
+queue of encoded events, so idle connections cost little memory; a
+client that falls too far behind is told to resynchronise over the REST
+API instead of being buffered without limit.
+
+Views publish through `publish_messages` and `publish_read`, which push
+once the surrounding transaction commits. With several server processes,
+set `CHATS_EVENT_BROKER_SOCKET` and run `manage.py run_event_broker`: the
+hub then relays its events to the other processes through `chats.broker`.
+Both transports need an ASGI server (e.g. `uvicorn
+messaging_app.asgi:application`).
+"""
+import asyncio
+import json
+import threading
+import uuid
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.utils.encoders import JSONEncoder
+
+from .auth import CachedJWTAuthentication
+from .broker import BrokerClient
+from .membership import membership_cache
+from .serializers import MessageSerializer
+
+WEBSOCKET_PATH = '/ws/events/'
+EVENTS_PATH = '/api/events/'
+
+# Sent in place of the queued events when a client falls behind.
+RESYNC_EVENT = json.dumps({'type': 'resync'})
+
+
+def encode_event(event):
+    """Encode an event the way the REST API renders the same data."""
+    return json.dumps(event, cls=JSONEncoder, separators=(',', ':'))
+
+
+class Subscription:
+    """The queue of encoded events waiting to be sent to one connection."""
+
+    __slots__ = ('user_id', 'conversation_ids', 'loop', 'queue')
+
+    def __init__(self, user_id, conversation_ids, loop, max_events):
+        """Create an empty subscription served by `loop`."""
+        self.user_id = user_id
+        self.conversation_ids = frozenset(conversation_ids)
+        self.loop = loop
+        self.queue = asyncio.Queue(max_events)
+
+    def push(self, data):
+        """Queue an encoded event; must run on the subscription's loop."""
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            # The client has missed events; it reloads over the REST API.
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC_EVENT)
+
+    async def get(self):
+        """Wait for the next encoded event."""
+        return await self.queue.get()
+
+
+class Hub:
+    """
+    Thread-safe registry of the subscriptions of this process.
+
+    When `relay` is set (a `BrokerClient`), published events are also
+    sent to the other processes, which `deliver` them to theirs.
+    """
+
+    def __init__(self, max_events=100):
+        """Create a hub whose subscriptions queue `max_events` events."""
+        self.max_events = max_events
+        self.relay = None
+        self._lock = threading.Lock()
+        self._by_conversation = {}
+        self._by_user = {}
+
+    def subscribe(self, user_id, conversation_ids):
+        """Subscribe the running event loop to the user's conversations."""
+        subscription = Subscription(
+            user_id, conversation_ids, asyncio.get_running_loop(),
+            self.max_events
+        )
+        with self._lock:
+            self._by_user.setdefault(user_id, set()).add(subscription)
+            self._index(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Forget a subscription; it receives no further events."""
+        with self._lock:
+            self._unindex(subscription)
+            subscriptions = self._by_user.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._by_user[subscription.user_id]
+
+    def is_subscribed(self, user_id):
+        """Return True if the user has an open connection here."""
+        return user_id in self._by_user
+
+    def has_subscribers(self, conversation_id):
+        """Return True if anyone here listens to the conversation."""
+        return conversation_id in self._by_conversation
+
+    def is_listened(self, conversation_id):
+        """Return True if an event of the conversation may reach anyone."""
+        return self.relay is not None or self.has_subscribers(conversation_id)
+
+    def update_conversations(self, user_id, conversation_ids):
+        """Move the user's subscriptions to a new set of conversations."""
+        conversation_ids = frozenset(conversation_ids)
+        with self._lock:
+            for subscription in self._by_user.get(user_id, ()):
+                self._unindex(subscription)
+                subscription.conversation_ids = conversation_ids
+                self._index(subscription)
+
+    def publish(self, conversation_id, event):
+        """
+        Send an event to the subscribers of a conversation.
+
+        The event is encoded once, whatever the number of subscribers and
+        processes. Returns the number of local subscriptions it was queued
+        for.
+        """
+        if not self.is_listened(conversation_id):
+            return 0
+        data = encode_event(event)
+        if self.relay is not None:
+            self.relay.publish(conversation_id, data)
+        return self.deliver(conversation_id, data)
+
+    def deliver(self, conversation_id, data):
+        """Queue an encoded event for the local subscribers only."""
+        with self._lock:
+            subscriptions = list(
+                self._by_conversation.get(conversation_id, ()))
+        for subscription in subscriptions:
+            self._push(subscription, data)
+        return len(subscriptions)
+
+    def resync(self):
+        """Tell every local subscriber that events may have been missed."""
+        with self._lock:
+            subscriptions = [
+                subscription for subscriptions in self._by_user.values()
+                for subscription in subscriptions
+            ]
+        for subscription in subscriptions:
+            self._push(subscription, RESYNC_EVENT)
+
+    def _push(self, subscription, data):
+        """Hand an encoded event to the subscription's event loop."""
+        try:
+            subscription.loop.call_soon_threadsafe(subscription.push, data)
+        except RuntimeError:
+            # The loop is closed: the connection died with it.
+            self.unsubscribe(subscription)
+
+    def _index(self, subscription):
+        """Register the subscription under its conversations."""
+        for conversation_id in subscription.conversation_ids:
+            self._by_conversation.setdefault(
+                conversation_id, set()).add(subscription)
+
+    def _unindex(self, subscription):
+        """Remove the subscription from its conversations."""
+        for conversation_id in subscription.conversation_ids:
+            subscriptions = self._by_conversation.get(conversation_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._by_conversation[conversation_id]
+
+
+hub = Hub(max_events=getattr(settings, 'CHATS_REALTIME_QUEUE_SIZE', 100))
+_relay_lock = threading.Lock()
+
+
+def connect_broker():
+    """Relay the hub through the event broker, if one is configured."""
+    path = getattr(settings, 'CHATS_EVENT_BROKER_SOCKET', None)
+    if not path or hub.relay is not None:
+        return
+    with _relay_lock:
+        if hub.relay is None:
+            relay = BrokerClient(
+                path, on_events=deliver_relayed, on_missed=hub.resync)
+            relay.start()
+            hub.relay = relay
+
+
+def deliver_relayed(events):
+    """Deliver the events another process published to the local hub."""
+    for conversation_id, data in events:
+        hub.deliver(uuid.UUID(conversation_id), data)
+
+
+def publish_messages(messages):
+    """Push new messages to their conversations once committed."""
+    connect_broker()
+    messages = list(messages)
+    transaction.on_commit(lambda: _publish_messages(messages))
+
+
+def _publish_messages(messages):
+    """Push new messages, serializing only those someone listens to."""
+    for message in messages:
+        if hub.is_listened(message.conversation_id):
+            hub.publish(message.conversation_id, {
+                'type': 'message',
+                'message': MessageSerializer(message).data,
+            })
+
+
+def publish_read(conversation_id, user_id, last_read_at, last_read_message_id):
+    """Push a read watermark change once committed."""
+    connect_broker()
+    event = {
+        'type': 'read',
+        'conversation_id': conversation_id,
+        'user_id': user_id,
+        'last_read_at': last_read_at,
+        'last_read_message_id': last_read_message_id,
+    }
+    transaction.on_commit(lambda: hub.publish(conversation_id, event))
+
+
+def refresh_subscriptions(user_ids):
+    """Follow membership changes of connected users once committed."""
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: _refresh_subscriptions(user_ids))
+
+
+def _refresh_subscriptions(user_ids):
+    """Reload the conversations of the connected users among `user_ids`."""
+    for user_id in user_ids:
+        if hub.is_subscribed(user_id):
+            hub.update_conversations(
+                user_id, membership_cache.get_conversation_ids(user_id))
+
+
+def authenticate_token(raw_token):
+    """Return the active user of a JWT access token, or None."""
+    if not raw_token:
+        return None
+    authentication = CachedJWTAuthentication()
+    try:
+        token = authentication.get_validated_token(raw_token.encode())
+        return authentication.get_user(token)
+    except AuthenticationFailed:
+        return None
+
+
+async def subscribe_user(user_id):
+    """Subscribe the running loop to every conversation of the user."""
+    connect_broker()
+    conversation_ids = await sync_to_async(
+        membership_cache.get_conversation_ids)(user_id)
+    return hub.subscribe(user_id, conversation_ids)
+
+
+async def websocket_application(scope, receive, send):
+    """
+    Serve `WEBSOCKET_PATH`: stream the user's events as text frames.
+
+    The access token comes from the `token` query parameter, since
+    browsers cannot set headers on WebSocket requests.
+    """
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    query = parse_qs(scope.get('query_string', b'').decode())
+    user = None
+    if scope['path'] == WEBSOCKET_PATH:
+        user = await sync_to_async(authenticate_token)(
+            query.get('token', [''])[0])
+    if user is None:
+        await send({'type': 'websocket.close', 'code': 4401})
+        return
+
+    subscription = await subscribe_user(user.id)
+    try:
+        await send({'type': 'websocket.accept'})
+        sender = asyncio.create_task(_send_events(subscription, send))
+        try:
+            while (await receive())['type'] != 'websocket.disconnect':
+                pass
+        finally:
+            sender.cancel()
+    finally:
+        hub.unsubscribe(subscription)
+
+
+async def _send_events(subscription, send):
+    """Forward the subscription's events to a WebSocket."""
+    while True:
+        text = await subscription.get()
+        await send({'type': 'websocket.send', 'text': text})
+
+
+async def sse_application(scope, receive, send):
+    """
+    Serve `EVENTS_PATH`: stream the user's events as Server-Sent Events.
+
+    The fallback for clients without WebSockets. Takes the access token
+    from the `Authorization` header or, for `EventSource`, from the
+    `token` query parameter, and sends a comment every
+    `CHATS_REALTIME_HEARTBEAT` seconds to keep idle proxies from closing
+    the stream. Served outside Django, whose ASGI handler does not watch
+    for `http.disconnect` while streaming: the stream, and its
+    subscription, would outlive the client.
+    """
+    query = parse_qs(scope.get('query_string', b'').decode())
+    raw_token = query.get('token', [''])[0]
+    headers = dict(scope.get('headers', ()))
+    header = headers.get(b'authorization', b'').decode('latin-1').split()
+    if len(header) == 2 and header[0] == 'Bearer':
+        raw_token = header[1]
+    user = await sync_to_async(authenticate_token)(raw_token)
+    if user is None:
+        await send({
+            'type': 'http.response.start',
+            'status': 401,
+            'headers': [(b'content-type', b'application/json')],
+        })
+        await send({'type': 'http.response.body', 'body': json.dumps(
+            {'detail': "Authentication credentials were not provided."}
+        ).encode()})
+        return
+
+    subscription = await subscribe_user(user.id)
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await _send_chunk(send, ': connected\n\n')
+        sender = asyncio.create_task(_stream_events(subscription, send))
+        try:
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+        finally:
+            sender.cancel()
+    finally:
+        hub.unsubscribe(subscription)
+
+
+async def _stream_events(subscription, send):
+    """Forward the subscription's events in Server-Sent Events framing."""
+    heartbeat = getattr(settings, 'CHATS_REALTIME_HEARTBEAT', 15)
+    while True:
+        try:
+            data = await asyncio.wait_for(subscription.get(), heartbeat)
+        except asyncio.TimeoutError:
+            await _send_chunk(send, ': ping\n\n')
+        else:
+            await _send_chunk(send, f'data: {data}\n\n')
+
+
+async def _send_chunk(send, text):
+    """Send a chunk of a streamed response."""
+    await send({
+        'type': 'http.response.body', 'body': text.encode(),
+        'more_body': True,
+    })
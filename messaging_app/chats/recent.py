@@ -0,0 +1,156 @@
+"""
+Buffers of the newest messages of busy conversations.
+
+Most message list reads ask for the newest page of a conversation
+(`?from=latest`), and most of those go to a few very active
+conversations. `recent_messages` keeps, for each conversation read this
+way, the encoded JSON of its newest `max_messages` messages along with
+the conversation's ETag validators, in a per-process LRU cache bounded
+by total size that evicts whole conversations. A newest page it holds is
+answered, conditional GET included, after reading the validators alone.
+
+A buffer is filled by a cold read of the newest page and extended by the
+messages sent through this process. It is only used while its validators
+are the conversation's current ones, read from the database with every
+request: `Conversation.version` is bumped in the transaction of every
+write to the conversation's messages, and of every rename of one of its
+participants or senders, so a change made through any process sends the
+next read to the database, which refills the buffer.
+"""
+from collections import namedtuple
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import transaction
+
+from .etags import conversation_validators
+from .fragments import encoding_version
+from .lru import ByteLRUCache
+from .renderers import encode_json
+from .serializers import MessageSerializer
+
+# Approximate memory taken by a buffer and by each of its messages,
+# besides the encoded messages themselves.
+BUFFER_OVERHEAD = 500
+MESSAGE_OVERHEAD = 200
+
+RecentMessage = namedtuple('RecentMessage', 'sent_at message_id fragment')
+
+# `messages` is a tuple, oldest first: buffers are replaced, never
+# modified, so readers on other threads can use them without a lock.
+Buffer = namedtuple('Buffer', 'encoding validators messages complete size')
+
+
+class RecentMessages:
+    """Bounded, versioned cache of conversation id -> newest messages."""
+
+    def __init__(self, max_messages=50, max_bytes=16 * 1024 * 1024):
+        """Create an empty cache of `max_messages` per conversation."""
+        self.max_messages = max_messages
+        self._buffers = ByteLRUCache(max_bytes, sizeof=attrgetter('size'))
+
+    def enabled(self):
+        """Return True when conversations may be buffered."""
+        return self.max_messages > 0 and self._buffers.max_bytes > 0
+
+    def get(self, conversation_id, validators, page_size):
+        """
+        Return the buffer of a conversation, or None.
+
+        The buffer must have been read at `validators`, the current ones
+        of the conversation, encoded like the current request and hold
+        at least a page of `page_size` messages.
+        """
+        buffer = self._buffers.get(conversation_id)
+        if buffer is None or validators[0] is None or (
+                buffer.validators != validators):
+            return None
+        if buffer.encoding != encoding_version():
+            return None
+        if len(buffer.messages) < page_size and not buffer.complete:
+            return None
+        return buffer
+
+    def fill(self, conversation_id, validators, messages, complete):
+        """
+        Buffer the newest messages of a conversation, read at `validators`.
+
+        `messages` are `RecentMessage`s, oldest first; `complete` tells
+        whether they are all the messages of the conversation.
+        """
+        if validators[0] is None:
+            return
+        messages = tuple(messages)
+        if len(messages) > self.max_messages:
+            messages = messages[-self.max_messages:]
+            complete = False
+        self._buffers.set(conversation_id, Buffer(
+            encoding_version(), validators, messages, complete,
+            BUFFER_OVERHEAD + sum(
+                len(message.fragment) + MESSAGE_OVERHEAD
+                for message in messages
+            )
+        ))
+
+    def extend(self, conversation_id, messages):
+        """
+        Append new messages of a conversation once the transaction commits.
+
+        Must run inside the transaction, after the conversation's version
+        was bumped. When this process buffers the conversation, the
+        messages are encoded now and appended on commit, provided nothing
+        else changed the conversation in between.
+        """
+        if self._buffers.get(conversation_id) is None:
+            return
+        validators = conversation_validators(conversation_id)
+        encoding = encoding_version()
+        messages = [
+            RecentMessage(
+                message.sent_at, message.message_id,
+                encode_json(MessageSerializer(message).data)
+            )
+            for message in messages
+        ]
+        transaction.on_commit(lambda: self._extend(
+            conversation_id, validators, encoding, messages))
+
+    def invalidate(self, conversation_ids):
+        """Drop the buffers of conversations once the transaction commits."""
+        conversation_ids = list(conversation_ids)
+        transaction.on_commit(lambda: self._invalidate(conversation_ids))
+
+    def clear(self):
+        """Drop every buffer held by this process."""
+        self._buffers.clear()
+
+    def _extend(self, conversation_id, validators, encoding, messages):
+        """Append committed messages to the buffer, or drop it."""
+        buffer = self._buffers.get(conversation_id)
+        if buffer is None:
+            return
+        # Appending is only right if this write is the only one since the
+        # buffer was read, and if the messages come after its own.
+        keys = [(message.sent_at, message.message_id) for message in messages]
+        if (validators[0] is None or
+                buffer.validators[0] != validators[0] - 1 or
+                buffer.encoding != encoding or keys != sorted(keys) or (
+                    buffer.messages and
+                    keys[0] <= buffer.messages[-1][:2])):
+            self._buffers.pop(conversation_id)
+            return
+        self.fill(
+            conversation_id, validators,
+            buffer.messages + tuple(messages), buffer.complete)
+
+    def _invalidate(self, conversation_ids):
+        """Drop the buffers of conversations."""
+        for conversation_id in conversation_ids:
+            self._buffers.pop(conversation_id)
+
+
+recent_messages = RecentMessages(
+    max_messages=getattr(settings, 'CHATS_RECENT_MESSAGES', 50),
+    max_bytes=getattr(
+        settings, 'CHATS_RECENT_MESSAGES_CACHE_BYTES', 16 * 1024 * 1024)
+)
@@ -0,0 +1,163 @@
+"""
+Fast renderers and parsers for the chat API.
+
+`ORJSONRenderer` and `ORJSONParser` replace DRF's JSON classes with
+orjson, which encodes a page of messages several times faster than the
+standard library and produces the same bytes: datetimes, decimals and
+lazy strings are still handed to DRF's encoder, so their format does not
+change, and U+2028 and U+2029, which orjson writes raw, are escaped as
+DRF escapes them. `MessagePackRenderer` and `MessagePackParser` offer
+the binary `application/msgpack` format to clients asking for it in
+`Accept` or `Content-Type`.
+
+Both libraries are optional: without orjson the DRF classes are used,
+and without msgpack the format is not offered. `RENDERER_CLASSES` and
+`PARSER_CLASSES` list what is available, in order of preference.
+`manage.py benchmark_renderers` compares them.
+
+`ORJSONRenderer` also renders `JSONFragments`, lists of values that are
+already encoded, by splicing their bytes into the output.
+"""
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import (
+    BaseParser,
+    FormParser,
+    JSONParser,
+    MultiPartParser
+)
+from rest_framework.renderers import (
+    BaseRenderer,
+    BrowsableAPIRenderer,
+    JSONRenderer
+)
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Converts what the fast encoders leave to DRF, as DRF's renderer does.
+encode_default = JSONEncoder().default
+
+# The UTF-8 of the line and paragraph separators, which DRF escapes since
+# JavaScript before ES2019 does not allow them raw in string literals.
+LINE_SEPARATORS = (
+    ('\u2028'.encode(), b'\\u2028'),
+    ('\u2029'.encode(), b'\\u2029'),
+)
+
+
+def encode_json(data):
+    """Encode `data` into the compact JSON `ORJSONRenderer` renders."""
+    encoded = orjson.dumps(
+        data, default=encode_default,
+        option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    )
+    # Both separators start with these bytes, rare outside punctuation.
+    if b'\xe2\x80' in encoded:
+        for raw, escaped in LINE_SEPARATORS:
+            encoded = encoded.replace(raw, escaped)
+    return encoded
+
+
+class JSONFragments(list):
+    """A list of values already encoded into JSON bytes."""
+
+
+def splices_fragments(request, renderer_context):
+    """Return True if the response to `request` may hold `JSONFragments`."""
+    renderer = request.accepted_renderer
+    return isinstance(renderer, ORJSONRenderer) and not renderer.get_indent(
+        request.accepted_media_type, renderer_context)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSON renderer backed by orjson.
+
+    Indented output (`Accept: application/json; indent=4`) is rare and
+    beyond what orjson supports, so it is left to DRF's renderer.
+    `JSONFragments`, alone or as values of the top-level object, are
+    spliced into compact output.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render `data` into compact UTF-8 JSON."""
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        return self.splice(data)
+
+    def splice(self, data):
+        """Encode `data`, copying the bytes of its `JSONFragments`."""
+        if isinstance(data, JSONFragments):
+            return b'[' + b','.join(data) + b']'
+        if isinstance(data, dict) and any(
+                isinstance(value, JSONFragments) for value in data.values()):
+            return b'{' + b','.join(
+                encode_json(key) + b':' + self.splice(value)
+                for key, value in data.items()
+            ) + b'}'
+        return encode_json(data)
+
+
+class ORJSONParser(JSONParser):
+    """JSON parser backed by orjson."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        """Parse a JSON request body."""
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Renderer for the `application/msgpack` format."""
+
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render `data` into MessagePack."""
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    """Parser for `application/msgpack` request bodies."""
+
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        """Parse a MessagePack request body."""
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError,
+                msgpack.StackError) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
+
+
+RENDERER_CLASSES = [
+    ORJSONRenderer if orjson is not None else JSONRenderer,
+    BrowsableAPIRenderer,
+]
+PARSER_CLASSES = [
+    ORJSONParser if orjson is not None else JSONParser,
+    FormParser,
+    MultiPartParser,
+]
+if msgpack is not None:
+    RENDERER_CLASSES.append(MessagePackRenderer)
+    PARSER_CLASSES.append(MessagePackParser)
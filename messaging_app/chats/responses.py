@@ -0,0 +1,211 @@
+"""
+Two-tier cache of rendered list and retrieve responses.
+
+The first tier is a per-process LRU cache bounded by total size; the
+second is the Django cache named by `CHATS_RESPONSE_CACHE_ALIAS`, when
+configured: a private directory every process of the host shares
+(`FileResponseCache`), so it works without any external service. A hit
+in the second tier is copied into the first.
+
+Keys are built from the validators of the conditional GET mixins of
+`chats.etags` (conversation or user versions, bumped by every write),
+the user, the full path and the negotiated media type. A write therefore
+never deletes anything: the entries of the old version simply stop
+being asked for, and age out of the first tier by LRU and of the second
+by its timeout. Renaming a user, which changes responses besides those
+of the conversations it bumps, retires every entry at once by replacing
+an epoch kept in the second tier; the ETags carry the epoch too.
+`stats()` counts hits, misses and evictions for this process.
+"""
+import hashlib
+import os
+import random
+import stat
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from .lru import ByteLRUCache
+
+# Approximate memory taken by an entry besides the response body.
+ENTRY_OVERHEAD = 300
+
+
+class FileResponseCache(FileBasedCache):
+    """
+    File-based cache that refuses a directory other users can reach.
+
+    Entries are pickled, so whoever can write to the directory can run
+    code in the server: the directory must belong to the server's user
+    and grant nothing to anyone else. Culling lists the whole directory,
+    so it runs at most once every `CULL_INTERVAL` seconds (an option, 60
+    by default) per process instead of on every store.
+    """
+
+    # Directory -> monotonic time of the last cull in this process.
+    last_culls = {}
+
+    def __init__(self, dir, params):
+        """Read the `CULL_INTERVAL` option."""
+        super().__init__(dir, params)
+        self.cull_interval = params.get('OPTIONS', {}).get(
+            'CULL_INTERVAL', 60)
+
+    def _cull(self):
+        """Remove random entries if there are too many, now and then."""
+        now = time.monotonic()
+        last = self.last_culls.get(self._dir)
+        if last is not None and now - last < self.cull_interval:
+            return
+        self.last_culls[self._dir] = now
+        super()._cull()
+
+    def _createdir(self):
+        """Create the directory if missing, then check its permissions."""
+        super()._createdir()
+        info = os.lstat(self._dir)
+        if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or
+                info.st_mode & 0o077):
+            raise ImproperlyConfigured(
+                f"The response cache directory {self._dir} must be a "
+                f"directory owned by the server's user, with mode 0700."
+            )
+
+
+class ResponseCache:
+    """Per-process LRU cache of rendered responses, over a shared cache."""
+
+    key_prefix = 'chats:response:'
+    epoch_key = 'chats:response:epoch'
+
+    def __init__(self, max_bytes, cache_alias=None, epoch_ttl=5):
+        """
+        Create an empty cache keeping `max_bytes` of responses here.
+
+        The shared epoch is read again after `epoch_ttl` seconds.
+        """
+        self.local = ByteLRUCache(
+            max_bytes, sizeof=lambda entry: len(entry[0]) + ENTRY_OVERHEAD)
+        self.cache_alias = cache_alias
+        self.epoch = 0
+        self.epoch_ttl = epoch_ttl
+        self._shared_epoch = None
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(
+            ('local_hits', 'shared_hits', 'misses', 'stores'), 0)
+
+    @property
+    def shared(self):
+        """Return the shared second tier, or None."""
+        if self.cache_alias not in settings.CACHES:
+            return None
+        return caches[self.cache_alias]
+
+    def enabled(self):
+        """Return True when responses may be cached."""
+        return self.local.max_bytes > 0
+
+    def make_key(self, *parts):
+        """Return the key of the response identified by `parts`."""
+        return hashlib.blake2b(
+            '|'.join(map(str, (self.get_epoch(),) + parts)).encode(),
+            digest_size=16
+        ).hexdigest()
+
+    def get_epoch(self):
+        """
+        Return the current epoch, shared by the processes if possible.
+
+        An epoch missing from the second tier is replaced by a random one,
+        so it never comes back to a value entries were stored under. The
+        shared epoch is kept here for `epoch_ttl` seconds, so another
+        process's rename takes up to that long to retire responses.
+        """
+        if self.shared is None:
+            return self.epoch
+        now = time.monotonic()
+        cached = self._shared_epoch
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        epoch = self.shared.get(self.epoch_key)
+        if epoch is None:
+            self.shared.add(
+                self.epoch_key, random.getrandbits(62), timeout=None)
+            epoch = self.shared.get(self.epoch_key, self.epoch)
+        self._shared_epoch = (epoch, now + self.epoch_ttl)
+        return epoch
+
+    def invalidate_all(self):
+        """Retire every entry, in every process, once committed."""
+        transaction.on_commit(self._invalidate_all)
+
+    def get(self, key):
+        """Return the `(content, content_type)` stored under `key`, or None."""
+        entry = self.local.get(key)
+        if entry is not None:
+            self._count('local_hits')
+            return entry
+        if self.shared is not None:
+            entry = self.shared.get(self.key_prefix + key)
+            if entry is not None:
+                self.local.set(key, entry)
+                self._count('shared_hits')
+                return entry
+        self._count('misses')
+        return None
+
+    def set(self, key, content, content_type):
+        """Store a rendered response in both tiers."""
+        entry = (bytes(content), content_type)
+        self.local.set(key, entry)
+        if self.shared is not None:
+            self.shared.set(self.key_prefix + key, entry)
+        self._count('stores')
+
+    def stats(self):
+        """Return the counters of this process and the size of its tier."""
+        with self._lock:
+            stats = dict(self._counts)
+        stats.update(
+            local_entries=len(self.local),
+            local_bytes=self.local.total_bytes,
+            local_max_bytes=self.local.max_bytes,
+            local_evictions=self.local.evictions,
+        )
+        return stats
+
+    def clear(self):
+        """Empty both tiers and reset the counters."""
+        self.local.clear()
+        self._shared_epoch = None
+        if self.shared is not None:
+            self.shared.clear()
+        with self._lock:
+            self._counts = dict.fromkeys(self._counts, 0)
+        self.local.evictions = 0
+
+    def _invalidate_all(self):
+        """Replace the epoch and empty this process's tier."""
+        self.epoch += 1
+        self._shared_epoch = None
+        if self.shared is not None:
+            self.shared.set(
+                self.epoch_key, random.getrandbits(62), timeout=None)
+        self.local.clear()
+
+    def _count(self, name):
+        """Add one to a counter."""
+        with self._lock:
+            self._counts[name] += 1
+
+
+response_cache = ResponseCache(
+    getattr(settings, 'CHATS_RESPONSE_CACHE_BYTES', 16 * 1024 * 1024),
+    cache_alias=getattr(settings, 'CHATS_RESPONSE_CACHE_ALIAS', None),
+    epoch_ttl=getattr(settings, 'CHATS_RESPONSE_CACHE_EPOCH_TTL', 5),
+)
@@ -0,0 +1,358 @@
+"""
+Read-only serialization of `values()` rows for the list endpoints.
+
+A `RowSerializer` produces the output of a DRF serializer without
+building model instances or running the serializer's per-field machinery
+for every row. The readable fields of its `serializer_class` are compiled
+once into accessors reading a `values()` row and converting the value as
+the field's `to_representation` would, so a row becomes a dict in one
+pass. Fields that are not a column (method fields, related lists, nested
+serializers) come from `get_<field name>(row)` methods instead, which may
+load what they need for the whole page at once in `prefetch(rows)`.
+Given the `fields` of a sparse fieldset, a row serializer only selects
+and renders those.
+
+The output must stay identical to the serializer's; `RowSerializerTests`
+compares the rendered bytes of both paths.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.db.models.functions import Cast
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .fieldsets import latest_messages
+from .models import ConversationParticipant, Message
+from .serializers import (
+    ConversationSerializer,
+    ConversationSummarySerializer,
+    MessageSerializer
+)
+
+# Fields whose `to_representation` is a plain type conversion.
+CONVERTERS = {
+    serializers.CharField: str,
+    serializers.EmailField: str,
+    serializers.IntegerField: int,
+}
+
+
+def compile_converter(field, tzinfo):
+    """Return a function equivalent to `field.to_representation`."""
+    if type(field) in CONVERTERS:
+        return CONVERTERS[type(field)]
+    if type(field) is serializers.UUIDField and (
+            field.uuid_format == 'hex_verbose'):
+        return str
+    if type(field) is serializers.DateTimeField:
+        return compile_datetime_converter(field, tzinfo)
+    return field.to_representation
+
+
+def compile_datetime_converter(field, tzinfo):
+    """Return the ISO 8601 formatting of a `DateTimeField` in `tzinfo`."""
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if (output_format is None or output_format.lower() != ISO_8601 or
+            not settings.USE_TZ or hasattr(field, 'timezone')):
+        return field.to_representation
+
+    def convert(value):
+        value = value.astimezone(tzinfo).isoformat()
+        if value.endswith('+00:00'):
+            return value[:-6] + 'Z'
+        return value
+    return convert
+
+
+def format_uuid_text(value):
+    """Format a UUID read as text like `str(uuid.UUID(value))`."""
+    if len(value) == 32:
+        return (
+            f'{value[:8]}-{value[8:12]}-{value[12:16]}-{value[16:20]}-'
+            f'{value[20:]}'
+        )
+    return value
+
+
+def resolve_column(model, lookup):
+    """Return the model field holding the column `lookup` reads."""
+    *relations, name = lookup.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    field = model._meta.get_field(name)
+    if field.is_relation:
+        return field.target_field
+    return field
+
+
+class RowSerializer:
+    """
+    Serialize `values()` rows like `serializer_class` serializes objects.
+
+    `extra_lookups` names the additional columns read from every row,
+    and `method_lookups` those the `get_<field>` method of a field reads
+    when the field is rendered. UUID columns rendered as strings are
+    selected as text and formatted directly, which skips building a
+    `uuid.UUID` for each value; `restore_keys` converts those a paginator
+    orders on back for the rows it takes its cursors from. `serialize`
+    must be given rows from the same instance's `values`.
+    """
+
+    serializer_class = None
+    extra_lookups = ()
+    method_lookups = {}
+
+    def __init__(self, fields=None):
+        """Compile the fields of `serializer_class` on first use."""
+        cls = type(self)
+        if '_columns' not in cls.__dict__:
+            cls._columns = cls.compile()
+            cls._lookups = cls.get_lookups(cls._columns)
+        self.fields = fields
+        if fields is not None:
+            self._columns = tuple(
+                column for column in self._columns if column[0] in fields)
+            self._lookups = self.get_lookups(self._columns)
+
+    @classmethod
+    def compile(cls):
+        """Return the (name, method, lookup, field) of each output field."""
+        columns = []
+        for name, field in cls.serializer_class().fields.items():
+            if field.write_only:
+                continue
+            method = f'get_{name}'
+            if hasattr(cls, method):
+                columns.append((name, method, None, None))
+                continue
+            if isinstance(field, (
+                    serializers.SerializerMethodField,
+                    serializers.RelatedField,
+                    serializers.ManyRelatedField,
+                    serializers.BaseSerializer)):
+                raise ImproperlyConfigured(
+                    f"{cls.__name__} needs a {method}() method for the "
+                    f"{name!r} field."
+                )
+            columns.append((name, None, '__'.join(field.source_attrs), field))
+        return tuple(columns)
+
+    @classmethod
+    def get_lookups(cls, columns):
+        """Return the columns to select for rendering `columns`."""
+        lookups = []
+        for name, method, lookup, _ in columns:
+            if method is None:
+                lookups.append(lookup)
+            else:
+                lookups.extend(cls.method_lookups.get(name, ()))
+        return tuple(lookups) + tuple(cls.extra_lookups)
+
+    @property
+    def field_names(self):
+        """Return the names of the rendered fields, in order."""
+        return [name for name, *_ in self._columns]
+
+    def wants(self, *names):
+        """Return True if any of the named fields is rendered."""
+        return self.fields is None or not self.fields.isdisjoint(names)
+
+    def values(self, queryset, *keys):
+        """Return `queryset` as rows of the columns to serialize and `keys`."""
+        model = self.serializer_class.Meta.model
+        self.text_lookups = {
+            lookup: column
+            for _, _, lookup, field in self._columns
+            if lookup is not None and lookup not in self.extra_lookups and
+            compile_converter(field, None) is str and
+            isinstance(column := resolve_column(model, lookup),
+                       models.UUIDField)
+        }
+        self.text_keys = [key for key in keys if key in self.text_lookups]
+        lookups = dict.fromkeys(
+            lookup for lookup in self._lookups + keys
+            if lookup not in self.text_lookups
+        )
+        return queryset.prefetch_related(None).values(*lookups, **{
+            f'{lookup}_text': Cast(lookup, models.CharField())
+            for lookup in self.text_lookups
+        })
+
+    def restore_keys(self, rows):
+        """Add the typed value of the keys read as text to `rows`."""
+        for row in rows:
+            for key in self.text_keys:
+                row[key] = self.text_lookups[key].to_python(
+                    row[f'{key}_text'])
+
+    def prefetch(self, rows):
+        """Load what the `get_<field>` methods need for `rows`."""
+
+    def serialize(self, rows):
+        """Return the representation of every row."""
+        rows = list(rows)
+        self.tzinfo = timezone.get_current_timezone()
+        self.prefetch(rows)
+        fields = [
+            (name, getattr(self, method), None, None) if method else
+            (name, None, f'{lookup}_text', format_uuid_text)
+            if lookup in self.text_lookups else
+            (name, None, lookup, compile_converter(field, self.tzinfo))
+            for name, method, lookup, field in self._columns
+        ]
+        results = []
+        for row in rows:
+            data = {}
+            for name, get, lookup, convert in fields:
+                if get is not None:
+                    data[name] = get(row)
+                    continue
+                value = row[lookup]
+                data[name] = None if value is None else convert(value)
+            results.append(data)
+        return results
+
+
+class MessageRows(RowSerializer):
+    """Rows of `MessageSerializer`."""
+
+    serializer_class = MessageSerializer
+
+
+def load_participants(conversation_ids):
+    """Return the (id, username) of each conversation's participants."""
+    participants = {pk: [] for pk in conversation_ids}
+    memberships = ConversationParticipant.objects.filter(
+        conversation_id__in=conversation_ids
+    ).order_by('user_id').values_list(
+        'conversation_id', 'user_id', 'user__username')
+    for conversation_id, user_id, username in memberships:
+        participants[conversation_id].append((user_id, username))
+    return participants
+
+
+class ConversationSummaryRows(RowSerializer):
+    """Rows of `ConversationSummarySerializer`."""
+
+    serializer_class = ConversationSummarySerializer
+    extra_lookups = ('conversation_id',)
+    method_lookups = {
+        'last_message': (
+            'last_message_pk', 'last_message_sender',
+            'last_message_preview', 'last_activity'
+        ),
+    }
+
+    def prefetch(self, rows):
+        """Load the participants of the page's conversations."""
+        self.participants = {}
+        if self.wants('participants', 'participants_usernames'):
+            self.participants = load_participants(
+                [row['conversation_id'] for row in rows])
+        self.format_datetime = compile_datetime_converter(
+            serializers.DateTimeField(), self.tzinfo)
+
+    def get_participants(self, row):
+        """Return the participant ids."""
+        return [pk for pk, _ in self.participants[row['conversation_id']]]
+
+    def get_participants_usernames(self, row):
+        """Return the participant usernames."""
+        return [
+            username
+            for _, username in self.participants[row['conversation_id']]
+        ]
+
+    def get_last_message(self, row):
+        """Return the preview of the most recent message, if any."""
+        if row['last_message_pk'] is None:
+            return None
+        return {
+            'message_id': str(row['last_message_pk']),
+            'sender_username': row['last_message_sender'],
+            'message_body': row['last_message_preview'],
+            'sent_at': self.format_datetime(row['last_activity']),
+        }
+
+
+class ConversationRows(RowSerializer):
+    """Rows of `ConversationSerializer`, messages included."""
+
+    serializer_class = ConversationSerializer
+    extra_lookups = ('conversation_id',)
+
+    def __init__(self, fields=None, messages_limit=None):
+        """Render `fields`, and at most `messages_limit` messages each."""
+        super().__init__(fields)
+        self.messages_limit = messages_limit
+
+    def prefetch(self, rows):
+        """Load the participants and messages of the page's conversations."""
+        conversation_ids = [row['conversation_id'] for row in rows]
+        self.participants = self.messages = {}
+        if self.wants('participants', 'participants_usernames'):
+            self.participants = load_participants(conversation_ids)
+        if not self.wants('messages'):
+            return
+        self.messages = {pk: [] for pk in conversation_ids}
+        if self.messages_limit == 0:
+            return
+        messages = Message.objects.filter(
+            conversation_id__in=conversation_ids)
+        if self.messages_limit is None:
+            messages = messages.order_by('sent_at', 'message_id')
+        else:
+            messages = latest_messages(messages, self.messages_limit)
+        message_rows = MessageRows()
+        messages = message_rows.values(messages, 'conversation_id')
+        messages = list(messages)
+        message_rows.restore_keys(messages)
+        for row, data in zip(messages, message_rows.serialize(messages)):
+            self.messages[row['conversation_id']].append(data)
+
+    get_participants = ConversationSummaryRows.get_participants
+    get_participants_usernames = (
+        ConversationSummaryRows.get_participants_usernames)
+
+    def get_messages(self, row):
+        """Return the serialized messages of the conversation."""
+        return self.messages[row['conversation_id']]
+
+
+class RowListMixin:
+    """
+    Serve `list` from `get_row_serializer`, when it returns one.
+
+    Pages are fetched as `values()` rows, including the columns the
+    paginator orders on.
+    """
+
+    def get_row_serializer(self):
+        """Return the row serializer of the response, or None."""
+        return None
+
+    def list(self, request, *args, **kwargs):
+        """Return the list of the filtered queryset."""
+        return self.list_queryset(self.filter_queryset(self.get_queryset()))
+
+    def list_queryset(self, queryset):
+        """Paginate and serialize `queryset`, as rows when possible."""
+        row_serializer = self.get_row_serializer()
+        if row_serializer is None:
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                return self.get_paginated_response(
+                    self.get_serializer(page, many=True).data)
+            return Response(self.get_serializer(queryset, many=True).data)
+
+        ordering = getattr(self.paginator, 'ordering', ())
+        rows = row_serializer.values(queryset, *ordering)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            # The cursors are built from the first and last rows.
+            row_serializer.restore_keys(page[:1] + page[-1:])
+            return self.get_paginated_response(row_serializer.serialize(page))
+        return Response(row_serializer.serialize(rows))
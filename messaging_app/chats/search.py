@@ -0,0 +1,262 @@
+"""
+Full-text search over message bodies.
+
+On SQLite, `chats_message_fts` is an FTS5 index of `Message.message_body`
+that stores no text of its own (an external content table). It is keyed
+on `Message.search_key` rather than on the rowid of `chats_message`, which
+a VACUUM or a migration rebuilding the table may renumber. Triggers keep
+the index in step with every insert, update and delete, bulk ones
+included. The insert trigger gives the next key to a message inserted
+without one; `Message.objects.bulk_create` inserts its messages with
+keys reserved by `reserve_keys` instead. Queries join the index
+through the unmanaged `MessageSearchIndex` model and its `match` lookup.
+
+A migration rebuilding `chats_message` drops its triggers. `ensure` puts
+them back after every `migrate` (see `chats.signals`) and reindexes the
+messages when any was missing; `manage.py rebuild_message_search` does
+the same on demand and `--check` tells whether it is needed.
+
+Ranking every match of a common word costs time in proportion to the
+number of matches, so only the most recent `CHATS_SEARCH_CANDIDATES`
+matches in the index are ranked, found by walking the index backwards by
+search key without ranking or joining the messages; the ones the user
+can see are returned. Older matches are left out, which
+`search_messages` reports.
+
+Other databases fall back to a case-insensitive substring match.
+"""
+import re
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import F, Lookup
+
+FTS_TABLE = 'chats_message_fts'
+
+KEYS_TABLE = 'chats_message_search_keys'
+
+TRIGGERS = ('ai', 'ad', 'au')
+
+CREATE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "message_body, content='chats_message', content_rowid='search_key', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    # The last search key handed out by reserve_keys, in a single row.
+    f"CREATE TABLE IF NOT EXISTS {KEYS_TABLE} "
+    "(last_key INTEGER NOT NULL)",
+    f"INSERT INTO {KEYS_TABLE}(last_key) SELECT 0 "
+    f"WHERE NOT EXISTS (SELECT 1 FROM {KEYS_TABLE})",
+    # A new message without a key gets the next one; the update indexes it.
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai "
+    "AFTER INSERT ON chats_message "
+    "BEGIN UPDATE chats_message SET search_key = ("
+    "SELECT IFNULL(MAX(search_key), 0) + 1 FROM chats_message "
+    "WHERE search_key IS NOT NULL"
+    ") WHERE rowid = new.rowid AND new.search_key IS NULL; "
+    f"INSERT INTO {FTS_TABLE}(rowid, message_body) "
+    "SELECT new.search_key, new.message_body "
+    "WHERE new.search_key IS NOT NULL; END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad "
+    "AFTER DELETE ON chats_message "
+    f"BEGIN INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message_body) "
+    "SELECT 'delete', old.search_key, old.message_body "
+    "WHERE old.search_key IS NOT NULL; END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au "
+    "AFTER UPDATE OF message_body, search_key ON chats_message "
+    f"BEGIN INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message_body) "
+    "SELECT 'delete', old.search_key, old.message_body "
+    "WHERE old.search_key IS NOT NULL; "
+    f"INSERT INTO {FTS_TABLE}(rowid, message_body) "
+    "SELECT new.search_key, new.message_body "
+    "WHERE new.search_key IS NOT NULL; END",
+)
+
+DROP_SQL = tuple(
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{trigger}" for trigger in TRIGGERS
+) + (
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+    f"DROP TABLE IF EXISTS {KEYS_TABLE}",
+)
+
+# Keys for the messages that have none, after the largest one, in rowid
+# order. The subquery does not depend on the row, so it runs once.
+ASSIGN_KEYS_SQL = (
+    "UPDATE chats_message SET search_key = rowid + ("
+    "SELECT IFNULL(MAX(search_key), 0) FROM chats_message "
+    "WHERE search_key IS NOT NULL"
+    ") WHERE search_key IS NULL"
+)
+
+# Keys handed out are above every key in use and every key reserved
+# before. Updating the row first holds the write lock of the database
+# until the transaction inserting the messages ends.
+RESERVE_KEYS_SQL = (
+    f"UPDATE {KEYS_TABLE} SET last_key = MAX(last_key, ("
+    "SELECT IFNULL(MAX(search_key), 0) FROM chats_message"
+    ")) + %s RETURNING last_key"
+)
+
+TOKEN_RE = re.compile(r'\w+\*?')
+
+
+class Match(Lookup):
+    """`message_body__match=query`: the rows matching an FTS5 query."""
+
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        """Return the MATCH constraint."""
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+def fts_available(using=None):
+    """Return True when the database has the FTS5 index."""
+    return (using or connection).vendor == 'sqlite'
+
+
+def install(schema_editor):
+    """Create the index and its triggers, and index existing messages."""
+    if not fts_available(schema_editor.connection):
+        return
+    rebuild(schema_editor.connection)
+
+
+def uninstall(schema_editor):
+    """Drop the index and its triggers."""
+    if not fts_available(schema_editor.connection):
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+def rebuild(using=None):
+    """
+    Reindex every message from `chats_message`.
+
+    Messages without a search key get one first, and the index and any
+    missing trigger are created.
+    """
+    with (using or connection).cursor() as cursor:
+        cursor.execute(ASSIGN_KEYS_SQL)
+        for sql in CREATE_SQL:
+            cursor.execute(sql)
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def missing_objects(using=None):
+    """Return the names of the index tables and triggers that are missing."""
+    names = [FTS_TABLE, KEYS_TABLE] + [
+        f'{FTS_TABLE}_{trigger}' for trigger in TRIGGERS]
+    with (using or connection).cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name IN (%s)"
+            % ', '.join(['%s'] * len(names)), names)
+        found = {name for name, in cursor.fetchall()}
+    return [name for name in names if name not in found]
+
+
+def ensure(using=None):
+    """
+    Reinstall the index and its triggers if any is missing.
+
+    Returns True if the index had to be rebuilt. Does nothing before the
+    migration adding `Message.search_key`.
+    """
+    using = using or connection
+    if not fts_available(using):
+        return False
+    with using.cursor() as cursor:
+        columns = using.introspection.get_table_description(
+            cursor, 'chats_message')
+    if 'search_key' not in {column.name for column in columns}:
+        return False
+    if not missing_objects(using):
+        return False
+    rebuild(using)
+    return True
+
+
+def check(using=None):
+    """
+    Return True if the index matches the messages.
+
+    The index is out of date when a trigger is missing, when a message
+    has no search key or when the FTS5 integrity check fails.
+    """
+    if missing_objects(using):
+        return False
+    with (using or connection).cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM chats_message WHERE search_key IS NULL LIMIT 1")
+        if cursor.fetchone() is not None:
+            return False
+        try:
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) "
+                "VALUES ('integrity-check', 1)")
+        except DatabaseError:
+            return False
+    return True
+
+
+def reserve_keys(count, using=None):
+    """
+    Reserve `count` consecutive search keys and return the first one.
+
+    Call it in the transaction inserting the messages that get the keys:
+    it keeps other connections from inserting messages until then.
+    """
+    with (using or connection).cursor() as cursor:
+        cursor.execute(RESERVE_KEYS_SQL, [count])
+        last_key, = cursor.fetchone()
+    return last_key - count + 1
+
+
+def to_match_query(text):
+    """
+    Turn user input into an FTS5 query matching every word.
+
+    Words are quoted so that FTS5 operators and punctuation in the input
+    are searched for literally; a trailing `*` keeps prefix matching.
+    Returns None when the input has no word.
+    """
+    terms = []
+    for token in TOKEN_RE.findall(text):
+        word, prefix = token.rstrip('*'), token.endswith('*')
+        terms.append(f'"{word}"' + ('*' if prefix else ''))
+    return ' '.join(terms) or None
+
+
+def search_messages(messages, text):
+    """
+    Restrict a message queryset to the messages matching `text`.
+
+    Returns a (matches, truncated) pair, or None when `text` has no word.
+    With the FTS5 index, the matches are annotated with `search_rank`
+    (bm25, lower is better), the ordering of `SearchCursorPagination`
+    with `search_key`, and `truncated` is True when older matches were
+    left out of the candidates.
+    """
+    query = to_match_query(text)
+    if query is None:
+        return None
+    if not fts_available():
+        return messages.filter(message_body__icontains=text.strip()), False
+
+    matches = messages.filter(search_index__message_body__match=query)
+    index = messages.model._meta.get_field('search_index').related_model
+    candidates = getattr(settings, 'CHATS_SEARCH_CANDIDATES', 5000)
+    # The oldest candidate, and the match before it if there is one. The
+    # index returns its rows by key, newest first, without ranking them;
+    # the messages are only joined for the candidates.
+    floor = list(index.objects.using(messages.db).filter(
+        message_body__match=query,
+    ).order_by('-message_id').values_list(
+        'message_id', flat=True)[candidates - 1:candidates + 1])
+    truncated = len(floor) > 1
+    if floor:
+        matches = matches.filter(search_index__message_id__gte=floor[0])
+    return matches.annotate(search_rank=F('search_index__rank')), truncated
@@ -18,16 +18,38 @@ class CustomUserSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'user_id', 'created_at')
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class SparseFieldsSerializerMixin:
+    """
+    Keep only the readable fields named by the `fields` argument.
+
+    `fields=None` keeps every field. Write-only fields are always kept,
+    so the serializer accepts the same input whatever it renders.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        """Drop the readable fields not in `fields`."""
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name, field in list(self.fields.items()):
+                if name not in fields and not field.write_only:
+                    self.fields.pop(name)
+
+
+class MessageSerializer(SparseFieldsSerializerMixin,
+                        serializers.ModelSerializer):
     """
     Serializer for the Message model.
 
     Includes read-only fields for sender username and conversation ID.
+    The conversation ID is read from the foreign key column, so it never
+    loads the related conversation. The sender and the conversation are
+    only set when the message is created: an edit cannot move a message
+    into another conversation or give it another sender.
     """
 
-    sender_username = serializers.CharField(source='sender.username')
-    conversation_id = serializers.CharField(
-        source='conversation.conversation_id')
+    sender_username = serializers.CharField(
+        source='sender.username', read_only=True)
+    conversation_id = serializers.CharField(read_only=True)
 
     class Meta:
         """Show meta fields."""
@@ -39,19 +61,45 @@ class MessageSerializer(serializers.ModelSerializer):
         )
         read_only_fields = ('message_id', 'sent_at')
         extra_kwargs = {
-            'sender': {'write_only': True},
-            'conversation': {'write_only': True}
+            'sender': {'write_only': True, 'required': False},
+            'conversation': {'write_only': True, 'required': False}
         }
 
+    def get_fields(self):
+        """Leave out the sender and the conversation on updates."""
+        fields = super().get_fields()
+        if self.instance is not None:
+            del fields['sender'], fields['conversation']
+        return fields
+
+
+class BulkMessageSerializer(serializers.Serializer):
+    """
+    Serializer for one item of a bulk message upload.
 
-class ConversationSerializer(serializers.ModelSerializer):
+    Only validates the input shape; membership of the conversations is
+    checked by the view for the whole batch at once.
+    """
+
+    conversation = serializers.UUIDField(required=False)
+    message_body = serializers.CharField()
+
+
+class ConversationSerializer(SparseFieldsSerializerMixin,
+                             serializers.ModelSerializer):
     """
     Serialzer for the Conversation model.
 
     Includes nested MessageSerializer to show messages within a conversation.
-    Also includes a list of participant usernames.
+    Also includes a list of participant usernames. `participants` is
+    declared, as DRF leaves relations with a custom through model
+    read-only, and its membership rows are written by `create` and
+    `update`.
     """
 
+    participants = serializers.PrimaryKeyRelatedField(
+        many=True, queryset=CustomUser.objects.all())
+
     messages = MessageSerializer(many=True, read_only=True)
 
     participants_usernames = serializers.SerializerMethodField()
@@ -85,3 +133,63 @@ class ConversationSerializer(serializers.ModelSerializer):
                 "A conversation must have at least two participants."
             )
         return value
+
+    def create(self, validated_data):
+        """Create the conversation, then its memberships."""
+        participants = validated_data.pop('participants')
+        conversation = super().create(validated_data)
+        conversation.participants.set(participants)
+        # The default of `created_at` is a datetime; render the stored date.
+        conversation.refresh_from_db(fields=['created_at'])
+        return conversation
+
+    def update(self, instance, validated_data):
+        """Update the conversation, and its memberships when given."""
+        participants = validated_data.pop('participants', None)
+        conversation = super().update(instance, validated_data)
+        if participants is not None:
+            conversation.participants.set(participants)
+        return conversation
+
+
+class ConversationSummarySerializer(SparseFieldsSerializerMixin,
+                                    serializers.ModelSerializer):
+    """
+    Inbox summary of a Conversation.
+
+    Shows the participants, a preview of the last message, the last
+    activity time and the unread count instead of the whole history. The
+    last message and unread count fields read annotations added by
+    `ConversationViewSet`, so no per-conversation queries are made.
+    """
+
+    participants_usernames = serializers.SerializerMethodField()
+    last_message = serializers.SerializerMethodField()
+    last_activity = serializers.DateTimeField(read_only=True)
+    unread_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        """Show meta fields."""
+
+        model = Conversation
+        fields = (
+            'conversation_id', 'participants', 'participants_usernames',
+            'created_at', 'last_message', 'last_activity', 'unread_count'
+        )
+        read_only_fields = fields
+
+    def get_participants_usernames(self, obj):
+        """Return a list of usernames for all participants."""
+        return [user.username for user in obj.participants.all()]
+
+    def get_last_message(self, obj):
+        """Return a preview of the most recent message, if any."""
+        if obj.last_message_pk is None:
+            return None
+        return {
+            'message_id': str(obj.last_message_pk),
+            'sender_username': obj.last_message_sender,
+            'message_body': obj.last_message_preview,
+            'sent_at': self.fields['last_activity'].to_representation(
+                obj.last_activity),
+        }
@@ -0,0 +1,169 @@
+"""Signal handlers of the chat app."""
+from django.db import connections
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_migrate,
+    post_save,
+    pre_save
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import inbox, search
+from .activity import record_conversations_changed
+from .auth import cached_users
+from .fingerprint import refresh_participant_set_hashes
+from .fragments import forget_messages
+from .membership import membership_cache
+from .models import Conversation, ConversationParticipant, CustomUser, Message
+from .realtime import refresh_subscriptions
+from .recent import recent_messages
+from .responses import response_cache
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def sync_inbox_on_participants_change(sender, instance, action, reverse,
+                                      pk_set, **kwargs):
+    """Keep the inbox table in step with `Conversation.participants`."""
+    if not inbox.fanout_enabled() or not action.startswith('post_'):
+        return
+    ids = list(pk_set) if pk_set is not None else None
+    if reverse:
+        inbox.sync(conversation_ids=ids, user_ids=[instance.pk])
+    else:
+        inbox.sync(conversation_ids=[instance.pk], user_ids=ids)
+
+
+@receiver(post_save, sender=ConversationParticipant)
+@receiver(post_delete, sender=ConversationParticipant)
+def sync_inbox_on_membership_change(sender, instance, **kwargs):
+    """Keep the inbox table in step with direct membership writes."""
+    if inbox.fanout_enabled():
+        inbox.sync([instance.conversation_id], [instance.user_id])
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def invalidate_memberships_on_participants_change(sender, instance, action,
+                                                  reverse, pk_set, **kwargs):
+    """Invalidate the cached memberships of the users involved."""
+    if reverse:
+        if action.startswith('post_'):
+            memberships_changed([instance.pk])
+    elif action == 'pre_clear':
+        # The participants are gone by post_clear; remember them now.
+        instance._cleared_participant_ids = list(
+            instance.participants.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        memberships_changed(
+            getattr(instance, '_cleared_participant_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        memberships_changed(pk_set)
+
+
+@receiver(post_save, sender=ConversationParticipant)
+@receiver(post_delete, sender=ConversationParticipant)
+def invalidate_membership_on_membership_change(sender, instance, **kwargs):
+    """Invalidate the cached memberships of the user involved."""
+    memberships_changed([instance.user_id])
+
+
+def memberships_changed(user_ids):
+    """Drop cached memberships and move the users' live subscriptions."""
+    user_ids = list(user_ids)
+    membership_cache.invalidate(user_ids)
+    refresh_subscriptions(user_ids)
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def refresh_conversations_on_participants_change(sender, instance, action,
+                                                 reverse, pk_set, **kwargs):
+    """Update the conversations whose participants changed."""
+    if action == 'pre_clear' and reverse:
+        # The memberships are gone by post_clear; remember them now.
+        instance._cleared_conversation_ids = list(
+            instance.conversations.values_list('pk', flat=True))
+    elif not action.startswith('post_'):
+        return
+    elif not reverse:
+        participants_changed([instance.pk])
+    elif action == 'post_clear':
+        participants_changed(
+            getattr(instance, '_cleared_conversation_ids', []))
+    else:
+        participants_changed(pk_set)
+
+
+@receiver(post_save, sender=ConversationParticipant)
+@receiver(post_delete, sender=ConversationParticipant)
+def refresh_conversation_on_membership_change(sender, instance, **kwargs):
+    """Update the conversation after a direct membership write."""
+    if kwargs.get('created', True):
+        participants_changed([instance.conversation_id])
+
+
+def participants_changed(conversation_ids):
+    """Refresh the fingerprints and versions of the conversations."""
+    conversation_ids = list(conversation_ids)
+    refresh_participant_set_hashes(conversation_ids)
+    record_conversations_changed(conversation_ids)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def forget_cached_user(sender, instance, **kwargs):
+    """Stop authenticating requests with a stale copy of the user."""
+    cached_users.pop(instance.pk)
+
+
+@receiver(pre_save, sender=CustomUser)
+def remember_stored_username(sender, instance, raw=False, update_fields=None,
+                             **kwargs):
+    """Read the username being replaced, for `retire_cached_usernames`."""
+    if raw or instance._state.adding:
+        return
+    if update_fields is None or 'username' in update_fields:
+        instance._stored_username = CustomUser.objects.filter(
+            pk=instance.pk).values_list('username', flat=True).first()
+
+
+@receiver(post_save, sender=CustomUser)
+def retire_cached_usernames(sender, instance, created, **kwargs):
+    """
+    Retire the cached messages and responses showing a changed username.
+
+    The versions of the conversations the user takes part in or wrote
+    to are bumped, which retires their buffers and ETags in every process.
+    """
+    stored = instance.__dict__.pop('_stored_username', instance.username)
+    if not created and stored != instance.username:
+        record_conversations_changed(
+            ConversationParticipant.objects.filter(
+                user=instance).values('conversation_id'))
+        record_conversations_changed(
+            Message.objects.filter(
+                sender=instance).values('conversation_id'))
+        response_cache.invalidate_all()
+
+
+@receiver(pre_save, sender=Message)
+def stamp_message_edit(sender, instance, raw=False, **kwargs):
+    """Record that a message already sent is being saved again."""
+    if not raw and not instance._state.adding:
+        instance.edited_at = timezone.now()
+
+
+@receiver(post_save, sender=Message)
+def forget_edited_message(sender, instance, created, **kwargs):
+    """Drop the cached encodings of an edited message, bump its version."""
+    if not created:
+        forget_messages([instance.pk])
+        record_conversations_changed([instance.conversation_id])
+        recent_messages.invalidate([instance.conversation_id])
+
+
+@receiver(post_migrate)
+def reinstall_search_triggers(sender, using, **kwargs):
+    """Put back the search triggers a migration rebuilding messages drops."""
+    if sender.name == 'chats':
+        search.ensure(connections[using])
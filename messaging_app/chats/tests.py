@@ -1,3 +1,2235 @@
-from django.test import TestCase
+"""Tests for the chat app API."""
+import asyncio
+import csv
+import json
+import os
+import tempfile
+import threading
+import uuid
+from base64 import b64encode
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.core.management.base import CommandError
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import inbox, search
+from .activity import rebuild_counters
+from .auth import cached_users, verified_tokens
+from .broker import MISSED_EVENT, Broker, BrokerClient, EventBacklog
+from .export import export_chunks
+from .fingerprint import participant_set_hash
+from .fragments import message_fragments
+from .ids import UUID7Generator, uuid7, uuid7_time
+from .lru import ByteLRUCache
+from .membership import MembershipCache, membership_cache
+from .models import (
+    Conversation,
+    ConversationParticipant,
+    CustomUser,
+    InboxEntry,
+    Message
+)
+from .realtime import Hub, hub, sse_application, websocket_application
+from .recent import RecentMessage, RecentMessages, recent_messages
+from .renderers import ORJSONRenderer, msgpack
+from .responses import FileResponseCache, ResponseCache, response_cache
+from .views import ConversationViewSet, MessageViewSet
+
+
+class ChatsAPITestCase(APITestCase):
+    """Shared fixtures: two participants, an outsider and a conversation."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Keep the response cache's shared tier in a scratch directory."""
+        cache_dir = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(cache_dir.cleanup)
+        caches_override = override_settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+            'responses': {
+                'BACKEND': 'chats.responses.FileResponseCache',
+                'LOCATION': cache_dir.name,
+            },
+        })
+        caches_override.enable()
+        cls.addClassCleanup(caches_override.disable)
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create the users and the conversation shared by the tests."""
+        cls.alice = CustomUser.objects.create_user('alice', password='pw')
+        cls.bob = CustomUser.objects.create_user('bob', password='pw')
+        cls.eve = CustomUser.objects.create_user('eve', password='pw')
+        cls.conversation = Conversation.objects.create()
+        cls.conversation.participants.set([cls.alice, cls.bob])
+        cls.base_time = timezone.now() - timedelta(days=1)
+
+    def setUp(self):
+        """Authenticate as a participant of the conversation."""
+        membership_cache.clear()
+        message_fragments.clear()
+        recent_messages.clear()
+        response_cache.clear()
+        self.client.force_authenticate(self.alice)
+
+    def create_messages(self, count, conversation=None, sender=None,
+                        step=timedelta(seconds=1)):
+        """Create `count` messages with increasing `sent_at` values."""
+        conversation = conversation or self.conversation
+        sender = sender or self.bob
+        messages = [
+            Message(
+                conversation=conversation,
+                sender=sender,
+                message_body=f'message {i}',
+                sent_at=self.base_time + step * i,
+            )
+            for i in range(count)
+        ]
+        messages = Message.objects.bulk_create(messages)
+        rebuild_counters(Conversation.objects.filter(pk=conversation.pk))
+        if inbox.fanout_enabled():
+            inbox.sync(conversation_ids=[conversation.pk])
+        return messages
+
+    def messages_url(self, conversation=None):
+        """Return the nested message list URL for a conversation."""
+        conversation = conversation or self.conversation
+        return f'/api/conversations/{conversation.pk}/messages/'
+
+
+class MessagePaginationTests(ChatsAPITestCase):
+    """Keyset pagination of the message list."""
+
+    def walk(self, url, direction='next'):
+        """Follow `direction` links from `url` and collect every message id."""
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids = [m['message_id'] for m in response.json()['results']]
+            seen.extend(ids if direction == 'next' else reversed(ids))
+            url = response.json()[direction]
+        return seen
+
+    def test_pages_follow_sent_at_and_message_id(self):
+        """Every message appears once, in (sent_at, message_id) order."""
+        # Shared timestamps force the tie-break on message_id.
+        self.create_messages(7, step=timedelta(0))
+        self.create_messages(6)
+        expected = [
+            str(pk) for pk in Message.objects.order_by(
+                'sent_at', 'message_id').values_list('message_id', flat=True)
+        ]
+
+        seen = self.walk(self.messages_url() + '?page_size=4')
+
+        self.assertEqual(seen, expected)
+
+    def test_previous_links_walk_back(self):
+        """Previous links from the last page return every earlier message."""
+        self.create_messages(9)
+        url = self.messages_url() + '?page_size=4'
+        while True:
+            response = self.client.get(url)
+            if not response.json()['next']:
+                break
+            url = response.json()['next']
+        last_page = [m['message_id'] for m in response.json()['results']]
+
+        seen = self.walk(response.json()['previous'], direction='previous')
+
+        expected = [
+            str(pk) for pk in Message.objects.order_by(
+                '-sent_at', '-message_id').values_list('message_id', flat=True)
+        ]
+        self.assertEqual(list(reversed(last_page)) + seen, expected)
+
+    def test_concurrent_inserts_do_not_shift_pages(self):
+        """Rows inserted behind the cursor do not repeat or skip rows."""
+        self.create_messages(6)
+        first = self.client.get(self.messages_url() + '?page_size=3')
+        Message.objects.create(
+            conversation=self.conversation, sender=self.bob,
+            message_body='late', sent_at=self.base_time - timedelta(hours=1),
+        )
+
+        second = self.client.get(first.json()['next'])
+
+        first_ids = {m['message_id'] for m in first.json()['results']}
+        second_ids = {m['message_id'] for m in second.json()['results']}
+        self.assertEqual(len(second_ids), 3)
+        self.assertFalse(first_ids & second_ids)
+        self.assertIsNone(second.json()['next'])
+
+    def test_from_latest_starts_at_the_newest_page(self):
+        """`?from=latest` starts at the end and walks back to the start."""
+        self.create_messages(9)
+        response = self.client.get(
+            self.messages_url() + '?from=latest&page_size=4')
+        self.assertIsNone(response.json()['next'])
+        newest = [m['message_id'] for m in response.json()['results']]
+
+        seen = self.walk(response.json()['previous'], direction='previous')
+
+        expected = [
+            str(pk) for pk in Message.objects.order_by(
+                '-sent_at', '-message_id').values_list('message_id', flat=True)
+        ]
+        self.assertEqual(list(reversed(newest)) + seen, expected)
+
+    def test_invalid_cursor_is_not_found(self):
+        """A tampered cursor is rejected instead of raising."""
+        cursor = b64encode(b'p=not-a-position').decode()
+        response = self.client.get(self.messages_url() + f'?cursor={cursor}')
+        self.assertEqual(response.status_code, 404)
+
+
+class NestedMessageScopeTests(ChatsAPITestCase):
+    """The nested message routes are scoped to the URL conversation."""
+
+    def test_lists_only_the_url_conversation(self):
+        """Messages from the user's other conversations are not listed."""
+        other = Conversation.objects.create()
+        other.participants.set([self.alice, self.bob])
+        self.create_messages(2)
+        self.create_messages(3, conversation=other)
+
+        response = self.client.get(self.messages_url())
+
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_non_participant_is_forbidden_without_reading_messages(self):
+        """Outsiders get a 403 before the message table is touched."""
+        self.client.force_authenticate(self.eve)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.messages_url())
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(
+            any('chats_message' in q['sql'] for q in queries.captured_queries)
+        )
+
+    def test_unknown_conversation_is_not_found(self):
+        """A conversation id that does not exist is a 404."""
+        response = self.client.get(
+            f'/api/conversations/{uuid.uuid4()}/messages/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_create_uses_the_url_conversation(self):
+        """Posting to the nested route files the message under the URL."""
+        response = self.client.post(
+            self.messages_url(), {'message_body': 'hi'}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        message = Message.objects.get()
+        self.assertEqual(message.conversation_id, self.conversation.pk)
+        self.assertEqual(message.sender, self.alice)
+
+
+class QueryCountTests(ChatsAPITestCase):
+    """List endpoints run a constant number of queries."""
+
+    def create_conversations(self, count, messages_each=3):
+        """Create conversations of alice and bob, each with a few messages."""
+        for _ in range(count):
+            conversation = Conversation.objects.create()
+            conversation.participants.set([self.alice, self.bob])
+            self.create_messages(messages_each, conversation=conversation)
+
+    def test_conversation_list_query_count(self):
+        """The ETag, conversations, participants and messages: 4 queries."""
+        self.create_conversations(2)
+        with self.assertNumQueries(4):
+            self.client.get('/api/conversations/?view=full')
+
+        self.create_conversations(20)
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/conversations/?view=full')
+        self.assertEqual(len(response.data), 23)
+
+    def test_summary_list_query_count(self):
+        """The inbox summary is the ETag, one annotated query, participants."""
+        self.create_conversations(2)
+        with self.assertNumQueries(3):
+            self.client.get('/api/conversations/')
+
+        self.create_conversations(20)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/conversations/')
+        self.assertEqual(len(response.data), 23)
+
+    def test_message_list_query_count(self):
+        """The checks and one page query, or the checks alone once cached."""
+        self.create_messages(60)
+        with self.assertNumQueries(4):
+            self.client.get(self.messages_url() + '?page_size=5')
+        with self.assertNumQueries(2):
+            self.client.get(self.messages_url() + '?page_size=5')
+        with self.assertNumQueries(3):
+            response = self.client.get(self.messages_url() + '?page_size=50')
+        self.assertEqual(
+            response.json()['results'][0]['sender_username'], 'bob')
+
+
+class ConversationSummaryTests(ChatsAPITestCase):
+    """The conversation list defaults to inbox summaries."""
+
+    def test_summary_fields(self):
+        """The summary has the last message preview and unread count."""
+        self.create_messages(3)
+        Message.objects.create(
+            conversation=self.conversation, sender=self.alice,
+            message_body='x' * 500, sent_at=self.base_time + timedelta(1),
+        )
+        rebuild_counters()
+        inbox.sync()
+
+        response = self.client.get('/api/conversations/')
+
+        summary = response.data[0]
+        self.assertNotIn('messages', summary)
+        self.assertEqual(summary['participants_usernames'], ['alice', 'bob'])
+        # Nothing has been marked as read yet.
+        self.assertEqual(summary['unread_count'], 4)
+        self.assertEqual(summary['last_message']['sender_username'], 'alice')
+        self.assertEqual(len(summary['last_message']['message_body']), 100)
+        self.assertEqual(
+            summary['last_activity'], summary['last_message']['sent_at'])
+
+    def test_empty_conversation(self):
+        """A conversation without messages has no last message."""
+        summary = self.client.get('/api/conversations/').data[0]
+        self.assertIsNone(summary['last_message'])
+        self.assertIsNone(summary['last_activity'])
+        self.assertEqual(summary['unread_count'], 0)
+
+    def test_retrieve_keeps_full_detail(self):
+        """Retrieving one conversation still embeds its messages."""
+        self.create_messages(2)
+        response = self.client.get(
+            f'/api/conversations/{self.conversation.pk}/')
+        self.assertEqual(len(response.data['messages']), 2)
+
+
+class ConversationParticipantsTests(ChatsAPITestCase):
+    """Participants are validated and written on create and update."""
+
+    def test_create_adds_the_current_user(self):
+        """The requester joins the conversation it creates."""
+        response = self.client.post(
+            '/api/conversations/',
+            {'participants': [self.bob.id, self.eve.id]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        conversation = Conversation.objects.get(
+            pk=response.data['conversation_id'])
+        self.assertEqual(
+            set(conversation.participants.all()),
+            {self.alice, self.bob, self.eve})
+
+    def test_invalid_participants_are_rejected(self):
+        """Missing, empty, unknown and non-list participants are a 400."""
+        for url in ('/api/conversations/',
+                    '/api/conversations/?get_or_create=true'):
+            for data in ({}, {'participants': []},
+                         {'participants': [self.bob.id, 0]},
+                         {'participants': self.bob.id}):
+                response = self.client.post(url, data, format='json')
+                self.assertEqual(response.status_code, 400, (url, data))
+                self.assertIn('participants', response.json())
+        self.assertEqual(Conversation.objects.count(), 1)
+
+    def test_update_replaces_the_participants(self):
+        """PATCH writes the membership rows, and validates them."""
+        url = f'/api/conversations/{self.conversation.pk}/'
+        response = self.client.patch(
+            url, {'participants': [self.bob.id, 0]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch(
+            url, {'participants': [self.alice.id, self.eve.id]},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(self.conversation.participants.all()),
+            {self.alice, self.eve})
+        self.assertTrue(membership_cache.is_member(
+            self.eve.id, self.conversation.pk))
+
+
+class ActivityCounterTests(ChatsAPITestCase):
+    """Conversation activity counters follow message writes."""
+
+    def test_create_and_delete_update_counters(self):
+        """Posting and deleting messages keep the counters exact."""
+        first = self.client.post(
+            self.messages_url(), {'message_body': 'one'}, format='json')
+        second = self.client.post(
+            self.messages_url(), {'message_body': 'two'}, format='json')
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 2)
+        self.assertEqual(
+            str(self.conversation.last_message_id),
+            second.data['message_id'])
+
+        self.client.delete(
+            self.messages_url() + f"{second.data['message_id']}/")
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 1)
+        self.assertEqual(
+            str(self.conversation.last_message_id),
+            first.data['message_id'])
+
+    def test_edit_cannot_move_a_message(self):
+        """An edit keeps the message's conversation and sender."""
+        message = self.create_messages(1)[0]
+        foreign = Conversation.objects.create()
+        foreign.participants.set([self.eve])
+        response = self.client.patch(
+            f'/api/messages/{message.pk}/', {
+                'message_body': 'edited', 'conversation': foreign.pk,
+                'sender': self.eve.pk,
+            }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        message.refresh_from_db()
+        self.assertEqual(message.message_body, 'edited')
+        self.assertEqual(message.conversation_id, self.conversation.pk)
+        self.assertEqual(message.sender_id, self.bob.pk)
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.message_count, 0)
+
+    def test_list_is_ordered_by_activity(self):
+        """The most recently active conversation comes first."""
+        quiet = Conversation.objects.create()
+        quiet.participants.set([self.alice, self.bob])
+        busy = Conversation.objects.create()
+        busy.participants.set([self.alice, self.bob])
+        self.create_messages(1, conversation=quiet)
+        self.client.post(
+            self.messages_url(busy), {'message_body': 'hi'}, format='json')
+
+        response = self.client.get('/api/conversations/')
+
+        ids = [c['conversation_id'] for c in response.data]
+        self.assertEqual(
+            ids, [str(busy.pk), str(quiet.pk), str(self.conversation.pk)])
+
+    def test_rebuild_command_repairs_drift(self):
+        """The management command recomputes counters from messages."""
+        messages = self.create_messages(3)
+        Conversation.objects.update(message_count=42, last_message=None)
+
+        call_command('rebuild_conversation_counters', stdout=StringIO())
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 3)
+        self.assertEqual(self.conversation.last_message, messages[-1])
+
+
+class ReadWatermarkTests(ChatsAPITestCase):
+    """Per-participant read watermarks and unread counts."""
+
+    def read_url(self, conversation=None):
+        """Return the read endpoint of a conversation."""
+        conversation = conversation or self.conversation
+        return f'/api/conversations/{conversation.pk}/read/'
+
+    def test_read_up_to_a_message(self):
+        """Reading up to a message leaves only the later ones unread."""
+        messages = self.create_messages(5)
+
+        response = self.client.post(
+            self.read_url(), {'message_id': str(messages[1].pk)},
+            format='json')
+
+        self.assertEqual(response.data['unread_count'], 3)
+        summary = self.client.get('/api/conversations/').data[0]
+        self.assertEqual(summary['unread_count'], 3)
+
+    def test_malformed_ids(self):
+        """A malformed conversation id is a 404, a malformed message a 400."""
+        response = self.client.post(
+            '/api/conversations/not-a-uuid/read/', format='json')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(
+            self.read_url(), {'message_id': 'not-a-uuid'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('message_id', response.json())
+
+    def test_watermark_never_moves_back(self):
+        """Reading an older message does not unread newer ones."""
+        messages = self.create_messages(4)
+        self.client.post(self.read_url(), format='json')
+
+        response = self.client.post(
+            self.read_url(), {'message_id': str(messages[0].pk)},
+            format='json')
+
+        self.assertEqual(response.data['unread_count'], 0)
+        self.assertEqual(
+            response.data['last_read_message_id'], messages[-1].pk)
+
+    def test_ties_on_sent_at_use_the_message_id(self):
+        """Messages sharing the watermark's timestamp are ordered by id."""
+        messages = sorted(
+            self.create_messages(4, step=timedelta(0)), key=lambda m: m.pk)
+
+        response = self.client.post(
+            self.read_url(), {'message_id': str(messages[1].pk)},
+            format='json')
+
+        self.assertEqual(response.data['unread_count'], 2)
+
+    def test_sending_marks_the_conversation_read(self):
+        """A user's own message moves their watermark past it."""
+        self.create_messages(3)
+        self.client.post(
+            self.messages_url(), {'message_body': 'reply'}, format='json')
+
+        response = self.client.get('/api/conversations/unread/')
+
+        self.assertEqual(response.data, {'total': 0, 'conversations': {}})
+
+    def test_unread_counts_the_whole_inbox_in_one_query(self):
+        """The unread endpoint is a single aggregate query."""
+        other = Conversation.objects.create()
+        other.participants.set([self.alice, self.bob])
+        self.create_messages(2)
+        self.create_messages(3, conversation=other)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/conversations/unread/')
+
+        self.assertEqual(response.data['total'], 5)
+        self.assertEqual(
+            response.data['conversations'][str(other.pk)], 3)
+
+    def test_non_participant_cannot_read(self):
+        """Only participants have a watermark to advance."""
+        self.client.force_authenticate(self.eve)
+        response = self.client.post(self.read_url(), format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CHATS_INBOX_FANOUT=True)
+class FanoutSummaryTests(ConversationSummaryTests):
+    """The inbox summary served from the fan-out inbox table."""
+
+
+@override_settings(CHATS_INBOX_FANOUT=True)
+class FanoutActivityCounterTests(ActivityCounterTests):
+    """Activity ordering served from the fan-out inbox table."""
+
+
+@override_settings(CHATS_INBOX_FANOUT=True)
+class FanoutReadWatermarkTests(ReadWatermarkTests):
+    """Unread counts served from the fan-out inbox table."""
+
+
+@override_settings(CHATS_INBOX_FANOUT=True)
+class InboxFanoutTests(ChatsAPITestCase):
+    """Maintenance of the fan-out inbox table."""
+
+    def test_messages_fan_out_to_other_participants(self):
+        """A new message is unread for everyone but its sender."""
+        self.client.post(
+            self.messages_url(), {'message_body': 'hi'}, format='json')
+
+        entries = dict(InboxEntry.objects.values_list(
+            'user__username', 'unread_count'))
+        self.assertEqual(entries, {'alice': 0, 'bob': 1})
+
+    def test_participant_changes_follow_membership(self):
+        """Adding and removing participants adds and removes entries."""
+        self.create_messages(2)
+        self.conversation.participants.add(self.eve)
+        self.assertEqual(
+            InboxEntry.objects.get(user=self.eve).unread_count, 2)
+
+        self.eve.conversations.remove(self.conversation)
+        self.assertFalse(InboxEntry.objects.filter(user=self.eve).exists())
+
+    def test_list_does_not_join_participants(self):
+        """The conversation list reads the inbox table only."""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/conversations/')
+        # The first query computes the ETag.
+        list_query = queries.captured_queries[1]['sql']
+        self.assertIn('chats_inboxentry', list_query)
+        self.assertNotIn('chats_conversation_participants', list_query)
+        self.assertNotIn('DISTINCT', list_query)
+
+    def test_rebuild_command_repairs_drift(self):
+        """The checker reports drift and the rebuild repairs it."""
+        self.create_messages(3)
+        InboxEntry.objects.filter(user=self.alice).delete()
+        InboxEntry.objects.filter(user=self.bob).update(unread_count=9)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_inbox', '--check', stdout=StringIO())
+        call_command('rebuild_inbox', stdout=StringIO())
+        call_command('rebuild_inbox', '--check', stdout=StringIO())
+
+        self.assertEqual(
+            InboxEntry.objects.get(user=self.alice).unread_count, 3)
+
+    def test_check_compares_users_in_batches(self):
+        """Every kind of drift is counted across batches of users."""
+        self.create_messages(2)
+        InboxEntry.objects.filter(user=self.alice).delete()
+        InboxEntry.objects.filter(user=self.bob).update(unread_count=9)
+        InboxEntry.objects.create(
+            user=self.eve, conversation=self.conversation)
+
+        self.assertEqual(
+            inbox.check(batch_size=1),
+            {'missing': 1, 'stale': 1, 'mismatched': 1})
+        batches = inbox.compute_entries(
+            ConversationParticipant.objects.all(), batch_size=1)
+        self.assertEqual([len(batch) for batch in batches], [1, 1])
+
+
+class BulkMessageTests(ChatsAPITestCase):
+    """Bulk message uploads."""
+
+    url = '/api/messages/bulk/'
+
+    def test_per_item_results(self):
+        """Valid items are created and invalid ones reported in place."""
+        foreign = Conversation.objects.create()
+        foreign.participants.set([self.bob, self.eve])
+
+        response = self.client.post(self.url, [
+            {'conversation': str(self.conversation.pk), 'message_body': 'a'},
+            {'conversation': str(foreign.pk), 'message_body': 'b'},
+            {'conversation': str(self.conversation.pk)},
+            {'conversation': str(self.conversation.pk), 'message_body': 'c'},
+        ], format='json')
+
+        self.assertEqual(response.status_code, 207)
+        statuses = [r['status'] for r in response.data['results']]
+        self.assertEqual(statuses, ['created', 'error', 'error', 'created'])
+        self.assertIn('conversation', response.data['results'][1]['errors'])
+        self.assertIn('message_body', response.data['results'][2]['errors'])
+        bodies = list(Message.objects.order_by(
+            'sent_at', 'message_id').values_list('message_body', flat=True))
+        self.assertEqual(bodies, ['a', 'c'])
+
+    def test_counters_and_watermark(self):
+        """Counters and the sender's watermark follow the whole batch."""
+        response = self.client.post(
+            self.messages_url() + 'bulk/',
+            [{'message_body': str(i)} for i in range(5)], format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 5)
+        self.assertEqual(
+            self.conversation.last_message.message_body, '4')
+        unread = self.client.get('/api/conversations/unread/').data
+        self.assertEqual(unread['total'], 0)
+
+    def test_query_count_does_not_grow_with_batch(self):
+        """Membership is checked once and rows are inserted in batches."""
+        other = Conversation.objects.create()
+        other.participants.set([self.alice, self.bob])
+
+        def upload(count):
+            items = [
+                {'conversation': str(c.pk), 'message_body': 'x'}
+                for c in (self.conversation, other)
+                for _ in range(count)
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(self.url, items, format='json')
+            return len(queries)
+
+        upload(1)  # Warm the membership cache.
+        # 140 rows still fit in one INSERT, even under SQLite's variable limit.
+        self.assertEqual(upload(5), upload(70))
+
+    def test_rejects_non_list_payload(self):
+        """The payload must be a list."""
+        response = self.client.post(
+            self.url, {'message_body': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_empty_list(self):
+        """An empty list creates nothing and is rejected."""
+        response = self.client.post(self.url, [], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+
+class MembershipCacheTests(ChatsAPITestCase):
+    """The membership cache behind IsParticipantOfConversation."""
+
+    def test_posting_makes_no_membership_query(self):
+        """A warm cache answers the membership check of a new message."""
+        self.client.get(self.messages_url())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                self.messages_url(), {'message_body': 'hi'}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(any(
+            'FROM "chats_conversation_participants"' in q['sql']
+            for q in queries.captured_queries
+        ))
+
+    def test_version_is_read_once_per_request(self):
+        """The membership checks of a request share one version query."""
+        self.create_messages(1)
+        url = f'/api/conversations/{self.conversation.pk}/'
+        self.client.get(url)
+        # The retrieve checks the conversation for its validators and
+        # again as the object.
+        for path in (self.messages_url(), f'{url}?messages_limit=5'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(sum(
+                '"membership_version"' in q['sql']
+                for q in queries.captured_queries
+            ), 1)
+            self.assertFalse(any(
+                'FROM "chats_conversation_participants"' in q['sql']
+                for q in queries.captured_queries
+            ))
+
+    def test_participant_changes_invalidate(self):
+        """Adding or removing a participant is seen on the next request."""
+        self.client.force_authenticate(self.eve)
+        self.assertEqual(
+            self.client.get(self.messages_url()).status_code, 403)
+
+        self.conversation.participants.add(self.eve)
+        self.assertEqual(
+            self.client.get(self.messages_url()).status_code, 200)
+
+        self.conversation.participants.remove(self.eve)
+        self.assertEqual(
+            self.client.get(self.messages_url()).status_code, 403)
+
+    def test_clear_invalidates_every_participant(self):
+        """Clearing the participants revokes every cached membership."""
+        self.client.get(self.messages_url())
+        self.conversation.participants.clear()
+        self.assertEqual(
+            self.client.get(self.messages_url()).status_code, 403)
+
+    def test_bounded_size(self):
+        """The least recently used users are evicted first."""
+        cache = MembershipCache(max_users=2)
+        for user in (self.alice, self.bob, self.eve):
+            cache.get_conversation_ids(user.id)
+        self.assertEqual(list(cache._entries), [self.bob.id, self.eve.id])
+
+    def test_changes_reach_other_processes(self):
+        """A cache that did not see the change notices it from the DB."""
+        other = MembershipCache()
+        self.assertFalse(other.is_member(self.eve.id, self.conversation.pk))
+        self.conversation.participants.add(self.eve)
+        self.assertTrue(other.is_member(self.eve.id, self.conversation.pk))
+
+        # Saving a user loaded before the change keeps the new version.
+        stale = CustomUser.objects.get(pk=self.eve.pk)
+        self.conversation.participants.remove(self.eve)
+        stale.save()
+        self.assertFalse(other.is_member(self.eve.id, self.conversation.pk))
+
+    def test_entries_expire(self):
+        """Entries are reloaded once their time to live has passed."""
+        cache = MembershipCache(ttl=0)
+        cache.get_conversation_ids(self.eve.id)
+        # bulk_create sends no signals, so the version stays the same.
+        ConversationParticipant.objects.bulk_create([ConversationParticipant(
+            conversation=self.conversation, user=self.eve)])
+        self.assertTrue(cache.is_member(self.eve.id, self.conversation.pk))
+
+    def test_object_permission_on_messages(self):
+        """Messages are only retrievable by participants."""
+        message = self.create_messages(1)[0]
+        self.client.force_authenticate(self.eve)
+        response = self.client.get(f'/api/messages/{message.pk}/')
+        self.assertEqual(response.status_code, 404)
+
+
+class JWTAuthenticationTests(ChatsAPITestCase):
+    """JWT is the default scheme, with cached tokens and users."""
+
+    def setUp(self):
+        """Start unauthenticated with empty auth caches."""
+        super().setUp()
+        self.client.force_authenticate(None)
+        verified_tokens.clear()
+        cached_users.clear()
+
+    def obtain_token(self, username='alice'):
+        """Return an access token obtained with the user's password."""
+        response = self.client.post(
+            '/api/token/', {'username': username, 'password': 'pw'})
+        self.assertEqual(response.status_code, 200)
+        return response.data['access']
+
+    def test_bearer_token_authenticates(self):
+        """A token from /api/token/ authenticates API calls."""
+        token = self.obtain_token()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        response = self.client.get(self.messages_url())
+        self.assertEqual(response.status_code, 200)
+
+    def test_basic_auth_disabled(self):
+        """Basic auth, which hashes the password per call, is off."""
+        credentials = b64encode(b'alice:pw').decode()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Basic {credentials}')
+        response = self.client.get(self.messages_url())
+        self.assertEqual(response.status_code, 401)
+
+    def test_repeat_request_skips_user_query(self):
+        """A cached token and user do not load the user again."""
+        token = self.obtain_token()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.client.get(self.messages_url())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.messages_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any(
+            q['sql'].startswith('SELECT "chats_customuser"."id"')
+            for q in queries.captured_queries
+        ))
+
+    def test_tampered_token_rejected(self):
+        """A token whose signature does not match is refused."""
+        token = self.obtain_token()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token[:-2]}xx')
+        response = self.client.get(self.messages_url())
+        self.assertEqual(response.status_code, 401)
+
+    def test_user_changes_invalidate(self):
+        """Deactivating a user takes effect on the next request."""
+        token = self.obtain_token()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.client.get(self.messages_url())
+        self.alice.is_active = False
+        self.alice.save()
+        response = self.client.get(self.messages_url())
+        self.assertEqual(response.status_code, 401)
+
+
+class RealtimeTests(ChatsAPITestCase):
+    """Push of new messages and read watermarks to connected clients."""
+
+    def connect(self, user, token=None):
+        """Return a communicator for a WebSocket connection of `user`."""
+        token = token if token is not None else AccessToken.for_user(user)
+        return ApplicationCommunicator(websocket_application, {
+            'type': 'websocket',
+            'path': '/ws/events/',
+            'query_string': f'token={token}'.encode(),
+        })
+
+    def send_message(self, body='hello'):
+        """Post a message as alice and run the commit callbacks."""
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                self.messages_url(), {'message_body': body})
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def read_conversation(self):
+        """Mark the conversation read as alice, running commit callbacks."""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                f'/api/conversations/{self.conversation.pk}/read/')
+
+    async def receive_event(self, communicator):
+        """Return the next event sent over a WebSocket."""
+        output = await communicator.receive_output(1)
+        self.assertEqual(output['type'], 'websocket.send')
+        return json.loads(output['text'])
+
+    async def test_websocket_receives_new_messages(self):
+        """Participants receive messages posted to their conversations."""
+        communicator = self.connect(self.bob)
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual(
+            (await communicator.receive_output(1))['type'], 'websocket.accept')
+
+        sent = await sync_to_async(self.send_message)()
+        event = await self.receive_event(communicator)
+        self.assertEqual(event['type'], 'message')
+        self.assertEqual(event['message']['message_id'], sent['message_id'])
+        self.assertEqual(event['message']['sender_username'], 'alice')
+
+        await sync_to_async(self.read_conversation)()
+        event = await self.receive_event(communicator)
+        self.assertEqual(event['type'], 'read')
+        self.assertEqual(event['user_id'], self.alice.id)
+        self.assertEqual(event['last_read_message_id'], sent['message_id'])
+
+        await communicator.send_input({'type': 'websocket.disconnect'})
+        await communicator.wait(1)
+        self.assertFalse(hub.is_subscribed(self.bob.id))
+
+    async def test_websocket_requires_token(self):
+        """Connections without a valid token are refused."""
+        communicator = self.connect(self.bob, token='invalid')
+        await communicator.send_input({'type': 'websocket.connect'})
+        output = await communicator.receive_output(1)
+        self.assertEqual(output['type'], 'websocket.close')
+
+    async def test_outsiders_receive_nothing(self):
+        """Messages are not pushed to non-participants."""
+        communicator = self.connect(self.eve)
+        await communicator.send_input({'type': 'websocket.connect'})
+        await communicator.receive_output(1)
+        await sync_to_async(self.send_message)()
+        self.assertTrue(await communicator.receive_nothing(0.1))
+        await communicator.send_input({'type': 'websocket.disconnect'})
+        await communicator.wait(1)
+
+    async def test_membership_changes_move_subscriptions(self):
+        """A user added to a conversation starts receiving its events."""
+        subscription = hub.subscribe(self.eve.id, [])
+        try:
+            def add_eve():
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.conversation.participants.add(self.eve)
+            await sync_to_async(add_eve)()
+            self.assertIn(self.conversation.pk, subscription.conversation_ids)
+        finally:
+            hub.unsubscribe(subscription)
+
+    async def test_queue_is_bounded(self):
+        """A client that falls behind is told to resync."""
+        small_hub = Hub(max_events=2)
+        subscription = small_hub.subscribe(self.bob.id, [self.conversation.pk])
+        for i in range(3):
+            small_hub.publish(
+                self.conversation.pk, {'type': 'message', 'n': i})
+        await asyncio.sleep(0)
+        self.assertEqual(subscription.queue.qsize(), 1)
+        self.assertEqual(
+            json.loads(await subscription.get()), {'type': 'resync'})
+
+    def connect_sse(self, user, token=None):
+        """Return a communicator for a Server-Sent Events stream of `user`."""
+        token = token if token is not None else AccessToken.for_user(user)
+        return ApplicationCommunicator(sse_application, {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/api/events/',
+            'query_string': f'token={token}'.encode(),
+            'headers': [],
+        })
+
+    async def test_server_sent_events(self):
+        """The SSE fallback streams the same events until disconnected."""
+        communicator = self.connect_sse(self.bob)
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output(1)
+        self.assertEqual(start['status'], 200)
+        self.assertIn(
+            (b'content-type', b'text/event-stream'), start['headers'])
+        self.assertEqual(
+            (await communicator.receive_output(1))['body'], b': connected\n\n')
+
+        await sync_to_async(self.create_messages)(1)
+        await sync_to_async(self.read_conversation)()
+        chunk = (await communicator.receive_output(1))['body']
+        self.assertTrue(chunk.startswith(b'data: '))
+        self.assertEqual(json.loads(chunk[6:])['type'], 'read')
+
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(1)
+        self.assertFalse(hub.is_subscribed(self.bob.id))
+
+    async def test_server_sent_events_require_token(self):
+        """Streams without a valid token are refused."""
+        communicator = self.connect_sse(self.bob, token='invalid')
+        await communicator.send_input({'type': 'http.request'})
+        self.assertEqual((await communicator.receive_output(1))['status'], 401)
+        await communicator.wait(1)
+
+
+class EventBrokerTests(APITestCase):
+    """Relaying push events between processes through the broker."""
+
+    def start_broker(self, **kwargs):
+        """Serve a broker on a temporary socket from a thread."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        broker = Broker(os.path.join(directory.name, 'broker.sock'), **kwargs)
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+        task = loop.create_task(broker.serve(started))
+
+        def serve():
+            try:
+                loop.run_until_complete(task)
+            except asyncio.CancelledError:
+                loop.close()
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(loop.call_soon_threadsafe, task.cancel)
+        self.assertTrue(started.wait(5))
+        return broker
+
+    def connect(self, broker, received):
+        """Return a connected client collecting events in `received`."""
+        client = BrokerClient(broker.path, on_events=received.extend)
+        client.start()
+        self.addCleanup(client.close)
+        self.assertTrue(client.connected.wait(5))
+        return client
+
+    def test_events_reach_other_workers(self):
+        """A published event reaches every worker but its publisher."""
+        broker = self.start_broker()
+        received_a, received_b = [], []
+        client_a = self.connect(broker, received_a)
+        self.connect(broker, received_b)
+        conversation_id = uuid.uuid4()
+        for _ in range(50):
+            if len(broker.connections) == 2:
+                break
+            threading.Event().wait(0.01)
+
+        client_a.publish(conversation_id, '{"type":"message"}')
+        for _ in range(500):
+            if received_b:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(
+            received_b, [[str(conversation_id), '{"type":"message"}']])
+        self.assertEqual(received_a, [])
+
+    def test_slow_consumers_are_dropped(self):
+        """A worker whose backlog overflows is disconnected."""
+        class Writer:
+            closed = False
+
+            def close(self):
+                self.closed = True
+
+        broker = Broker('unused', max_backlog=2)
+        publisher, slow = Writer(), Writer()
+        broker.connections = {
+            publisher: EventBacklog(2), slow: EventBacklog(2)}
+        broker.forward(publisher, [['c', '1'], ['c', '2']])
+        self.assertFalse(slow.closed)
+        with self.assertLogs('chats.broker', 'WARNING'):
+            broker.forward(publisher, [['c', '3']])
+        self.assertTrue(slow.closed)
+        self.assertEqual(list(broker.connections), [publisher])
+
+    def test_overflowing_publisher_asks_for_resync(self):
+        """A worker that drops events tells the others to resync."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        client = BrokerClient(
+            os.path.join(directory.name, 'missing.sock'), on_events=None,
+            max_backlog=2)
+        client.start()
+        self.addCleanup(client.close)
+        with self.assertLogs('chats.broker', 'WARNING'):
+            for i in range(3):
+                client.publish(uuid.uuid4(), str(i))
+            for _ in range(500):
+                if client.dropped:
+                    break
+                threading.Event().wait(0.01)
+        self.assertEqual(client.dropped, 3)
+        self.assertEqual(client.pending, 1)
+
+        received, missed = [], []
+        receiver = BrokerClient(
+            'unused', on_events=received.extend,
+            on_missed=lambda: missed.append(True))
+        receiver._receive([MISSED_EVENT, ['c', '1']])
+        self.assertEqual((received, missed), ([['c', '1']], [True]))
+        receiver._task.cancel()
+        receiver._main()
+
+    async def test_hub_relays_published_events(self):
+        """The hub sends events to its relay and delivers relayed ones."""
+        class Relay:
+            def __init__(self):
+                self.events = []
+
+            def publish(self, conversation_id, data):
+                self.events.append((conversation_id, data))
+
+        relay_hub = Hub()
+        relay_hub.relay = Relay()
+        conversation_id = uuid.uuid4()
+        subscription = relay_hub.subscribe(1, [conversation_id])
+        relay_hub.publish(conversation_id, {'type': 'read'})
+        relay_hub.deliver(conversation_id, '{"type":"message"}')
+        await asyncio.sleep(0)
+        self.assertEqual(
+            relay_hub.relay.events, [(conversation_id, '{"type":"read"}')])
+        self.assertEqual(
+            [await subscription.get(), await subscription.get()],
+            ['{"type":"read"}', '{"type":"message"}'])
+
+
+class MessageSearchTests(ChatsAPITestCase):
+    """Full-text search of message bodies."""
+
+    def search(self, text, conversation=None, **params):
+        """Return the ids of a search's first page, and the response."""
+        url = (
+            self.messages_url(conversation) if conversation
+            else '/api/messages/'
+        ) + 'search/'
+        response = self.client.get(url, {'q': text, **params})
+        self.assertEqual(response.status_code, 200)
+        return [m['message_id'] for m in response.json()['results']], response
+
+    def post(self, body, conversation=None):
+        """Post a message as alice and return its id."""
+        response = self.client.post(
+            self.messages_url(conversation), {'message_body': body})
+        return response.data['message_id']
+
+    def test_best_match_first(self):
+        """Messages are ranked by relevance, not by date."""
+        weak = self.post('the deploy went fine, lunch later')
+        strong = self.post('deploy deploy deploy')
+        self.post('nothing to see here')
+        ids, _ = self.search('deploy', self.conversation)
+        self.assertEqual(ids, [strong, weak])
+
+    def test_respects_membership(self):
+        """Global search only returns messages of the user's conversations."""
+        other = Conversation.objects.create()
+        other.participants.set([self.bob, self.eve])
+        Message.objects.create(
+            conversation=other, sender=self.bob, message_body='secret plan')
+        mine = self.post('our plan')
+        ids, _ = self.search('plan')
+        self.assertEqual(ids, [mine])
+
+        self.client.force_authenticate(self.eve)
+        response = self.client.get(
+            self.messages_url() + 'search/', {'q': 'plan'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_index_follows_edits_and_deletes(self):
+        """Updates and deletes are reflected in the index."""
+        message_id = self.post('draft wording')
+        Message.objects.filter(pk=message_id).update(
+            message_body='final wording')
+        self.assertEqual(self.search('draft')[0], [])
+        self.assertEqual(self.search('final')[0], [message_id])
+        Message.objects.filter(pk=message_id).delete()
+        self.assertEqual(self.search('final')[0], [])
+
+    def test_query_syntax_is_literal(self):
+        """Operators and punctuation in the input cannot break the query."""
+        message_id = self.post('ship it AND test it')
+        self.assertEqual(self.search('"ship AND( it')[0], [message_id])
+        self.assertEqual(self.search('shi*')[0], [message_id])
+        response = self.client.get('/api/messages/search/', {'q': '!!'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_keyset_pagination(self):
+        """Every match is returned once across the pages."""
+        expected = {self.post(f'report number {i}') for i in range(7)}
+        seen = []
+        ids, response = self.search('report', self.conversation, page_size=3)
+        seen.extend(ids)
+        while response.json()['next']:
+            response = self.client.get(response.json()['next'])
+            seen.extend(m['message_id'] for m in response.json()['results'])
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(set(seen), expected)
+
+    def test_rebuild_command(self):
+        """The index can be checked and rebuilt."""
+        self.post('indexed message')
+        out = StringIO()
+        call_command('rebuild_message_search', '--check', stdout=out)
+        call_command('rebuild_message_search', stdout=out)
+        self.assertEqual(len(self.search('indexed')[0]), 1)
+
+    @override_settings(CHATS_SEARCH_CANDIDATES=3)
+    def test_results_past_the_candidates_are_flagged(self):
+        """Pages say when older matches were left out."""
+        posted = [self.post(f'report number {i}') for i in range(3)]
+        ids, response = self.search('report')
+        self.assertEqual(set(ids), set(posted))
+        self.assertFalse(response.json()['truncated'])
+
+        posted += [self.post(f'report number {i}') for i in range(3, 5)]
+        ids, response = self.search('report')
+        self.assertEqual(set(ids), set(posted[2:]))
+        self.assertTrue(response.json()['truncated'])
+
+    def test_index_is_keyed_on_search_keys(self):
+        """Renumbered rowids and dropped triggers are recovered from."""
+        first = self.post('rowid independent')
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE chats_message SET rowid = rowid + 1000")
+        self.assertEqual(self.search('independent')[0], [first])
+
+        # What a migration rebuilding chats_message leaves behind.
+        with connection.cursor() as cursor:
+            for trigger in search.TRIGGERS:
+                cursor.execute(
+                    f"DROP TRIGGER {search.FTS_TABLE}_{trigger}")
+        second = self.post('independent again')
+        self.assertFalse(search.check())
+        self.assertTrue(search.ensure())
+        self.assertTrue(search.check())
+        self.assertFalse(search.ensure())
+        self.assertEqual(
+            set(self.search('independent')[0]), {first, second})
+        third = self.post('independent still')
+        self.assertEqual(
+            set(self.search('independent')[0]), {first, second, third})
+
+    def test_saves_keep_the_search_key(self):
+        """Saving a message leaves its trigger-assigned key alone."""
+        message = Message.objects.create(
+            conversation=self.conversation, sender=self.alice,
+            message_body='first wording')
+        self.assertIsNone(message.search_key)
+        message.message_body = 'second wording'
+        message.save()
+        message.refresh_from_db()
+        self.assertIsNotNone(message.search_key)
+        self.assertEqual(self.search('second')[0], [str(message.pk)])
+        self.assertEqual(self.search('first')[0], [])
+        self.assertTrue(search.check())
+
+    def test_new_messages_get_search_keys(self):
+        """Keys are reserved for bulk inserts; the trigger keys the rest."""
+        first = Message.objects.create(
+            conversation=self.conversation, sender=self.alice,
+            message_body='keyed message')
+        first.refresh_from_db()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO chats_message (message_id, sender_id, "
+                "conversation_id, message_body, sent_at) "
+                "VALUES (%s, %s, %s, 'keyed by trigger', %s)",
+                [uuid7().hex, self.alice.pk, self.conversation.pk.hex,
+                 connection.ops.adapt_datetimefield_value(timezone.now())])
+        with CaptureQueriesContext(connection) as queries:
+            batch = Message.objects.bulk_create([
+                Message(
+                    conversation=self.conversation, sender=self.alice,
+                    message_body=f'keyed in bulk {i}')
+                for i in range(3)
+            ])
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(
+            [message.search_key for message in batch],
+            [first.search_key + 2 + i for i in range(3)])
+        self.assertEqual(len(self.search('keyed')[0]), 5)
+        self.assertTrue(search.check())
+
+
+class FilterTests(ChatsAPITestCase):
+    """Indexed FilterSets of the message and conversation lists."""
+
+    def query_plans(self, url, params, table):
+        """Request `url` and return the query plans of queries on `table`."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if f'FROM "{table}"' not in query['sql']:
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plans.append([row[3] for row in cursor.fetchall()])
+        self.assertTrue(plans)
+        return response, plans
+
+    def assertNoFullScan(self, plans):
+        """Fail if a plan reads a whole table or index."""
+        for plan in plans:
+            for step in plan:
+                self.assertFalse(
+                    step.startswith('SCAN '), f"full scan: {step} in {plan}")
+
+    def test_sent_at_range(self):
+        """Messages can be limited to a time window."""
+        messages = self.create_messages(10)
+        params = {
+            'sent_after': messages[3].sent_at.isoformat(),
+            'sent_before': messages[6].sent_at.isoformat(),
+        }
+        for url in (self.messages_url(), '/api/messages/'):
+            response, plans = self.query_plans(url, params, 'chats_message')
+            self.assertEqual(
+                [m['message_id'] for m in response.json()['results']],
+                [str(m.message_id) for m in messages[3:6]]
+            )
+            self.assertNoFullScan(plans)
+
+    def test_sender(self):
+        """Messages can be limited to one sender."""
+        self.create_messages(3, sender=self.bob)
+        mine = self.create_messages(2, sender=self.alice)
+        for url in (self.messages_url(), '/api/messages/'):
+            response, plans = self.query_plans(
+                url, {'sender': self.alice.id}, 'chats_message')
+            self.assertEqual(
+                [m['message_id'] for m in response.json()['results']],
+                [str(m.message_id) for m in mine]
+            )
+            self.assertNoFullScan(plans)
+
+    def test_conversations_with_user(self):
+        """An existing conversation with given users can be found."""
+        group = Conversation.objects.create()
+        group.participants.set([self.alice, self.bob, self.eve])
+        with_eve = Conversation.objects.create()
+        with_eve.participants.set([self.alice, self.eve])
+
+        response, plans = self.query_plans(
+            '/api/conversations/', {'participant': self.bob.id},
+            'chats_conversation')
+        self.assertEqual(
+            {c['conversation_id'] for c in response.data},
+            {str(self.conversation.pk), str(group.pk)}
+        )
+        self.assertNoFullScan(plans)
+
+        response, plans = self.query_plans(
+            '/api/conversations/',
+            {'participant': f'{self.bob.id},{self.eve.id}', 'view': 'full'},
+            'chats_conversation')
+        self.assertEqual(
+            [c['conversation_id'] for c in response.data], [str(group.pk)])
+        self.assertNoFullScan(plans)
+
+
+class ParticipantSetTests(ChatsAPITestCase):
+    """Participant set fingerprints and get-or-create of conversations."""
+
+    def get_or_create(self, *users):
+        """POST a conversation with `users` in get-or-create mode."""
+        return self.client.post(
+            '/api/conversations/?get_or_create=true',
+            {'participants': [user.id for user in users]}, format='json'
+        )
+
+    def test_fingerprint_follows_membership(self):
+        """The hash always reflects the current participants."""
+        self.conversation.refresh_from_db()
+        self.assertEqual(
+            self.conversation.participant_set_hash,
+            participant_set_hash([self.bob.id, self.alice.id]))
+        self.conversation.participants.add(self.eve)
+        self.conversation.refresh_from_db()
+        self.assertEqual(
+            self.conversation.participant_set_hash,
+            participant_set_hash([self.alice.id, self.bob.id, self.eve.id]))
+
+    def test_duplicates_have_no_fingerprint(self):
+        """Only the first conversation of a participant set is indexed."""
+        duplicate = Conversation.objects.create()
+        duplicate.participants.set([self.alice, self.bob])
+        duplicate.refresh_from_db()
+        self.assertIsNone(duplicate.participant_set_hash)
+
+        self.conversation.participants.remove(self.bob)
+        duplicate.participants.add(self.eve)
+        duplicate.participants.remove(self.eve)
+        duplicate.refresh_from_db()
+        self.assertEqual(
+            duplicate.participant_set_hash,
+            participant_set_hash([self.alice.id, self.bob.id]))
+
+    def test_get_or_create_returns_existing(self):
+        """An existing conversation is returned instead of a duplicate."""
+        # One query per validated participant, then the lookup and the
+        # participants of the summary.
+        with self.assertNumQueries(4):
+            response = self.get_or_create(self.alice, self.bob)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data['conversation_id'], str(self.conversation.pk))
+        self.assertEqual(Conversation.objects.count(), 1)
+
+    def test_get_or_create_creates_once(self):
+        """The first request creates the conversation, later ones reuse it."""
+        first = self.get_or_create(self.eve, self.bob)
+        self.assertEqual(first.status_code, 201)
+        second = self.get_or_create(self.bob, self.eve)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(
+            first.data['conversation_id'], second.data['conversation_id'])
+        self.assertEqual(
+            sorted(second.data['participants_usernames']),
+            ['alice', 'bob', 'eve'])
+
+    def test_get_or_create_validates_participants(self):
+        """The fingerprint is only built from valid participants."""
+        for participants in ('x', [self.eve.id, 'x'], [self.eve.id, 0]):
+            response = self.client.post(
+                '/api/conversations/?get_or_create=true',
+                {'participants': participants}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('participants', response.json())
+        self.assertEqual(Conversation.objects.count(), 1)
+
+    def test_get_or_create_race(self):
+        """A conversation created concurrently is returned, not duplicated."""
+        conversation = Conversation.objects.create(
+            participant_set_hash=participant_set_hash(
+                [self.alice.id, self.eve.id]))
+        conversation.participants.set([self.alice, self.eve])
+        # The lookup misses, as if the other request had not committed yet.
+        with mock.patch.object(QuerySet, 'first', return_value=None):
+            response = self.get_or_create(self.alice, self.eve)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data['conversation_id'], str(conversation.pk))
+
+    def test_participant_set_filter(self):
+        """The exact participant set is found with one index probe."""
+        group = Conversation.objects.create()
+        group.participants.set([self.alice, self.bob, self.eve])
+        response = self.client.get(
+            '/api/conversations/', {'participant_set': self.bob.id})
+        self.assertEqual(
+            [c['conversation_id'] for c in response.data],
+            [str(self.conversation.pk)])
+        plan = Conversation.objects.filter(
+            participant_set_hash=participant_set_hash([self.bob.id])
+        ).explain()
+        self.assertIn('chats_conv_participant_set_uniq', plan)
+
+
+class ConditionalGetTests(ChatsAPITestCase):
+    """ETag and Last-Modified on the conversation and message lists."""
+
+    def test_unchanged_list_is_not_modified(self):
+        """A matching If-None-Match costs the checks and has no body."""
+        self.create_messages(3)
+        # The list validators, then the membership check and validators.
+        for url, count in (('/api/conversations/', 1),
+                           (self.messages_url(), 2)):
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(count):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+            self.assertEqual(response['ETag'], etag)
+
+    def test_new_message_changes_etags(self):
+        """Sending a message changes both lists' ETags."""
+        urls = ('/api/conversations/', self.messages_url(), '/api/messages/')
+        before = [self.client.get(url)['ETag'] for url in urls]
+        self.client.post(
+            self.messages_url(), {'message_body': 'hi'}, format='json')
+        after = [self.client.get(url)['ETag'] for url in urls]
+        for old, new in zip(before, after):
+            self.assertNotEqual(old, new)
+
+    def test_edit_changes_message_list_etag(self):
+        """Editing a message changes its conversation's ETag."""
+        message = self.client.post(
+            self.messages_url(), {'message_body': 'hi'}, format='json').data
+        etag = self.client.get(self.messages_url())['ETag']
+        self.client.patch(
+            f"/api/messages/{message['message_id']}/",
+            {'message_body': 'hello'}, format='json')
+        self.assertNotEqual(self.client.get(self.messages_url())['ETag'], etag)
+
+    def test_rename_changes_every_etag(self):
+        """Renaming any user retires the ETags along with the responses."""
+        self.create_messages(1)
+        urls = ('/api/conversations/', self.messages_url(),
+                f'/api/conversations/{self.conversation.pk}/')
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        self.eve.username = 'eva'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.eve.save()
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+
+    def test_read_and_membership_change_conversation_etag(self):
+        """Reads and membership changes invalidate the summary list."""
+        self.create_messages(2)
+        etag = self.client.get('/api/conversations/')['ETag']
+        self.client.post(
+            f'/api/conversations/{self.conversation.pk}/read/', format='json')
+        read_etag = self.client.get('/api/conversations/')['ETag']
+        self.assertNotEqual(read_etag, etag)
+
+        other = Conversation.objects.create()
+        other.participants.set([self.alice, self.eve])
+        self.assertNotEqual(
+            self.client.get('/api/conversations/')['ETag'], read_etag)
+
+    def test_etag_depends_on_query_and_user(self):
+        """Different queries and users never share an ETag."""
+        etag = self.client.get(self.messages_url())['ETag']
+        response = self.client.get(self.messages_url() + '?page_size=5')
+        self.assertNotEqual(response['ETag'], etag)
+        self.client.force_authenticate(self.bob)
+        self.assertNotEqual(self.client.get('/api/messages/')['ETag'], etag)
+
+    def test_last_modified(self):
+        """The nested message list honours If-Modified-Since."""
+        self.create_messages(2)
+        response = self.client.get(self.messages_url())
+        last_modified = response['Last-Modified']
+        response = self.client.get(
+            self.messages_url(), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn(
+            'Last-Modified', self.client.get('/api/conversations/'))
+
+
+class RendererTests(ChatsAPITestCase):
+    """The orjson and MessagePack renderers and parsers."""
+
+    def test_orjson_matches_drf_json(self):
+        """orjson renders the same bytes as DRF's JSON renderer."""
+        messages = self.create_messages(3)
+        response = self.client.get('/api/conversations/?view=full')
+        self.assertEqual(
+            response.content,
+            JSONRenderer().render(response.data, 'application/json'))
+
+        response = self.client.post(
+            f'/api/conversations/{self.conversation.pk}/read/',
+            {'message_id': str(messages[1].pk)}, format='json')
+        self.assertIsInstance(response.data['last_read_at'], datetime)
+        self.assertEqual(
+            ORJSONRenderer().render(response.data),
+            JSONRenderer().render(response.data))
+
+    def test_orjson_escapes_line_separators(self):
+        """U+2028 and U+2029 are escaped as DRF escapes them."""
+        data = {'message_body': 'one\u2028two\u2029three \u2013 four'}
+        self.assertEqual(
+            ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+        self.client.post(self.messages_url(), data, format='json')
+        response = self.client.get(self.messages_url())
+        self.assertIn(b'one\\u2028two\\u2029three', response.content)
+        self.assertEqual(
+            response.json()['results'][0]['message_body'],
+            data['message_body'])
+
+    def test_indented_json(self):
+        """An indent in Accept is still honoured."""
+        self.create_messages(1)
+        response = self.client.get(
+            self.messages_url(), HTTP_ACCEPT='application/json; indent=2')
+        self.assertIn(b'\n  ', response.content)
+
+    def test_malformed_json(self):
+        """A malformed JSON body is a 400, not a server error."""
+        response = self.client.post(
+            self.messages_url(), '{"message_body": ',
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    @skipUnless(msgpack, "msgpack is not installed")
+    def test_msgpack(self):
+        """MessagePack is negotiated by Accept and Content-Type."""
+        self.create_messages(2)
+        json_response = self.client.get(self.messages_url())
+        response = self.client.get(
+            self.messages_url(), HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(
+            msgpack.unpackb(response.content),
+            json.loads(json_response.content))
+        self.assertNotEqual(response['ETag'], json_response['ETag'])
+
+        response = self.client.post(
+            self.messages_url(), msgpack.packb({'message_body': 'packed'}),
+            content_type='application/msgpack')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['message_body'], 'packed')
+
+
+class RowSerializerTests(ChatsAPITestCase):
+    """The values() row path renders exactly what the serializers do."""
+
+    def setUp(self):
+        """Create messages in two conversations and an empty one."""
+        super().setUp()
+        other = Conversation.objects.create()
+        other.participants.set([self.eve, self.alice])
+        Conversation.objects.create().participants.set([self.alice, self.bob])
+        self.create_messages(5, step=timedelta(microseconds=250000))
+        self.create_messages(3, conversation=other, sender=self.eve)
+
+    def assertSameResponses(self, viewset, url, **params):
+        """Compare the bytes of `url` with and without the row path."""
+        fast = self.client.get(url, params)
+        response_cache.clear()
+        with mock.patch.object(
+                viewset, 'get_row_serializer', return_value=None):
+            slow = self.client.get(url, params)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_message_lists(self):
+        """Nested and flat message pages match, cursors included."""
+        response = self.assertSameResponses(
+            MessageViewSet, self.messages_url(), page_size=2)
+        self.assertSameResponses(MessageViewSet, response.json()['next'])
+        self.assertSameResponses(MessageViewSet, '/api/messages/')
+        self.assertSameResponses(
+            MessageViewSet, self.messages_url() + 'search/', q='message')
+
+    def test_conversation_lists(self):
+        """The inbox summaries and the full conversations match."""
+        self.assertSameResponses(ConversationViewSet, '/api/conversations/')
+        self.assertSameResponses(
+            ConversationViewSet, '/api/conversations/', view='full')
+
+    @override_settings(TIME_ZONE='Africa/Nairobi')
+    def test_time_zone(self):
+        """Datetimes are converted to the current time zone alike."""
+        response = self.assertSameResponses(
+            MessageViewSet, self.messages_url())
+        self.assertTrue(
+            response.json()['results'][0]['sent_at'].endswith('+03:00'))
+        self.assertSameResponses(ConversationViewSet, '/api/conversations/')
+
+
+class MessageFragmentTests(ChatsAPITestCase):
+    """The cache of encoded messages spliced into list responses."""
+
+    def setUp(self):
+        """Read past the response cache, which writes here bypass."""
+        super().setUp()
+        patcher = mock.patch.object(
+            response_cache, 'enabled', return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def bodies(self):
+        """Return the message bodies of the conversation's first page."""
+        response = self.client.get(self.messages_url())
+        return [m['message_body'] for m in response.json()['results']]
+
+    def test_repeated_lists_reuse_fragments(self):
+        """A warm page is spliced from the cache, byte for byte."""
+        self.create_messages(3)
+        first = self.client.get(self.messages_url())
+        with mock.patch(
+                'chats.fragments.encode_json',
+                side_effect=AssertionError("encoded again")):
+            second = self.client.get(self.messages_url())
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(len(message_fragments), 3)
+
+    def test_edits_are_never_served_stale(self):
+        """Edits here and in other processes both show up."""
+        message = self.create_messages(2)[0]
+        self.bodies()
+        self.client.force_authenticate(self.bob)
+        self.client.patch(
+            f'/api/messages/{message.pk}/', {'message_body': 'edited'},
+            format='json')
+        self.assertEqual(self.bodies()[0], 'edited')
+
+        # Another process's edit leaves this process's cache untouched.
+        Message.objects.filter(pk=message.pk).update(
+            message_body='elsewhere', edited_at=timezone.now())
+        self.assertEqual(self.bodies()[0], 'elsewhere')
+
+    def test_username_change(self):
+        """A renamed sender is shown with the new username."""
+        self.create_messages(1)
+        self.bodies()
+        CustomUser.objects.filter(pk=self.bob.pk).update(username='robert')
+        response = self.client.get(self.messages_url())
+        self.assertEqual(
+            response.json()['results'][0]['sender_username'], 'robert')
+
+    def test_delete_drops_fragment(self):
+        """Deleting a message frees its cache entry."""
+        message = self.create_messages(1)[0]
+        self.bodies()
+        self.client.force_authenticate(self.bob)
+        self.client.delete(f'/api/messages/{message.pk}/')
+        self.assertIsNone(message_fragments.get(str(message.pk)))
+
+    def test_other_formats_bypass_the_cache(self):
+        """Indented JSON is rendered without fragments."""
+        self.create_messages(1)
+        response = self.client.get(
+            self.messages_url(), HTTP_ACCEPT='application/json; indent=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(message_fragments), 0)
+
+    def test_byte_lru_cache(self):
+        """Entries are evicted by total size, least recently used first."""
+        cache = ByteLRUCache(10)
+        cache.set('a', b'1234')
+        cache.set('b', b'1234')
+        cache.get('a')
+        cache.set('c', b'1234')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'1234')
+        self.assertEqual(cache.total_bytes, 8)
+        cache.set('d', b'12345678901')
+        self.assertIsNone(cache.get('d'))
+        cache.pop('a')
+        self.assertEqual(cache.total_bytes, 4)
+
+
+class RecentMessageTests(ChatsAPITestCase):
+    """The buffers of the newest messages of each conversation."""
+
+    def latest_url(self, page_size=5):
+        """Return the URL of the conversation's newest page."""
+        return self.messages_url() + f'?from=latest&page_size={page_size}'
+
+    def post(self, body, **extra):
+        """Send a message to the conversation and run the commit hooks."""
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                self.messages_url(), {'message_body': body}, format='json',
+                **extra)
+
+    def cold(self, url):
+        """Return the response of `url` read from the database."""
+        recent_messages.clear()
+        return self.client.get(url)
+
+    def test_newest_page_from_the_buffer(self):
+        """A buffered page costs the membership check and validators."""
+        self.create_messages(12)
+        first = self.client.get(self.latest_url())
+        with self.assertNumQueries(2):
+            second = self.client.get(self.latest_url())
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(second.json()['previous'], first.json()['previous'])
+
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                self.latest_url(), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # Smaller pages come from the same buffer.
+        with self.assertNumQueries(2):
+            response = self.client.get(self.latest_url(page_size=3))
+        self.assertEqual(
+            response.json()['results'], first.json()['results'][-3:])
+
+    def test_sent_messages_extend_the_buffer(self):
+        """Messages sent here are appended, exactly as read back later."""
+        self.create_messages(3)
+        self.client.get(self.latest_url())
+        self.post('one')
+        self.client.force_authenticate(self.bob)
+        self.post('two')
+        with self.assertNumQueries(2):
+            hot = self.client.get(self.latest_url())
+        self.assertEqual(
+            [m['message_body'] for m in hot.json()['results']],
+            ['message 0', 'message 1', 'message 2', 'one', 'two'])
+        cold = self.cold(self.latest_url())
+        self.assertEqual(hot.content, cold.content)
+        self.assertEqual(hot['ETag'], cold['ETag'])
+
+    def test_bulk_upload_extends_the_buffer(self):
+        """Bulk uploads are appended too, and the buffer stays bounded."""
+        self.client.get(self.latest_url())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                self.messages_url() + 'bulk/',
+                [{'message_body': f'bulk {i}'} for i in range(60)],
+                format='json')
+        with self.assertNumQueries(2):
+            hot = self.client.get(self.latest_url(page_size=50))
+        self.assertEqual(hot.json()['results'][-1]['message_body'], 'bulk 59')
+        self.assertIsNotNone(hot.json()['previous'])
+        self.assertEqual(
+            hot.content, self.cold(self.latest_url(page_size=50)).content)
+
+    def test_edits_and_deletes_are_never_served_stale(self):
+        """Edited and deleted messages retire the buffer."""
+        message = self.create_messages(3)[-1]
+        self.client.get(self.latest_url())
+        self.client.force_authenticate(self.bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                f'/api/messages/{message.pk}/', {'message_body': 'edited'},
+                format='json')
+        results = self.client.get(self.latest_url()).json()['results']
+        self.assertEqual(results[-1]['message_body'], 'edited')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/messages/{message.pk}/')
+        results = self.client.get(self.latest_url()).json()['results']
+        self.assertEqual(len(results), 2)
+
+    def test_writes_of_other_processes(self):
+        """A version bumped by another process sends reads to the database."""
+        self.create_messages(2)
+        first = self.client.get(self.latest_url())
+        # Written without this process's hooks, as another process would.
+        self.create_messages(1, sender=self.alice)
+        response = self.client.get(
+            self.latest_url(), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 3)
+
+        # An edit that did not go through the API bumps the version too.
+        message = Message.objects.get(sender=self.alice)
+        message.message_body = 'edited'
+        message.save()
+        results = self.client.get(self.latest_url()).json()['results']
+        self.assertIn('edited', [m['message_body'] for m in results])
+
+    def test_rename_retires_every_buffer(self):
+        """Buffered messages never show an old username."""
+        self.create_messages(1)
+        self.client.get(self.latest_url())
+        self.bob.username = 'robert'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bob.save()
+        response = self.client.get(self.latest_url())
+        self.assertEqual(
+            response.json()['results'][0]['sender_username'], 'robert')
+
+    def test_other_requests_bypass_the_buffer(self):
+        """Filtered, indented and cursor reads go to the database."""
+        self.create_messages(3)
+        self.client.get(self.latest_url())
+        for url, extra in (
+                (self.latest_url() + '&sender=1', {}),
+                (self.messages_url() + '?page_size=5', {}),
+                (self.latest_url(), {
+                    'HTTP_ACCEPT': 'application/json; indent=2'})):
+            with self.assertNumQueries(3):
+                self.client.get(url, **extra)
+
+    def test_conversations_are_evicted_whole(self):
+        """The byte budget evicts least recently used conversations."""
+        buffers = RecentMessages(max_messages=2, max_bytes=2500)
+        first, second = uuid.uuid4(), uuid.uuid4()
+        messages = [
+            RecentMessage(self.base_time, uuid.uuid4(), b'x' * 100)
+            for _ in range(3)
+        ]
+        buffers.fill(first, (1, None), messages, complete=True)
+        buffer = buffers.get(first, (1, None), page_size=2)
+        self.assertEqual(buffer.messages, tuple(messages[1:]))
+        self.assertFalse(buffer.complete)
+        self.assertIsNone(buffers.get(first, (1, None), page_size=3))
+        self.assertIsNone(buffers.get(first, (2, None), page_size=2))
+
+        buffers.fill(second, (1, None), messages, complete=True)
+        buffers.fill(uuid.uuid4(), (1, None), messages, complete=True)
+        self.assertIsNone(buffers.get(first, (1, None), page_size=1))
+        self.assertIsNotNone(buffers.get(second, (1, None), page_size=1))
+
+
+class ResponseCacheTests(ChatsAPITestCase):
+    """The two-tier cache of rendered list and retrieve responses."""
+
+    def test_repeated_list_is_served_from_the_cache(self):
+        """An unchanged list is not queried or rendered again."""
+        self.create_messages(3)
+        for url, count in (('/api/conversations/', 1),
+                           (self.messages_url(), 2)):
+            first = self.client.get(url)
+            with self.assertNumQueries(count):
+                second = self.client.get(url)
+            self.assertEqual(second.content, first.content)
+            self.assertEqual(second['ETag'], first['ETag'])
+            self.assertEqual(second['Content-Type'], first['Content-Type'])
+        stats = response_cache.stats()
+        self.assertEqual((stats['local_hits'], stats['misses']), (2, 2))
+
+    def test_writes_move_to_new_keys(self):
+        """A new message is listed at once, nothing being deleted."""
+        self.client.get(self.messages_url())
+        self.client.post(
+            self.messages_url(), {'message_body': 'hi'}, format='json')
+        response = self.client.get(self.messages_url())
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertEqual(response_cache.stats()['stores'], 2)
+
+    def test_shared_tier(self):
+        """Another process finds the response in the shared tier."""
+        first = self.client.get(self.messages_url())
+        response_cache.local.clear()
+        second = self.client.get(self.messages_url())
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(response_cache.stats()['shared_hits'], 1)
+
+    def test_retrieve(self):
+        """Conversations and messages are cached, edits show at once."""
+        message = self.create_messages(1)[0]
+        for url in (f'/api/conversations/{self.conversation.pk}/',
+                    f'/api/messages/{message.pk}/'):
+            first = self.client.get(url)
+            # The membership check and the validators.
+            with self.assertNumQueries(2):
+                second = self.client.get(url)
+            self.assertEqual(second.content, first.content)
+
+        self.client.force_authenticate(self.bob)
+        self.client.patch(
+            f'/api/messages/{message.pk}/', {'message_body': 'edited'},
+            format='json')
+        response = self.client.get(f'/api/messages/{message.pk}/')
+        self.assertEqual(response.json()['message_body'], 'edited')
+
+        self.client.force_authenticate(self.eve)
+        for url in (f'/api/conversations/{self.conversation.pk}/',
+                    f'/api/messages/{message.pk}/'):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_rename_retires_every_response(self):
+        """Cached responses never show an old username."""
+        self.create_messages(1)
+        self.client.get(self.messages_url())
+        self.bob.username = 'robert'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bob.save()
+        response = self.client.get(self.messages_url())
+        self.assertEqual(
+            response.json()['results'][0]['sender_username'], 'robert')
+
+    def test_saves_keeping_the_username_retire_nothing(self):
+        """Only an actual change of username retires the responses."""
+        self.client.get(self.messages_url())
+        self.bob.first_name = 'Bob'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bob.save()
+        self.client.get(self.messages_url())
+        self.assertEqual(response_cache.stats()['local_hits'], 1)
+
+    def test_shared_tier_must_be_private(self):
+        """A directory other users can reach is refused."""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            FileResponseCache(cache_dir, {})
+            os.chmod(cache_dir, 0o755)
+            with self.assertRaises(ImproperlyConfigured):
+                FileResponseCache(cache_dir, {})
+
+    def test_shared_epoch_is_kept_for_its_ttl(self):
+        """The epoch is not read from the shared tier on every request."""
+        cache = ResponseCache(1000, cache_alias='responses', epoch_ttl=60)
+        epoch = cache.get_epoch()
+        cache.shared.set(cache.epoch_key, 'renamed elsewhere', timeout=None)
+        self.assertEqual(cache.get_epoch(), epoch)
+        cache.epoch_ttl = 0
+        cache._shared_epoch = None
+        self.assertEqual(cache.get_epoch(), 'renamed elsewhere')
+
+    def test_culls_are_spaced_out(self):
+        """The directory is listed for culling once per interval."""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = FileResponseCache(cache_dir, {'OPTIONS': {
+                'MAX_ENTRIES': 2, 'CULL_INTERVAL': 60}})
+            with mock.patch.object(
+                    cache, '_list_cache_files',
+                    wraps=cache._list_cache_files) as list_files:
+                for i in range(5):
+                    cache.set(f'key {i}', i)
+            self.assertEqual(list_files.call_count, 1)
+
+    def test_browsable_api_is_not_cached(self):
+        """HTML pages depend on more than the data."""
+        self.client.get(self.messages_url(), HTTP_ACCEPT='text/html')
+        self.assertEqual(response_cache.stats()['stores'], 0)
+
+    def test_stats(self):
+        """Admins read the counters; evictions are counted."""
+        self.assertEqual(self.client.get('/api/cache-stats/').status_code, 403)
+        admin = CustomUser.objects.create_user(
+            'admin', password='pw', is_staff=True)
+        self.client.force_authenticate(admin)
+        response = self.client.get('/api/cache-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('local_evictions', response.json())
+
+        cache = ResponseCache(max_bytes=1000)
+        cache.set('a', b'x' * 400, 'application/json')
+        cache.set('b', b'x' * 400, 'application/json')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['local_evictions'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+
+class UUID7Tests(ChatsAPITestCase):
+    """Time-ordered ids for new rows and the rekey command."""
+
+    def test_ids_are_increasing_v7(self):
+        """Ids carry the time and sort in the order they were made."""
+        ids = [uuid7() for _ in range(5000)]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual({(i.version, i.variant) for i in ids},
+                         {(7, uuid.RFC_4122)})
+        now = timezone.now().timestamp() * 1000
+        self.assertLess(abs(uuid7_time(ids[-1]) - now), 60_000)
+
+        generate = UUID7Generator()
+        earlier = generate(2000)
+        self.assertLess(earlier, generate(1000))
+        self.assertEqual(uuid7_time(generate(3000)), 3000)
+
+    def test_new_rows_get_v7_ids(self):
+        """Created conversations and messages are keyed by UUIDv7."""
+        response = self.client.post(
+            self.messages_url(), {'message_body': 'hello'})
+        self.assertEqual(uuid.UUID(response.data['message_id']).version, 7)
+        self.assertEqual(Conversation.objects.create().pk.version, 7)
+
+    def test_rekey(self):
+        """Old ids are rewritten in time order, with every reference."""
+        conversation = self.conversation
+        old = Conversation.objects.create(conversation_id=uuid.uuid4())
+        old.participants.set([self.alice, self.bob])
+        messages = Message.objects.bulk_create([
+            Message(message_id=uuid.uuid4(), conversation=old,
+                    sender=self.bob, message_body=f'rekeyed {i}',
+                    sent_at=self.base_time + timedelta(seconds=i))
+            for i in range(3)
+        ])
+        rebuild_counters(Conversation.objects.filter(pk=old.pk))
+        ConversationParticipant.objects.filter(
+            conversation=old, user=self.alice
+        ).update(last_read_at=messages[1].sent_at,
+                 last_read_message_id=messages[1].pk)
+
+        call_command('rekey_uuid7', '--batch-size', '2', stdout=StringIO())
+        self.assertFalse(Conversation.objects.filter(pk=old.pk).exists())
+        self.assertTrue(
+            Conversation.objects.filter(pk=conversation.pk).exists())
+        rekeyed = Conversation.objects.exclude(pk=conversation.pk).get()
+        self.assertEqual(rekeyed.pk.version, 7)
+        ids = list(Message.objects.filter(conversation=rekeyed).order_by(
+            'sent_at').values_list('pk', flat=True))
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual({i.version for i in ids}, {7})
+        self.assertEqual(
+            uuid7_time(ids[0]),
+            int(self.base_time.timestamp() * 1000))
+        self.assertEqual(rekeyed.last_message_id, ids[-1])
+        self.assertEqual(
+            set(rekeyed.participants.all()), {self.alice, self.bob})
+        self.assertEqual(
+            ConversationParticipant.objects.get(
+                conversation=rekeyed, user=self.alice).last_read_message_id,
+            ids[1])
+
+        response = self.client.get(
+            '/api/messages/search/', {'q': 'rekeyed'})
+        self.assertEqual(
+            {m['message_id'] for m in response.json()['results']},
+            set(map(str, ids)))
+
+        call_command('rekey_uuid7', stdout=StringIO())
+        self.assertEqual(list(Message.objects.filter(
+            conversation=rekeyed).order_by('sent_at').values_list(
+                'pk', flat=True)), ids)
+
+
+class SparseFieldsetTests(ChatsAPITestCase):
+    """`?fields=` and `?messages_limit=` on the chat endpoints."""
+
+    assertSameResponses = RowSerializerTests.assertSameResponses
+
+    def setUp(self):
+        """Create messages in two conversations and an empty one."""
+        super().setUp()
+        other = Conversation.objects.create()
+        other.participants.set([self.eve, self.alice])
+        Conversation.objects.create().participants.set([self.alice, self.bob])
+        self.create_messages(5)
+        self.create_messages(3, conversation=other, sender=self.eve)
+
+    def test_message_fields(self):
+        """Only the requested fields are rendered, without the sender join."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.assertSameResponses(
+                MessageViewSet, self.messages_url(),
+                fields='message_id,message_body')
+        self.assertEqual(
+            set(response.json()['results'][0]), {'message_id', 'message_body'})
+        for query in queries:
+            self.assertNotIn('JOIN "chats_customuser"', query['sql'])
+
+        message_id = response.json()['results'][0]['message_id']
+        response = self.client.get(
+            f'/api/messages/{message_id}/', {'fields': 'sent_at'})
+        self.assertEqual(set(response.json()), {'sent_at'})
+
+    def test_conversation_fields(self):
+        """Only the joins and prefetches of the requested fields are made."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.assertSameResponses(
+                ConversationViewSet, '/api/conversations/',
+                fields='conversation_id,unread_count')
+        self.assertEqual(
+            set(response.json()[0]), {'conversation_id', 'unread_count'})
+        for query in queries:
+            self.assertNotIn('JOIN "chats_message"', query['sql'])
+            self.assertNotIn('JOIN "chats_customuser"', query['sql'])
+
+        # The validators and the page: no participants, no messages.
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                '/api/conversations/',
+                {'view': 'full', 'fields': 'conversation_id,created_at'})
+        self.assertEqual(
+            set(response.json()[0]), {'conversation_id', 'created_at'})
+
+    def test_messages_limit(self):
+        """Conversations carry their latest messages, oldest first."""
+        response = self.assertSameResponses(
+            ConversationViewSet, '/api/conversations/',
+            view='full', messages_limit=2)
+        bodies = {
+            conversation['conversation_id']: [
+                message['message_body']
+                for message in conversation['messages']
+            ]
+            for conversation in response.json()
+        }
+        self.assertEqual(
+            bodies[str(self.conversation.pk)], ['message 3', 'message 4'])
+        self.assertEqual(sorted(map(len, bodies.values())), [0, 2, 2])
+
+        response = self.client.get(
+            f'/api/conversations/{self.conversation.pk}/',
+            {'messages_limit': 1, 'fields': 'messages'})
+        self.assertEqual(
+            [m['message_body'] for m in response.json()['messages']],
+            ['message 4'])
+        response = self.client.get(
+            '/api/conversations/', {'view': 'full', 'messages_limit': 0})
+        self.assertEqual(
+            [c['messages'] for c in response.json()], [[]] * 3)
+
+    def test_invalid_parameters(self):
+        """Unknown fields and bad limits are rejected."""
+        for params in ({'fields': 'message_body,secret'},
+                       {'fields': 'sender'}):
+            response = self.client.get(self.messages_url(), params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('fields', response.json())
+        for limit in ('-1', 'all', '201', '9' * 23):
+            response = self.client.get(
+                '/api/conversations/',
+                {'view': 'full', 'messages_limit': limit})
+            self.assertEqual(response.status_code, 400)
+        # Summaries and messages have no nested messages to limit.
+        for url in ('/api/conversations/', self.messages_url()):
+            response = self.client.get(url, {'messages_limit': 2})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('messages_limit', response.json())
+
+    def test_selections_are_versioned_apart(self):
+        """Each selection has its own ETag and cached response."""
+        full = self.client.get(self.messages_url())
+        sparse = self.client.get(
+            self.messages_url(), {'fields': 'message_id'})
+        self.assertNotEqual(full['ETag'], sparse['ETag'])
+        again = self.client.get(
+            self.messages_url(), {'fields': 'message_id'},
+            HTTP_IF_NONE_MATCH=full['ETag'])
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(set(again.json()['results'][0]), {'message_id'})
+
+
+class ExportTests(ChatsAPITestCase):
+    """Streaming exports of a conversation's history."""
+
+    def setUp(self):
+        """Create messages, one of them awkward for CSV."""
+        super().setUp()
+        self.create_messages(6)
+        Message.objects.filter(message_body='message 3').update(
+            message_body='commas, "quotes"\nand lines')
+        self.url = f'/api/conversations/{self.conversation.pk}/export/'
+
+    def listed(self):
+        """Return the messages of the conversation as listed by the API."""
+        return self.client.get(
+            self.messages_url(), {'page_size': 100}).json()['results']
+
+    def test_ndjson(self):
+        """Every message is written on its own line, in list order."""
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('attachment;', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.listed())
+
+    def test_csv(self):
+        """A header, then one row per message."""
+        response = self.client.get(
+            self.url, {'type': 'csv'}, HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.DictReader(
+            StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows, self.listed())
+
+    def test_batches(self):
+        """Keyset batches and chunks cover every message exactly once."""
+        self.create_messages(1)  # A sent_at shared with the first message.
+        chunks = list(export_chunks(
+            self.conversation.pk, batch_size=3, chunk_size=2))
+        self.assertEqual(max(map(len, chunks)), 2)
+        self.assertEqual(
+            [data for chunk in chunks for data in chunk], self.listed())
+        self.assertEqual(list(export_chunks(Conversation.objects.create().pk)),
+                         [])
+
+    def test_errors(self):
+        """Outsiders get 404 and unknown types 400."""
+        self.assertEqual(
+            self.client.get(self.url, {'type': 'xml'}).status_code, 400)
+        self.client.force_authenticate(self.eve)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    async def test_streams_over_asgi(self):
+        """Under ASGI the export is streamed chunk by chunk."""
+        token = AccessToken.for_user(self.alice)
+        response = await self.async_client.get(
+            self.url, headers={'Authorization': f'Bearer {token}'})
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response])
+        self.assertEqual(len(content.splitlines()), 6)
@@ -1,11 +1,17 @@
 from django.urls import path, include
 from rest_framework_nested import routers 
-from .views import CustomUserViewSet, ConversationViewSet, MessageViewSet
+from .views import (
+    ConversationViewSet,
+    CustomUserViewSet,
+    MessageViewSet,
+    response_cache_stats
+)
 
 
 router = routers.DefaultRouter()
 router.register(r'users', CustomUserViewSet, basename='user')
 router.register(r'conversations', ConversationViewSet, basename='conversation')
+router.register(r'messages', MessageViewSet, basename='message')
 
 conversations_router = routers.NestedDefaultRouter(
     router, r'conversations', lookup='conversation'
@@ -14,6 +20,7 @@ conversations_router = routers.NestedDefaultRouter(
 conversations_router.register(r'messages', MessageViewSet, basename='conversation-message')
 
 urlpatterns = [
+    path('cache-stats/', response_cache_stats, name='cache-stats'),
     path('', include(router.urls)),
     path('', include(conversations_router.urls)),
 ]
@@ -1,15 +1,110 @@
 """Create a view set for the chat app."""
+import uuid
+from datetime import timedelta
+
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, transaction
+from django.db.models import F, Prefetch
+from django.db.models.functions import Substr
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import serializers, status, viewsets
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .models import Conversation, CustomUser, Message
+from . import inbox
+from .activity import (
+    advance_read_watermark,
+    annotate_unread_counts,
+    record_message_deleted,
+    record_messages,
+    unread_messages
+)
+from .etags import (
+    ConditionalListMixin,
+    ConditionalRetrieveMixin,
+    conversation_validators,
+    user_version
+)
+from .export import (
+    EXPORT_TYPES,
+    ExportContentNegotiation,
+    aiterate,
+    export_chunks
+)
+from .fieldsets import SparseFieldsMixin, latest_messages
+from .filters import ConversationFilter, MessageFilter
+from .fingerprint import participant_set_hash
+from .fragments import (
+    MessageFragmentRows,
+    forget_messages,
+    fragments_enabled
+)
+from .models import (
+    Conversation,
+    ConversationParticipant,
+    CustomUser,
+    InboxEntry,
+    Message
+)
+from .membership import membership_cache
+from .pagination import MessageCursorPagination, SearchCursorPagination
+from .permissions import IsParticipantOfConversation
+from .realtime import publish_messages, publish_read
+from .recent import RecentMessage, recent_messages
+from .renderers import (
+    PARSER_CLASSES,
+    RENDERER_CLASSES,
+    JSONFragments,
+    splices_fragments
+)
+from .rows import (
+    ConversationRows,
+    ConversationSummaryRows,
+    MessageRows,
+    RowListMixin
+)
+from .responses import response_cache
+from .search import fts_available, search_messages
 from .serializers import (
+    BulkMessageSerializer,
     ConversationSerializer,
+    ConversationSummarySerializer,
     CustomUserSerializer,
     MessageSerializer
 )
 
+# Columns read by MessageSerializer; the sender join only fetches the username.
+MESSAGE_COLUMNS = (
+    'message_id', 'conversation_id', 'message_body', 'sent_at',
+    'sender__username'
+)
+
+# Inbox order: most recent activity first, empty conversations last.
+# `last_activity` is annotated by ConversationViewSet.get_inbox_queryset.
+ACTIVITY_ORDERING = (
+    F('last_activity').desc(nulls_last=True), '-created_at'
+)
+
+# Largest number of messages accepted by one bulk upload, and the
+# number of rows per INSERT statement.
+BULK_MAX_MESSAGES = 5000
+BULK_BATCH_SIZE = 500
+
+# Length of the last message preview in the conversation inbox summary.
+PREVIEW_LENGTH = 100
+
+
+def select_message_columns(messages, sender=True):
+    """Load the columns MessageSerializer reads, the sender's if `sender`."""
+    if sender:
+        return messages.select_related('sender').only(*MESSAGE_COLUMNS)
+    return messages.only(
+        *(column for column in MESSAGE_COLUMNS if '__' not in column))
+
 
 class CustomUserViewSet(viewsets.ReadOnlyModelViewSet):
     """
@@ -21,83 +116,481 @@ class CustomUserViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = CustomUser.objects.all()
     serializer_class = CustomUserSerializer
     permission_classes = [IsAuthenticated]
+    renderer_classes = RENDERER_CLASSES
 
 
-class ConversationViewSet(viewsets.ModelViewSet):
+class ConversationViewSet(ConditionalListMixin, ConditionalRetrieveMixin,
+                          SparseFieldsMixin, RowListMixin,
+                          viewsets.ModelViewSet):
     """
     A ViewSet for viewing and editing Conversation instances.
 
     Allows listing, retrieving, creating, updating, and deleting conversations.
-    Users can only see conversations they are a part of.
+    Users can only see conversations they are a part of. The list shows an
+    inbox summary of each conversation unless `?view=full` is given.
+    `?fields=` selects the fields rendered and `?messages_limit=` keeps
+    only the latest messages of each conversation.
     """
 
     queryset = Conversation.objects.all()
     serializer_class = ConversationSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsParticipantOfConversation]
+    renderer_classes = RENDERER_CLASSES
+    parser_classes = PARSER_CLASSES
+    filterset_class = ConversationFilter
+
+    def is_summary(self):
+        """Return True when the request should get inbox summaries."""
+        return (
+            self.action == 'list' and
+            self.request.query_params.get('view') != 'full'
+        )
+
+    def nests_messages(self):
+        """Full listings and single conversations render messages."""
+        return self.action in ('list', 'retrieve') and not self.is_summary()
+
+    def get_serializer_class(self):
+        """Use the inbox summary serializer for summary listings."""
+        if self.is_summary():
+            return ConversationSummarySerializer
+        return super().get_serializer_class()
+
+    def get_row_serializer(self):
+        """Serialize the listed conversations from rows."""
+        fields = self.get_requested_fields()
+        if self.is_summary():
+            return ConversationSummaryRows(fields)
+        return ConversationRows(fields, self.get_messages_limit())
+
+    def get_list_validators(self):
+        """Version the list by the user's conversations and read state."""
+        return user_version(self.request.user), None
+
+    def get_member_conversation_pk(self):
+        """Return the URL conversation's id if the user is in it, or None."""
+        try:
+            conversation_pk = uuid.UUID(str(self.kwargs['pk']))
+        except ValueError:
+            return None
+        if not membership_cache.is_member(
+                self.request.user.id, conversation_pk, self.request):
+            return None
+        return conversation_pk
+
+    def get_retrieve_validators(self):
+        """Version a conversation of the user's by its own version."""
+        conversation_pk = self.get_member_conversation_pk()
+        if conversation_pk is None:
+            return None
+        version, updated_at = conversation_validators(conversation_pk)
+        if version is None:
+            return None
+        return (version,), updated_at
 
     def get_queryset(self):
         """
         Filter conversations to only show those the current.
 
-        authenticated user is a participant of.
+        authenticated user is a participant of, most recently active first.
+        Participants and messages (with their sender) are prefetched, when
+        rendered, so the nested serializers run a fixed number of queries
+        whatever the page size.
         """
         user = self.request.user
-        if user.is_authenticated:
-            return Conversation.objects.filter(
-                participants=user
-            ).distinct().order_by('-created_at')
-        return Conversation.objects.none()
+        if user.is_authenticated and self.is_summary():
+            return self.get_summary_queryset(user)
+        if not user.is_authenticated:
+            return Conversation.objects.none()
+        conversations = self.get_inbox_queryset(user)
+        if self.wants('participants', 'participants_usernames'):
+            conversations = conversations.prefetch_related(Prefetch(
+                'participants',
+                queryset=CustomUser.objects.only(
+                    'id', 'username').order_by('id')
+            ))
+        if self.wants('messages'):
+            messages = select_message_columns(Message.objects.all())
+            limit = self.get_messages_limit()
+            if limit is None:
+                messages = messages.order_by('sent_at', 'message_id')
+            else:
+                messages = latest_messages(messages, limit)
+            conversations = conversations.prefetch_related(
+                Prefetch('messages', queryset=messages))
+        return conversations
 
-    def perform_create(self, serializer):
+    def get_inbox_queryset(self, user, with_unread=False):
+        """
+        Return the user's conversations, most recently active first.
+
+        With the fan-out inbox enabled this is a range scan of the user's
+        inbox entries, which also carry the unread counts. Otherwise it
+        goes through the participants table and the activity counters.
+        Each membership is unique, so neither path needs a DISTINCT.
+        """
+        if inbox.fanout_enabled():
+            conversations = Conversation.objects.filter(
+                inbox_entries__user=user
+            ).annotate(
+                last_activity=F('inbox_entries__last_activity'),
+                unread_count=F('inbox_entries__unread_count'),
+            )
+        elif with_unread:
+            conversations = annotate_unread_counts(
+                Conversation.objects.all(), user
+            ).annotate(last_activity=F('last_message_at'))
+        else:
+            conversations = Conversation.objects.filter(
+                memberships__user=user
+            ).annotate(last_activity=F('last_message_at'))
+        return conversations.order_by(*ACTIVITY_ORDERING)
+
+    def get_summary_queryset(self, user, sparse=True):
+        """
+        Annotate the user's conversations with their inbox summary.
+
+        The last message is joined through the denormalized pointer and the
+        unread count comes from the inbox table or from a correlated
+        subquery against the user's read watermark, so the whole inbox
+        comes back from one query plus the participants prefetch. With
+        `sparse`, only what the requested fields need is annotated.
+        """
+        def wants(*names):
+            return not sparse or self.wants(*names)
+
+        conversations = self.get_inbox_queryset(
+            user, with_unread=wants('unread_count'))
+        if wants('last_message'):
+            conversations = conversations.annotate(
+                last_message_pk=F('last_message_id'),
+                last_message_sender=F('last_message__sender__username'),
+                last_message_preview=Substr(
+                    'last_message__message_body', 1, PREVIEW_LENGTH),
+            )
+        if wants('participants', 'participants_usernames'):
+            conversations = conversations.prefetch_related(Prefetch(
+                'participants',
+                queryset=CustomUser.objects.only(
+                    'id', 'username').order_by('id')
+            ))
+        return conversations
+
+    def create(self, request, *args, **kwargs):
+        """
+        Create a conversation.
+
+        With `?get_or_create=true`, first look up the conversation between
+        exactly the requested participants and the current user by its
+        participant set hash, and return it (200) instead of creating a
+        duplicate. Both outcomes return the inbox summary.
+        """
+        if request.query_params.get('get_or_create') not in ('1', 'true'):
+            return super().create(request, *args, **kwargs)
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        fingerprint = participant_set_hash(
+            user.id for user in self.get_participants(serializer))
+        conversations = self.get_summary_queryset(request.user, sparse=False)
+        existing = conversations.filter(
+            participant_set_hash=fingerprint).first()
+        if existing is None:
+            try:
+                with transaction.atomic():
+                    self.perform_create(
+                        serializer, participant_set_hash=fingerprint)
+            except IntegrityError:
+                # Created concurrently by another request.
+                pass
+            else:
+                created = conversations.get(pk=serializer.instance.pk)
+                return Response(
+                    ConversationSummarySerializer(created).data,
+                    status=status.HTTP_201_CREATED
+                )
+            existing = conversations.get(participant_set_hash=fingerprint)
+        return Response(ConversationSummarySerializer(existing).data)
+
+    def get_participants(self, serializer):
+        """Return the validated participants and the current user."""
+        participants = list(serializer.validated_data['participants'])
+        user = self.request.user
+        if user.is_authenticated and user.id not in {
+                participant.id for participant in participants}:
+            participants.append(user)
+        return participants
+
+    def perform_create(self, serializer, **kwargs):
         """
         When creating a new conversation, ensure the current user is.
 
         automatically added as a participant.
         """
-        participants_data = self.request.data.get('participants', [])
+        with transaction.atomic():
+            serializer.save(
+                participants=self.get_participants(serializer), **kwargs)
 
-        if not participants_data:
-            participants_data = []
+    def perform_update(self, serializer):
+        """Save the conversation and its memberships together."""
+        with transaction.atomic():
+            serializer.save()
 
-        if (self.request.user.is_authenticated and
-                self.request.user.id not in participants_data):
-            participants_data.append(self.request.user.id)
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        """
+        Advance the user's read watermark in a conversation.
 
-        participants = CustomUser.objects.filter(id__in=participants_data)
+        Marks everything up to `message_id` as read, or up to the last
+        message when no id is given. The watermark never moves backwards.
+        """
+        try:
+            pk = uuid.UUID(str(pk))
+        except ValueError:
+            raise NotFound("Conversation not found.")
+        membership = ConversationParticipant.objects.filter(
+            conversation_id=pk, user=request.user
+        ).select_related('conversation__last_message').first()
+        if membership is None:
+            raise NotFound("Conversation not found.")
 
-        if not participants.exists():
-            raise serializers.ValidationError(
-                "A conversation must have at least one participant."
+        message_id = request.data.get('message_id')
+        if message_id:
+            try:
+                message_id = uuid.UUID(str(message_id))
+            except ValueError:
+                raise serializers.ValidationError(
+                    {"message_id": "Enter a valid message id."}
+                )
+            message = Message.objects.filter(
+                conversation_id=pk, message_id=message_id
+            ).only('message_id', 'sent_at').first()
+            if message is None:
+                raise serializers.ValidationError(
+                    {"message_id": "Message not found in this conversation."}
+                )
+        else:
+            message = membership.conversation.last_message
+
+        if message is not None:
+            advance_read_watermark(
+                pk, request.user.id, message.sent_at, message.message_id)
+            membership.refresh_from_db(
+                fields=['last_read_at', 'last_read_message_id'])
+
+        unread = unread_messages(
+            pk, membership.last_read_at, membership.last_read_message_id
+        ).count()
+        if inbox.fanout_enabled():
+            inbox.record_read(pk, request.user.id, unread)
+        if message is not None:
+            publish_read(
+                membership.conversation_id, request.user.id,
+                membership.last_read_at, membership.last_read_message_id
             )
+        return Response({
+            'conversation_id': str(membership.conversation_id),
+            'last_read_at': membership.last_read_at,
+            'last_read_message_id': membership.last_read_message_id,
+            'unread_count': unread,
+        })
+
+    @action(detail=True,
+            content_negotiation_class=ExportContentNegotiation)
+    def export(self, request, pk=None):
+        """
+        Stream the whole history of a conversation, oldest first.
+
+        `?type=ndjson` (the default) writes one message object per line,
+        `?type=csv` a header and one row per message, with the fields of
+        the message list. Memory use does not depend on the length of the
+        conversation.
+        """
+        conversation_pk = self.get_member_conversation_pk()
+        if conversation_pk is None:
+            raise NotFound("Conversation not found.")
+        export_type = request.query_params.get('type', 'ndjson')
+        if export_type not in EXPORT_TYPES:
+            raise serializers.ValidationError({"type": [
+                f"Choose one of: {', '.join(EXPORT_TYPES)}."
+            ]})
 
-        conversation = serializer.save()
+        content_type, extension, encode = EXPORT_TYPES[export_type]
+        content = encode(export_chunks(conversation_pk))
+        if isinstance(request._request, ASGIRequest):
+            content = aiterate(content)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="conversation-{conversation_pk}.'
+            f'{extension}"'
+        )
+        return response
 
-        conversation.participants.set(participants)
-        conversation.save()
+    @action(detail=False)
+    def unread(self, request):
+        """Return the unread counts of the user's inbox from one query."""
+        if inbox.fanout_enabled():
+            counts = InboxEntry.objects.filter(user=request.user)
+            counts = counts.values_list('conversation_id', 'unread_count')
+        else:
+            counts = annotate_unread_counts(
+                Conversation.objects.order_by(), request.user
+            ).values_list('pk', 'unread_count')
+        counts = dict(counts.filter(unread_count__gt=0))
+        return Response({
+            'total': sum(counts.values()),
+            'conversations': {str(pk): n for pk, n in counts.items()},
+        })
 
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(ConditionalListMixin, ConditionalRetrieveMixin,
+                     SparseFieldsMixin, RowListMixin, viewsets.ModelViewSet):
     """
     A ViewSet for viewing and editing Message instances.
 
     Allows listing, retrieving, creating, updating, and deleting messages.
     Users can only see messages in conversations they are a part of.
+    `?fields=` selects the fields rendered.
     """
 
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsParticipantOfConversation]
+    renderer_classes = RENDERER_CLASSES
+    parser_classes = PARSER_CLASSES
+    pagination_class = MessageCursorPagination
+    filterset_class = MessageFilter
+
+    def initial(self, request, *args, **kwargs):
+        """
+        Resolve the URL conversation once the permissions have passed.
+
+        `IsParticipantOfConversation` has already turned non-participants
+        away, so the message table is never queried on their behalf.
+        """
+        super().initial(request, *args, **kwargs)
+        self.conversation_pk = None
+        if 'conversation_pk' in kwargs:
+            self.conversation_pk = uuid.UUID(str(kwargs['conversation_pk']))
+
+    def get_row_serializer(self):
+        """
+        Serialize listed messages from rows.
+
+        When the response is compact JSON with every field, cached
+        encodings of the messages are spliced into it instead.
+        """
+        fields = self.get_requested_fields()
+        if fields is None and fragments_enabled() and splices_fragments(
+                self.request, self.get_renderer_context()):
+            return MessageFragmentRows()
+        return MessageRows(fields)
+
+    def get_list_validators(self):
+        """
+        Version the list by its conversation, or by the user's ones.
+
+        The newest page of a conversation is served from its buffer in
+        `recent_messages` when the buffer was read at these validators.
+        """
+        if not self.conversation_pk:
+            return user_version(self.request.user), None
+        self.list_validators = conversation_validators(self.conversation_pk)
+        self.reads_recent = self.reads_recent_messages()
+        self.recent_buffer = None
+        if self.reads_recent:
+            self.recent_buffer = recent_messages.get(
+                self.conversation_pk, self.list_validators,
+                self.paginator.get_page_size(self.request)
+            )
+        version, updated_at = self.list_validators
+        return (version,), updated_at
+
+    def get_retrieve_validators(self):
+        """Version a message by its conversation, read in the same query."""
+        try:
+            message_pk = uuid.UUID(str(self.kwargs['pk']))
+        except ValueError:
+            return None
+        messages = Message.objects.filter(pk=message_pk)
+        if self.conversation_pk:
+            messages = messages.filter(conversation_id=self.conversation_pk)
+        row = messages.values_list(
+            'conversation_id', 'conversation__version',
+            'conversation__updated_at'
+        ).first()
+        if row is None or not membership_cache.is_member(
+                self.request.user.id, row[0], self.request):
+            return None
+        return row[1:2], row[2]
+
+    def reads_recent_messages(self):
+        """
+        Return True if the request may use the conversation's buffer.
+
+        That is the newest page of the URL conversation, unfiltered and
+        rendered as compact JSON.
+        """
+        params = self.request.query_params
+        return (
+            self.action == 'list' and recent_messages.enabled() and
+            self.paginator.starts_from_latest(self.request) and
+            params.keys() <= {
+                self.paginator.start_query_param,
+                self.paginator.page_size_query_param
+            } and
+            splices_fragments(self.request, self.get_renderer_context())
+        )
+
+    def list_queryset(self, queryset):
+        """
+        Serve the newest page from the conversation's buffer, if current.
+
+        Otherwise the page is read from the database, and buffered when it
+        is the newest one.
+        """
+        buffer = getattr(self, 'recent_buffer', None)
+        if buffer is not None:
+            page = self.paginator.paginate_latest(
+                buffer.messages, self.request, buffer.complete)
+            return self.get_paginated_response(
+                JSONFragments(message.fragment for message in page))
+
+        response = super().list_queryset(queryset)
+        results = response.data.get('results')
+        if getattr(self, 'reads_recent', False) and isinstance(
+                results, JSONFragments):
+            recent_messages.fill(
+                self.conversation_pk, self.list_validators, [
+                    RecentMessage(
+                        row['sent_at'],
+                        row.get('message_id') or
+                        uuid.UUID(row['message_id_text']),
+                        fragment
+                    )
+                    for row, fragment in zip(self.paginator.page, results)
+                ],
+                complete=not self.paginator.has_previous
+            )
+        return response
 
     def get_queryset(self):
         """
         Filter messages to only show those in conversations the current.
 
-        authenticated user is a participant of.
+        authenticated user is a participant of. Under the nested route the
+        queryset is scoped directly to the conversation in the URL.
         """
         user = self.request.user
+        messages = select_message_columns(
+            Message.objects.all(), sender=self.wants('sender_username'))
+        if getattr(self, 'conversation_pk', None):
+            return messages.filter(
+                conversation_id=self.conversation_pk
+            ).order_by('sent_at')
         if user.is_authenticated:
             user_conversations = Conversation.objects.filter(participants=user)
-            return Message.objects.filter(
+            return messages.filter(
                 conversation__in=user_conversations
             ).order_by('sent_at')
         return Message.objects.none()
@@ -107,30 +600,203 @@ class MessageViewSet(viewsets.ModelViewSet):
         When creating a new message, automatically set the sender to the.
 
         current authenticated user and link it to the specified conversation.
+        Under the nested route the conversation comes from the URL and its
+        membership has already been checked in `initial`.
         """
-        conversation_id = self.request.data.get('conversation')
-        if not conversation_id:
+        if self.conversation_pk:
+            serializer.validated_data.pop('conversation', None)
+            self.save_message(
+                serializer, conversation_id=self.conversation_pk)
+            return
+
+        conversation = serializer.validated_data.pop('conversation', None)
+        if conversation is None:
             raise serializers.ValidationError(
                 {
                     "conversation": "This field is required to send a message."
                 }
             )
 
-        try:
-            conversation = Conversation.objects.get(
-                conversation_id=conversation_id
+        if not membership_cache.is_member(
+                self.request.user.id, conversation.pk, self.request):
+            raise serializers.ValidationError(
+                "You are not a participant in this conversation."
+            )
+
+        self.save_message(serializer, conversation_id=conversation.pk)
+
+    def save_message(self, serializer, **kwargs):
+        """Save a new message and count it in its conversation's counters."""
+        with transaction.atomic():
+            message = serializer.save(sender=self.request.user, **kwargs)
+            record_messages(message.conversation_id, message)
+            recent_messages.extend(message.conversation_id, [message])
+            # Sending implies having read the conversation up to here.
+            advance_read_watermark(
+                message.conversation_id, self.request.user.id,
+                message.sent_at, message.message_id
             )
-        except Conversation.DoesNotExist:
+            if inbox.fanout_enabled():
+                inbox.record_message(message)
+            publish_messages([message])
+
+    def perform_update(self, serializer):
+        """Save an edited message; its post_save handler bumps the version."""
+        with transaction.atomic():
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        """Delete a message and update its conversation's counters."""
+        message_id = instance.pk
+        with transaction.atomic():
+            instance.delete()
+            record_message_deleted(instance.conversation_id)
+            forget_messages([message_id])
+            recent_messages.invalidate([instance.conversation_id])
+            if inbox.fanout_enabled():
+                inbox.sync(conversation_ids=[instance.conversation_id])
+
+    @action(detail=False)
+    def search(self, request, conversation_pk=None):
+        """
+        Search the bodies of the messages the user can see.
+
+        Every word of `q` must match (`word*` matches a prefix). Results
+        come best match first, a keyset page at a time, and are limited to
+        the URL conversation under the nested route. Only the most recent
+        matches are ranked; pages say in `truncated` whether older ones
+        were left out.
+        """
+        matches = search_messages(
+            self.filter_queryset(self.get_queryset()),
+            request.query_params.get('q', '')
+        )
+        if matches is None:
             raise serializers.ValidationError(
-                {"conversation": "Conversation not found."}
+                {"q": ["Enter one or more words to search for."]}
             )
+        messages, truncated = matches
+        if fts_available():
+            self._paginator = SearchCursorPagination()
+            self._paginator.truncated = truncated
+        return self.list_queryset(messages)
 
-        convo = conversation.participants.filter(
-                    id=self.request.user.id).exists()
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, conversation_pk=None):
+        """
+        Create many messages, possibly across conversations, at once.
 
-        if not convo:
+        Takes a non-empty list of `{"conversation", "message_body"}` items;
+        under the nested route `conversation` defaults to the URL
+        conversation.
+        Membership of every conversation is checked against the membership
+        cache (at most one query) and the valid messages are inserted in
+        batches inside one transaction. Returns one result per item, in
+        order.
+        """
+        items = request.data
+        if not isinstance(items, list) or not items:
             raise serializers.ValidationError(
-                "You are not a participant in this conversation."
+                {"non_field_errors": ["Expected a list of messages."]}
+            )
+        if len(items) > BULK_MAX_MESSAGES:
+            raise serializers.ValidationError(
+                {"non_field_errors": [
+                    f"At most {BULK_MAX_MESSAGES} messages per request."
+                ]}
             )
 
-        serializer.save(sender=self.request.user, conversation=conversation)
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            serializer = BulkMessageSerializer(data=item)
+            if not serializer.is_valid():
+                results[index] = {
+                    'status': 'error', 'errors': serializer.errors}
+                continue
+            conversation_id = serializer.validated_data.get(
+                'conversation', self.conversation_pk)
+            if conversation_id is None:
+                results[index] = {'status': 'error', 'errors': {
+                    'conversation': ["This field is required."]
+                }}
+                continue
+            valid.append(
+                (index, conversation_id,
+                 serializer.validated_data['message_body'])
+            )
+
+        member_of = membership_cache.get_conversation_ids(
+            request.user.id, request)
+
+        # Consecutive timestamps keep the upload order in (sent_at,
+        # message_id) order.
+        now = timezone.now()
+        created = []
+        for index, conversation_id, body in valid:
+            if conversation_id not in member_of:
+                results[index] = {'status': 'error', 'errors': {
+                    'conversation': [
+                        "You are not a participant in this conversation."
+                    ]
+                }}
+                continue
+            created.append((index, Message(
+                sender=request.user,
+                conversation_id=conversation_id,
+                message_body=body,
+                sent_at=now + timedelta(microseconds=len(created)),
+            )))
+
+        if created:
+            self.save_messages([message for _, message in created])
+        for index, message in created:
+            results[index] = {
+                'status': 'created',
+                'message_id': message.message_id,
+                'conversation_id': message.conversation_id,
+                'sent_at': message.sent_at,
+            }
+
+        if len(created) == len(items):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(
+            {
+                'created': len(created),
+                'failed': len(items) - len(created),
+                'results': results,
+            },
+            status=response_status
+        )
+
+    def save_messages(self, messages):
+        """Insert messages in batches and update each conversation once."""
+        by_conversation = {}
+        for message in messages:
+            by_conversation.setdefault(
+                message.conversation_id, []).append(message)
+
+        with transaction.atomic():
+            Message.objects.bulk_create(messages, batch_size=BULK_BATCH_SIZE)
+            for conversation_id, created in by_conversation.items():
+                message = created[-1]
+                record_messages(conversation_id, message, len(created))
+                recent_messages.extend(conversation_id, created)
+                advance_read_watermark(
+                    conversation_id, self.request.user.id,
+                    message.sent_at, message.message_id
+                )
+            if inbox.fanout_enabled():
+                inbox.sync(conversation_ids=list(by_conversation))
+            publish_messages(messages)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def response_cache_stats(request):
+    """Return the response cache counters of the process serving this."""
+    return Response(response_cache.stats())
@@ -2,6 +2,8 @@
 ASGI config for messaging_app project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+WebSocket connections and the Server-Sent Events stream are served by the
+chat app's push channel; everything else goes to Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -13,4 +15,20 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "messaging_app.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up by get_asgi_application().
+from chats.realtime import (  # noqa: E402
+    EVENTS_PATH,
+    sse_application,
+    websocket_application
+)
+
+
+async def application(scope, receive, send):
+    """Route the push channel's connections to it, the rest to Django."""
+    if scope['type'] == 'websocket':
+        return await websocket_application(scope, receive, send)
+    if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+        return await sse_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
+from datetime import timedelta
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -126,11 +128,17 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+AUTH_USER_MODEL = 'chats.CustomUser'
+
+# Maintain the per-user inbox table on every write and list conversations
+# from it. Run `manage.py rebuild_inbox` after turning it on.
+CHATS_INBOX_FANOUT = False
+
 # Django REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'chats.auth.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -139,3 +147,69 @@ REST_FRAMEWORK = {
         'django_filters.rest_framework.DjangoFilterBackend'
     ],
 }
+
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'AUTH_HEADER_TYPES': ('Bearer',),
+}
+
+# Per-process caches of chats.auth.CachedJWTAuthentication.
+CHATS_AUTH_TOKEN_CACHE_SIZE = 10000
+CHATS_AUTH_USER_CACHE_SIZE = 10000
+CHATS_AUTH_USER_CACHE_TTL = 60
+
+# Per-process cache of the conversations of each user (chats.membership):
+# users held, and seconds before an entry is reloaded even if its version
+# is unchanged.
+CHATS_MEMBERSHIP_CACHE_SIZE = 1024
+CHATS_MEMBERSHIP_CACHE_TTL = 300
+
+# Events queued per push connection before the client is told to resync,
+# and seconds between keep-alive comments on Server-Sent Events streams.
+CHATS_REALTIME_QUEUE_SIZE = 100
+CHATS_REALTIME_HEARTBEAT = 15
+
+# Unix socket of `manage.py run_event_broker`, which relays push events
+# between server processes. Leave unset with a single process.
+CHATS_EVENT_BROKER_SOCKET = None
+
+# Message search ranks the most recent matches only, this many at most.
+CHATS_SEARCH_CANDIDATES = 5000
+
+# Total size of the per-process cache of encoded messages (chats.fragments);
+# 0 disables it.
+CHATS_MESSAGE_FRAGMENT_CACHE_BYTES = 32 * 1024 * 1024
+
+# Newest messages buffered per conversation for `?from=latest` reads
+# (chats.recent), and the total size of the buffers per process; 0
+# disables them.
+CHATS_RECENT_MESSAGES = 50
+CHATS_RECENT_MESSAGES_CACHE_BYTES = 16 * 1024 * 1024
+
+# `default` holds per-process state. `responses` is the second tier of the
+# response cache (chats.responses), a directory shared by the processes of
+# the host; its entries are never invalidated, only left to expire. The
+# entries are pickled, so it is only enabled when CHATS_RESPONSE_CACHE_DIR
+# names a directory; that directory must be accessible to the server's
+# user alone, and is created that way when missing.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+if os.environ.get('CHATS_RESPONSE_CACHE_DIR'):
+    CACHES['responses'] = {
+        'BACKEND': 'chats.responses.FileResponseCache',
+        'LOCATION': os.environ['CHATS_RESPONSE_CACHE_DIR'],
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 10000, 'CULL_INTERVAL': 60},
+    }
+
+# Size of the per-process first tier of the response cache (0 disables
+# the cache), the alias of its shared second tier (None, or an alias
+# missing from CACHES, for none), and the seconds each process keeps the
+# shared epoch before reading it again.
+CHATS_RESPONSE_CACHE_BYTES = 16 * 1024 * 1024
+CHATS_RESPONSE_CACHE_ALIAS = 'responses'
+CHATS_RESPONSE_CACHE_EPOCH_TTL = 5